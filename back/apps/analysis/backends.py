@@ -0,0 +1,149 @@
+# back/apps/analysis/backends.py
+"""
+可插拔的 embedding 推理后端。
+
+settings.EMBEDDING_BACKEND:
+    'sentence_transformers' (默认): PyTorch SentenceTransformer，与旧实现一致。
+    'onnx': ONNX Runtime (CPU) + HuggingFace tokenizers，不导入 torch，导入与推理都更轻。
+            settings.EMBEDDING_ONNX_QUANTIZED 为 True 时使用 int8 动态量化后的模型。
+            模型文件由 export_onnx_model 命令准备。
+
+各后端对同一模型 (paraphrase-multilingual-mpnet-base-v2) 输出相同维度的向量。
+数值上与 PyTorch 基本一致的后端使用相同的 embedding_model_version；int8 量化的向量有可见偏差，
+使用带后缀的版本号，避免与 float 向量混用 (内容哈希缓存也按版本号隔离)。
+"""
+import logging
+import os
+from typing import Optional
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ('sentence_transformers', 'onnx')
+ONNX_FP32_FILE = 'model.onnx'
+ONNX_INT8_FILE = 'model_int8.onnx'
+
+
+class EmbeddingBackend:
+    """后端基类。encode 的签名与 SentenceTransformer.encode 兼容 (返回 numpy 数组)。"""
+    name = None
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.dimension = None
+
+    @property
+    def model_version(self) -> str:
+        return model_version_for(self.name, self.model_name)
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        raise NotImplementedError
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    name = 'sentence_transformers'
+
+    def load(self) -> None:
+        # 延迟导入：sentence_transformers/torch 的导入本身就需要数秒和数百 MB 内存
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(self.model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    ONNX Runtime 推理：tokenizer -> 模型输出的 token 向量 -> 按 attention mask 做均值池化，
+    与该模型在 sentence-transformers 中的 Pooling 配置 (mean pooling，不归一化) 一致。
+    """
+    name = 'onnx'
+
+    def __init__(self, model_name: str, quantized: Optional[bool] = None):
+        super().__init__(model_name)
+        self.quantized = get_onnx_quantized() if quantized is None else quantized
+
+    @property
+    def model_version(self) -> str:
+        return model_version_for(self.name, self.model_name, quantized=self.quantized)
+
+    def load(self) -> None:
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_dir = get_onnx_model_dir(self.model_name)
+        model_path = os.path.join(model_dir, ONNX_INT8_FILE if self.quantized else ONNX_FP32_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found at {model_path}. Run 'manage.py export_onnx_model' first.")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=getattr(settings, 'EMBEDDING_MAX_SEQ_LENGTH', 128))
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        threads = getattr(settings, 'EMBEDDING_ONNX_THREADS', 0)
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dimension = self.encode(['dimension probe']).shape[1]
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size=batch_size)[0]
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            outputs.append(summed / np.clip(mask.sum(axis=1), 1e-9, None))
+        if not outputs:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        return np.vstack(outputs).astype(np.float32)
+
+
+def get_backend_name() -> str:
+    name = getattr(settings, 'EMBEDDING_BACKEND', 'sentence_transformers')
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Invalid EMBEDDING_BACKEND: {name}")
+    return name
+
+
+def get_onnx_quantized() -> bool:
+    return getattr(settings, 'EMBEDDING_ONNX_QUANTIZED', False)
+
+
+def get_onnx_model_dir(model_name: str) -> str:
+    model_dir = getattr(settings, 'EMBEDDING_ONNX_MODEL_DIR', None)
+    if model_dir:
+        return str(model_dir)
+    return os.path.join(str(settings.BASE_DIR), 'models', model_name)
+
+
+def model_version_for(backend_name: str, model_name: str, quantized: Optional[bool] = None) -> str:
+    """
+    计算写入 embedding_model_version 的版本号 (无需加载模型)。
+    只有 int8 量化会改变向量数值，需要区分版本。
+    """
+    if backend_name == 'onnx' and (get_onnx_quantized() if quantized is None else quantized):
+        return f"{model_name}+onnx-int8"
+    return model_name
+
+
+def create_backend(model_name: str, backend_name: Optional[str] = None, **kwargs) -> EmbeddingBackend:
+    """按名称创建 (未加载的) 后端实例。"""
+    backend_name = backend_name or get_backend_name()
+    if backend_name == 'onnx':
+        return OnnxBackend(model_name, **kwargs)
+    return SentenceTransformerBackend(model_name)
@@ -0,0 +1,225 @@
+# back/apps/analysis/batching.py
+"""
+Embedding 微批处理缓冲区。
+
+单个版本的 embedding 请求 (post_save 信号、批量导入、TestCaseViewSet.update 等) 不再各自派发
+一个 Celery 任务、各自调用一次 model.encode，而是先把版本 ID 写入 Redis 中的待处理集合，
+在一个有界窗口 (时间或数量) 内合并，由 flush_embedding_batch_task 一次性 encode 并 bulk_update。
+
+在事务中触发的请求 (post_save 信号) 先记入当前事务的派发缓冲区，同一事务内重复保存的版本只记一次，
+事务提交后统一派发 (request_version_embeddings)：任务不会在提交前读到旧数据，事务回滚则不派发。
+
+取出的版本 ID 不会直接从 Redis 删除，而是原子地移入处理中集合 (有序集合，分数为取出时间)：
+写回成功后才移除 (ack_processing_versions)，失败时放回待处理集合 (requeue_processing_versions)。
+worker 崩溃遗留在处理中集合的版本超过 EMBEDDING_MICRO_BATCH_PROCESSING_TIMEOUT 秒后，
+由下一次 flush (包括定时派发的 flush) 放回待处理集合。
+"""
+import logging
+import time
+from typing import Iterable, List, Optional, Set
+from django.conf import settings
+from django.db import transaction
+from tcms.transactions import get_commit_buffer
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'tcms:analysis:embedding:pending'
+PROCESSING_KEY = 'tcms:analysis:embedding:processing'
+FLUSH_SCHEDULED_KEY = 'tcms:analysis:embedding:flush_scheduled'
+# 事务派发缓冲区登记在数据库连接对象上 (Django 的事务状态同样按连接保存，见 tcms.transactions)
+COMMIT_BUFFER_ATTR = '_tcms_embedding_commit_buffer'
+
+_redis_client = None
+
+# SPOP 与 ZADD 在同一个脚本中执行：取出的 ID 要么仍在待处理集合，要么已在处理中集合
+_POP_TO_PROCESSING_SCRIPT = """
+local members = redis.call('SPOP', KEYS[1], ARGV[1])
+for _, member in ipairs(members) do
+    redis.call('ZADD', KEYS[2], ARGV[2], member)
+end
+return members
+"""
+# 把处理中集合里取出时间早于 ARGV[1] 的 ID 放回待处理集合
+_REQUEUE_STALE_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, member in ipairs(members) do
+    redis.call('SADD', KEYS[1], member)
+    redis.call('ZREM', KEYS[2], member)
+end
+return #members
+"""
+
+
+def get_redis():
+    """获取 (并缓存) 用于微批缓冲区的 Redis 连接，默认复用 Celery broker。"""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        url = getattr(settings, 'EMBEDDING_MICRO_BATCH_REDIS_URL', None) or settings.CELERY_BROKER_URL
+        _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'EMBEDDING_MICRO_BATCH_ENABLED', True)
+
+
+def get_batch_size() -> int:
+    return getattr(settings, 'EMBEDDING_MICRO_BATCH_SIZE', 64)
+
+
+def get_window_seconds() -> float:
+    return getattr(settings, 'EMBEDDING_MICRO_BATCH_WINDOW_MS', 2000) / 1000.0
+
+
+def get_processing_timeout() -> int:
+    return getattr(settings, 'EMBEDDING_MICRO_BATCH_PROCESSING_TIMEOUT', 600)
+
+
+def add_pending_versions(version_ids: Iterable[int]) -> int:
+    """把版本 ID 加入待处理集合 (集合自动去重)，返回当前待处理数量。"""
+    version_ids = list(version_ids)
+    if not version_ids:
+        return pending_count()
+    pipe = get_redis().pipeline()
+    pipe.sadd(PENDING_KEY, *version_ids)
+    pipe.scard(PENDING_KEY)
+    _, count = pipe.execute()
+    return count
+
+
+def pop_pending_versions(max_count: int) -> List[int]:
+    """
+    原子地取出最多 max_count 个待处理的版本 ID，并移入处理中集合。
+    调用方处理成功后调用 ack_processing_versions，失败时调用 requeue_processing_versions。
+    """
+    members = get_redis().eval(_POP_TO_PROCESSING_SCRIPT, 2, PENDING_KEY, PROCESSING_KEY,
+                               max_count, time.time()) or []
+    return [int(member) for member in members]
+
+
+def ack_processing_versions(version_ids: Iterable[int]) -> None:
+    """embedding 已写回，从处理中集合移除。"""
+    version_ids = list(version_ids)
+    if version_ids:
+        get_redis().zrem(PROCESSING_KEY, *version_ids)
+
+
+def requeue_processing_versions(version_ids: Iterable[int]) -> None:
+    """处理失败，把版本 ID 从处理中集合放回待处理集合 (MULTI 中执行，不会丢失)。"""
+    version_ids = list(version_ids)
+    if not version_ids:
+        return
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.sadd(PENDING_KEY, *version_ids)
+    pipe.zrem(PROCESSING_KEY, *version_ids)
+    pipe.execute()
+
+
+def requeue_stale_versions(timeout: Optional[int] = None) -> int:
+    """把处理中超过 timeout 秒 (例如 worker 崩溃) 的版本 ID 放回待处理集合，返回数量。"""
+    if timeout is None:
+        timeout = get_processing_timeout()
+    return get_redis().eval(_REQUEUE_STALE_SCRIPT, 2, PENDING_KEY, PROCESSING_KEY, time.time() - timeout)
+
+
+def processing_count() -> int:
+    return get_redis().zcard(PROCESSING_KEY)
+
+
+def pending_count() -> int:
+    return get_redis().scard(PENDING_KEY)
+
+
+def mark_flush_scheduled(window_seconds: Optional[float] = None) -> bool:
+    """
+    尝试占用"已安排 flush"标记。返回 True 表示调用方负责派发 flush 任务。
+    标记带过期时间，即使 flush 任务丢失，下一次请求也能重新安排。
+    """
+    if window_seconds is None:
+        window_seconds = get_window_seconds()
+    # 过期时间留出余量，覆盖 countdown 与任务排队的延迟
+    expire_ms = int(window_seconds * 1000) + 30000
+    return bool(get_redis().set(FLUSH_SCHEDULED_KEY, 1, nx=True, px=expire_ms))
+
+
+def clear_flush_scheduled() -> None:
+    get_redis().delete(FLUSH_SCHEDULED_KEY)
+
+
+def enqueue_version_embedding(version_id: int) -> None:
+    """请求为单个版本生成 embedding (立即进入缓冲区，不等待事务提交)。"""
+    enqueue_version_embeddings([version_id])
+
+
+def enqueue_version_embeddings(version_ids: Iterable[int]) -> None:
+    """
+    请求为一组版本生成 embedding。
+
+    开启微批时写入缓冲区：一次请求多个版本、或缓冲区达到批大小时立即 flush，否则在窗口到期后 flush。
+    未开启微批或 Redis 不可用时，单个版本派发单版本任务，多个版本派发一个批量任务 (走交互队列)。
+    """
+    from .queues import EMBEDDING_QUEUE, PRIORITY_INTERACTIVE
+    from .tasks import flush_embedding_batch_task, generate_embeddings_batch_task, generate_version_embedding_task
+
+    version_ids = sorted(set(version_ids))
+    if not version_ids:
+        return
+
+    def dispatch_directly():
+        if len(version_ids) == 1:
+            generate_version_embedding_task.delay(version_ids[0])
+        else:
+            generate_embeddings_batch_task.apply_async(
+                args=[version_ids], queue=EMBEDDING_QUEUE, priority=PRIORITY_INTERACTIVE
+            )
+
+    if not is_enabled():
+        dispatch_directly()
+        return
+
+    try:
+        pending = add_pending_versions(version_ids)
+    except Exception as e:
+        logger.warning(f"Micro-batch buffer unavailable ({e}), dispatching embedding task directly for Versions {version_ids}.")
+        dispatch_directly()
+        return
+
+    if pending >= get_batch_size() or len(version_ids) > 1:
+        flush_embedding_batch_task.delay()
+    else:
+        window_seconds = get_window_seconds()
+        if mark_flush_scheduled(window_seconds):
+            flush_embedding_batch_task.apply_async(countdown=window_seconds)
+
+
+class _CommitBuffer:
+    """一个事务内请求 embedding 的版本 ID，提交时一次性派发。"""
+
+    def __init__(self):
+        self.version_ids: Set[int] = set()
+
+    def flush(self) -> None:
+        version_ids, self.version_ids = self.version_ids, set()
+        try:
+            enqueue_version_embeddings(version_ids)
+            logger.info(f"Embedding generation enqueued on commit for {len(version_ids)} version(s).")
+        except Exception as e:
+            # 例如 Celery broker 不可达；事务已提交，不能再影响请求
+            logger.error(f"Failed to dispatch embedding for Versions {sorted(version_ids)} on commit: {e}")
+
+
+def request_version_embeddings(version_ids: Iterable[int], using: Optional[str] = None) -> None:
+    """
+    在当前事务提交后请求生成 embedding。同一事务内多次请求的版本去重后只派发一次，
+    多个版本合并为一个批次。不在事务中 (autocommit) 时立即派发。
+    """
+    version_ids = set(version_ids)
+    if not version_ids:
+        return
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        enqueue_version_embeddings(version_ids)
+        return
+
+    get_commit_buffer(COMMIT_BUFFER_ATTR, _CommitBuffer, using=using).version_ids.update(version_ids)
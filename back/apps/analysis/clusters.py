@@ -0,0 +1,277 @@
+# back/apps/analysis/clusters.py
+"""
+重复用例簇的物化。
+
+把 similarity_score >= settings.DUPLICATE_CLUSTER_THRESHOLD 且未被标记为 ignored 的配对视为无向图的边，
+用并查集 (union-find) 求连通分量，每个分量 (至少两个版本) 保存为一个 DuplicateCluster。
+评审页面按簇加载 (一簇一行)，而不是逐个翻阅簇内全部配对。
+
+两种维护方式：
+    rebuild_clusters(project_id)            - 全量重建项目内的簇 (全量重复扫描结束后调用)
+    update_clusters_for_versions(ids)       - 增量：只重新计算包含这些版本的连通分量
+                                              (写入新配对、撤销配对或评审为 ignored 后调用)
+重新计算时尽量复用与新分量重叠最多的旧簇行，保留其 id 与评审状态。
+"""
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from apps.testcases.models import TestCaseVersion
+from .models import PotentialDuplicatePair, DuplicateCluster, DuplicateClusterMember
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock 的键空间，避免并发的重复检测任务同时改写同一批簇
+CLUSTER_LOCK_NAMESPACE = 7014
+
+Edge = Tuple[int, int, float]
+
+
+class UnionFind:
+    """带路径压缩和按大小合并的并查集。"""
+
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+        self.size: Dict[int, int] = {}
+
+    def find(self, node: int) -> int:
+        parent = self.parent.setdefault(node, node)
+        if parent == node:
+            self.size.setdefault(node, 1)
+            return node
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size.pop(root_b)
+
+    def components(self) -> List[Set[int]]:
+        groups = defaultdict(set)
+        for node in self.parent:
+            groups[self.find(node)].add(node)
+        return list(groups.values())
+
+
+def get_cluster_threshold() -> float:
+    return getattr(settings, 'DUPLICATE_CLUSTER_THRESHOLD', 0.90)
+
+
+def cluster_edges_queryset(threshold: Optional[float] = None):
+    """参与聚类的配对：相似度达到阈值且未被评审为非重复。"""
+    return PotentialDuplicatePair.objects.filter(
+        similarity_score__gte=get_cluster_threshold() if threshold is None else threshold
+    ).exclude(status='ignored')
+
+
+def connected_components(edges: Iterable[Edge]) -> List[Set[int]]:
+    uf = UnionFind()
+    for version_a, version_b, _ in edges:
+        uf.union(version_a, version_b)
+    return [component for component in uf.components() if len(component) > 1]
+
+
+def collect_component_edges(seed_ids: Iterable[int], threshold: Optional[float] = None) -> List[Edge]:
+    """
+    从 seed_ids 出发按边逐层扩展，返回这些版本所在连通分量内的全部边。
+    每层一次查询，查询次数等于分量的直径，与项目内配对总数无关。
+    """
+    edges: Dict[Tuple[int, int], float] = {}
+    visited: Set[int] = set()
+    frontier = set(seed_ids)
+    queryset = cluster_edges_queryset(threshold)
+    while frontier:
+        visited |= frontier
+        rows = queryset.filter(
+            Q(version_a_id__in=frontier) | Q(version_b_id__in=frontier)
+        ).values_list('version_a_id', 'version_b_id', 'similarity_score')
+        next_frontier = set()
+        for version_a, version_b, score in rows:
+            edges[(version_a, version_b)] = score
+            for node in (version_a, version_b):
+                if node not in visited:
+                    next_frontier.add(node)
+        frontier = next_frontier
+    return [(version_a, version_b, score) for (version_a, version_b), score in edges.items()]
+
+
+def choose_representative(component: Set[int], edges: List[Edge], active_ids: Set[int]) -> int:
+    """代表版本：优先活动版本，其次簇内相似度之和 (加权度) 最高，最后取 id 最小者。"""
+    weighted_degree = defaultdict(float)
+    for version_a, version_b, score in edges:
+        weighted_degree[version_a] += score
+        weighted_degree[version_b] += score
+    return min(component, key=lambda node: (node not in active_ids, -weighted_degree[node], node))
+
+
+def _lock_clusters(project_id: Optional[int]) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [CLUSTER_LOCK_NAMESPACE, project_id or 0])
+
+
+def _save_components(components: List[Set[int]], edges: List[Edge],
+                     old_clusters: Dict[int, Set[int]]) -> dict:
+    """
+    把连通分量写入 DuplicateCluster。old_clusters 为可能受影响的旧簇 {cluster_id: 成员集合}：
+    每个新分量复用与其重叠最多且尚未被复用的旧簇，其余旧簇删除。
+    """
+    all_nodes = set().union(*components) if components else set()
+    version_rows = TestCaseVersion.objects.filter(pk__in=all_nodes).values_list('id', 'project_id', 'is_active')
+    project_of = {}
+    active_ids = set()
+    for version_id, project_id, is_active in version_rows:
+        project_of[version_id] = project_id
+        if is_active:
+            active_ids.add(version_id)
+
+    edges_of = defaultdict(list)
+    node_to_component = {}
+    for index, component in enumerate(components):
+        for node in component:
+            node_to_component[node] = index
+    for edge in edges:
+        index = node_to_component.get(edge[0])
+        if index is not None:
+            edges_of[index].append(edge)
+
+    reused = set()
+    stats = {'created': 0, 'updated': 0, 'deleted': 0}
+    members_to_create = []
+    kept_cluster_ids = []
+    for index, component in enumerate(components):
+        component_edges = edges_of[index]
+        representative = choose_representative(component, component_edges, active_ids)
+        to_representative = {}
+        for version_a, version_b, score in component_edges:
+            if version_a == representative:
+                to_representative[version_b] = score
+            elif version_b == representative:
+                to_representative[version_a] = score
+        fields = {
+            'project_id': project_of.get(representative),
+            'representative_id': representative,
+            'size': len(component),
+            'max_similarity': max((score for _, _, score in component_edges), default=0.0),
+        }
+
+        overlaps = sorted(
+            ((len(members & component), cluster_id) for cluster_id, members in old_clusters.items()
+             if cluster_id not in reused and members & component),
+            reverse=True,
+        )
+        if overlaps:
+            cluster_id = overlaps[0][1]
+            reused.add(cluster_id)
+            DuplicateCluster.objects.filter(pk=cluster_id).update(updated_at=timezone.now(), **fields)
+            stats['updated'] += 1
+        else:
+            cluster_id = DuplicateCluster.objects.create(**fields).pk
+            stats['created'] += 1
+        kept_cluster_ids.append(cluster_id)
+        members_to_create.extend(
+            DuplicateClusterMember(
+                cluster_id=cluster_id,
+                version_id=node,
+                similarity_to_representative=1.0 if node == representative else to_representative.get(node),
+            )
+            for node in component
+        )
+
+    stale_ids = set(old_clusters) - reused
+    if stale_ids:
+        stats['deleted'] = DuplicateCluster.objects.filter(pk__in=stale_ids).delete()[1].get(
+            DuplicateCluster._meta.label, 0
+        )
+    # 成员整体替换：先删除受影响版本与被复用簇的旧成员，再批量插入
+    DuplicateClusterMember.objects.filter(Q(cluster_id__in=kept_cluster_ids) | Q(version_id__in=all_nodes)).delete()
+    DuplicateClusterMember.objects.bulk_create(members_to_create, batch_size=1000)
+    return stats
+
+
+def rebuild_clusters(project_id: Optional[int] = None, threshold: Optional[float] = None) -> dict:
+    """
+    全量重建项目内的簇 (project_id 为 None 时重建全部项目)。
+
+    Returns:
+        {'clusters', 'versions', 'created', 'updated', 'deleted'}
+    """
+    edges_queryset = cluster_edges_queryset(threshold)
+    old_queryset = DuplicateClusterMember.objects.all()
+    if project_id is not None:
+        edges_queryset = edges_queryset.filter(version_a__project_id=project_id)
+        old_queryset = old_queryset.filter(cluster__project_id=project_id)
+
+    with transaction.atomic():
+        _lock_clusters(project_id)
+        edges = list(edges_queryset.values_list('version_a_id', 'version_b_id', 'similarity_score').iterator())
+        components = connected_components(edges)
+        old_clusters = defaultdict(set)
+        for cluster_id, version_id in old_queryset.values_list('cluster_id', 'version_id'):
+            old_clusters[cluster_id].add(version_id)
+        # 已没有成员的空簇也一并清理
+        empty = DuplicateCluster.objects.filter(memberships__isnull=True)
+        if project_id is not None:
+            empty = empty.filter(project_id=project_id)
+        for cluster_id in empty.values_list('id', flat=True):
+            old_clusters.setdefault(cluster_id, set())
+        stats = _save_components(components, edges, dict(old_clusters))
+
+    stats['clusters'] = len(components)
+    stats['versions'] = sum(len(component) for component in components)
+    logger.info(f"Rebuilt duplicate clusters for project {project_id}: {stats}")
+    return stats
+
+
+def update_clusters_for_versions(version_ids: Iterable[int], threshold: Optional[float] = None) -> dict:
+    """
+    增量更新：重新计算包含 version_ids 的连通分量 (以及这些版本当前所在旧簇的其他成员，
+    以便处理配对被撤销/忽略后簇的拆分)，只改写受影响的簇。
+    """
+    version_ids = set(version_ids)
+    if not version_ids:
+        return {'created': 0, 'updated': 0, 'deleted': 0}
+
+    with transaction.atomic():
+        project_ids = set(
+            TestCaseVersion.objects.filter(pk__in=version_ids).values_list('project_id', flat=True)
+        )
+        for project_id in sorted(project_ids, key=lambda value: value or 0):
+            _lock_clusters(project_id)
+
+        old_cluster_ids = set(
+            DuplicateClusterMember.objects.filter(version_id__in=version_ids).values_list('cluster_id', flat=True)
+        )
+        old_clusters = defaultdict(set)
+        for cluster_id, version_id in DuplicateClusterMember.objects.filter(
+            cluster_id__in=old_cluster_ids
+        ).values_list('cluster_id', 'version_id'):
+            old_clusters[cluster_id].add(version_id)
+
+        seeds = version_ids.union(*old_clusters.values())
+        edges = collect_component_edges(seeds, threshold)
+        components = connected_components(edges)
+        # 扩展过程中可能连到其他旧簇 (两个簇因新配对合并)，它们也要参与复用/删除
+        reached = set().union(*components) if components else set()
+        merged_cluster_ids = set(
+            DuplicateClusterMember.objects.filter(version_id__in=reached - seeds).values_list('cluster_id', flat=True)
+        ) - old_cluster_ids
+        for cluster_id, version_id in DuplicateClusterMember.objects.filter(
+            cluster_id__in=merged_cluster_ids
+        ).values_list('cluster_id', 'version_id'):
+            old_clusters[cluster_id].add(version_id)
+        stats = _save_components(components, edges, dict(old_clusters))
+
+    logger.debug(f"Updated duplicate clusters for {len(version_ids)} versions: {stats}")
+    return stats
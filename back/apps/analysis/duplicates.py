@@ -0,0 +1,419 @@
+# back/apps/analysis/duplicates.py
+"""
+项目级批量重复检测引擎。
+
+与逐版本派发 find_and_store_duplicate_pairs_task (N 个 Celery 消息、N 次 HNSW 查询、
+N×limit 次 update_or_create，且每一对会被找到两次) 不同，这里把一个项目的全部 embedding
+读入一个 NumPy 矩阵，分块计算余弦相似度 top-k，对称的配对去重后一次性批量写入。
+
+增量模式以上一次完成扫描的开始时间 (减去安全余量) 为水位线，只把之后 embedding 新增或变化的版本拿去
+查询 HNSW 索引，耗时与当天的编辑量成正比，而不是与语料规模成正比。embedding_updated_at 在写入语句中
+取数据库时钟，但要到事务提交后才可见：提交前开始的扫描看不到该版本，余量保证下一次扫描仍会覆盖它
+(配对以 upsert 写入，余量内重复比较的版本不会产生重复数据)。
+全量扫描结束后撤销本次没有再检出的待处理配对 (重新生成 embedding 后不再相似的版本)。
+embedding 模型切换或回滚 (model_migration.py) 一次替换全部向量，但 embedding_updated_at 沿用影子向量的生成时间，
+因此之后的第一次扫描改为全量扫描，用新向量重新计算配对分数与簇。
+
+向量检索之前先用 shingle MinHash/LSH (shingles.py) 以线性时间找出完全相同/几乎相同的版本：
+每组只让代表版本参与向量检索，其余成员直接与代表版本配对。增量模式只为变化的版本补算签名，
+并按其哈希与 LSH 分段键 (索引列) 取候选版本分组，不对整个项目重新分组。
+
+扫描结束后同步维护重复簇 (clusters.py)：全量扫描重建项目内的簇，增量扫描只重算受影响的簇。
+"""
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from apps.testcases.models import TestCaseVersion
+from .models import PotentialDuplicatePair, DuplicateScanRun, DuplicateClusterMember, EmbeddingModelMigration
+from .utils import similar_versions_queryset, hnsw_search_params, ef_search_for_limit
+from .clusters import rebuild_clusters, update_clusters_for_versions
+from .shingles import ensure_text_signatures, find_candidate_rows, find_near_duplicate_groups, is_prefilter_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 512
+DEFAULT_WRITE_BATCH_SIZE = 5000
+
+
+def embedded_versions_queryset(project_id: Optional[int] = None, active_only: bool = False):
+    """参与重复检测的版本：已生成 embedding，可按项目和活动状态限定。"""
+    queryset = TestCaseVersion.objects.filter(embedding__isnull=False)
+    if project_id is not None:
+        queryset = queryset.filter(project_id=project_id)
+    if active_only:
+        queryset = queryset.filter(is_active=True)
+    return queryset
+
+
+def load_embedding_matrix(project_id: Optional[int] = None, active_only: bool = False,
+                          chunk_size: int = 2000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    以流式方式读取 embedding，返回 (版本 ID 数组, 已 L2 归一化的 float32 矩阵)。
+    归一化后矩阵乘积即为余弦相似度。
+    """
+    queryset = embedded_versions_queryset(project_id, active_only)
+
+    ids = []
+    rows = []
+    for version_id, embedding in queryset.order_by('id').values_list('id', 'embedding').iterator(chunk_size=chunk_size):
+        ids.append(version_id)
+        rows.append(np.asarray(embedding, dtype=np.float32))
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+    matrix = np.vstack(rows)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return np.asarray(ids, dtype=np.int64), matrix
+
+
+def iter_topk_pairs(ids: np.ndarray, matrix: np.ndarray, similarity_threshold: float,
+                    limit_per_source: int, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterable[Tuple[int, int, float]]:
+    """
+    分块计算每个版本的 top-k 相似版本 (不含自身，且相似度高于阈值，与 find_similar_testcases 一致)。
+    每次只计算 block_size × N 的相似度子矩阵，内存占用与语料规模线性相关。
+
+    Yields:
+        (source_id, neighbour_id, similarity)，同一对可能从两端各产出一次，由调用方去重。
+    """
+    total = len(ids)
+    if total < 2:
+        return
+    k = min(limit_per_source, total - 1)
+    for start in range(0, total, block_size):
+        end = min(start + block_size, total)
+        similarities = matrix[start:end] @ matrix.T
+        # 排除自身
+        similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+        # argpartition 取每行 top-k (无序)，比全排序快得多
+        top_idx = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_sim = np.take_along_axis(similarities, top_idx, axis=1)
+        rows, cols = np.nonzero(top_sim > similarity_threshold)
+        for row, col in zip(rows, cols):
+            # 浮点误差可能使相似度略大于 1
+            yield int(ids[start + row]), int(ids[top_idx[row, col]]), min(float(top_sim[row, col]), 1.0)
+
+
+def collect_unique_pairs(pair_iter: Iterable[Tuple[int, int, float]]) -> Dict[Tuple[int, int], float]:
+    """把 (a, b) 规范化为 version_a.id < version_b.id 并去重，返回 {(a, b): similarity}。"""
+    pairs = {}
+    for source_id, neighbour_id, similarity in pair_iter:
+        key = (source_id, neighbour_id) if source_id < neighbour_id else (neighbour_id, source_id)
+        if similarity > pairs.get(key, -1.0):
+            pairs[key] = similarity
+    return pairs
+
+
+def load_near_duplicate_groups(project_id: Optional[int], active_only: bool = False) -> List[List[int]]:
+    """补齐缺失的文本签名后，返回项目内的近重复分组 (每组第一个为代表版本)。全量扫描使用。"""
+    queryset = embedded_versions_queryset(project_id, active_only)
+    ensure_text_signatures(queryset)
+    return find_near_duplicate_groups(
+        queryset.order_by('id').values_list('id', 'text_hash', 'text_minhash').iterator(chunk_size=5000)
+    )
+
+
+def shingle_prefilter(ids: np.ndarray, matrix: np.ndarray, project_id: Optional[int], similarity_threshold: float,
+                      active_only: bool = False) -> Tuple[np.ndarray, np.ndarray, Dict[Tuple[int, int], float]]:
+    """
+    批量模式的预过滤：近重复组内的非代表版本直接与代表版本配对 (分数取二者的余弦相似度)，
+    并从矩阵中移除，不再参与 top-k 计算。
+
+    Returns:
+        (保留的版本 ID, 保留的矩阵行, 预过滤得到的配对)
+    """
+    if not is_prefilter_enabled() or len(ids) < 2:
+        return ids, matrix, {}
+    index_of = {int(version_id): index for index, version_id in enumerate(ids)}
+    keep = np.ones(len(ids), dtype=bool)
+    pairs = {}
+    for group in load_near_duplicate_groups(project_id, active_only):
+        # 读取矩阵之后才生成 embedding 的版本不在矩阵中
+        members = [version_id for version_id in group if version_id in index_of]
+        if len(members) < 2:
+            continue
+        representative = matrix[index_of[members[0]]]
+        for member in members[1:]:
+            similarity = min(float(representative @ matrix[index_of[member]]), 1.0)
+            if similarity > similarity_threshold:
+                pairs[(members[0], member)] = similarity
+                keep[index_of[member]] = False
+    return ids[keep], matrix[keep], pairs
+
+
+def store_pairs(pairs: Dict[Tuple[int, int], float], batch_size: int = DEFAULT_WRITE_BATCH_SIZE) -> int:
+    """
+    批量 upsert 配对 (INSERT ... ON CONFLICT (version_a, version_b) DO UPDATE)。
+    只更新相似度分数，已评审 (confirmed/ignored) 的状态保持不变。返回写入 (新建 + 更新) 的数量。
+    """
+    created, updated = PotentialDuplicatePair.objects.bulk_upsert(
+        ((a, b, similarity) for (a, b), similarity in pairs.items()),
+        batch_size=batch_size,
+    )
+    return created + updated
+
+
+def find_duplicates_bulk(project_id: Optional[int] = None, similarity_threshold: float = 0.90,
+                         limit_per_source: int = 50, active_only: bool = False,
+                         block_size: int = DEFAULT_BLOCK_SIZE) -> dict:
+    """
+    对单个项目 (project_id 为 None 时对全部版本) 执行批量重复检测并写入结果。
+
+    Returns:
+        统计信息: versions, pairs, load_seconds, compute_seconds, write_seconds。
+    """
+    stats = {'project_id': project_id, 'versions': 0, 'pairs': 0}
+
+    start_time = time.perf_counter()
+    ids, matrix = load_embedding_matrix(project_id=project_id, active_only=active_only)
+    stats['versions'] = len(ids)
+    stats['load_seconds'] = round(time.perf_counter() - start_time, 3)
+
+    start_time = time.perf_counter()
+    ids, matrix, prefiltered_pairs = shingle_prefilter(ids, matrix, project_id, similarity_threshold, active_only)
+    stats['prefiltered'] = len(prefiltered_pairs)
+    stats['prefilter_seconds'] = round(time.perf_counter() - start_time, 3)
+
+    start_time = time.perf_counter()
+    pairs = collect_unique_pairs(
+        iter_topk_pairs(ids, matrix, similarity_threshold, limit_per_source, block_size=block_size)
+    )
+    pairs.update(prefiltered_pairs)
+    stats['compute_seconds'] = round(time.perf_counter() - start_time, 3)
+
+    start_time = time.perf_counter()
+    stats['pairs'] = store_pairs(pairs)
+    stats['write_seconds'] = round(time.perf_counter() - start_time, 3)
+
+    logger.info(
+        f"Bulk duplicate detection for project {project_id}: {stats['versions']} versions, {stats['pairs']} pairs, "
+        f"{stats['prefiltered']} near-exact versions skipped by shingle prefilter "
+        f"(load {stats['load_seconds']}s, prefilter {stats['prefilter_seconds']}s, compute {stats['compute_seconds']}s, write {stats['write_seconds']}s)."
+    )
+    return stats
+
+
+def get_projects_with_embeddings() -> List[int]:
+    """返回存在已生成 embedding 的版本的项目 ID 列表。"""
+    return list(
+        TestCaseVersion.objects.filter(embedding__isnull=False, project__isnull=False)
+        .values_list('project_id', flat=True)
+        .order_by('project_id')
+        .distinct()
+    )
+
+
+def get_watermark_margin() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'DUPLICATE_SCAN_WATERMARK_MARGIN_SECONDS', 300))
+
+
+def get_last_model_switch():
+    """最近一次 embedding 模型切换 (cutover) 或回滚的时间，没有时返回 None。"""
+    times = EmbeddingModelMigration.objects.aggregate(
+        cutover=Max('cutover_at'),
+        rollback=Max('finished_at', filter=Q(status='rolled_back')),
+    )
+    return max((value for value in times.values() if value is not None), default=None)
+
+
+def get_last_completed_scan(project_id: Optional[int]) -> Optional[DuplicateScanRun]:
+    return DuplicateScanRun.objects.filter(project_id=project_id, status='completed').order_by('-started_at').first()
+
+
+def retire_stale_pairs(project_id: Optional[int], changed_version_ids: List[int]) -> int:
+    """
+    撤销失效的待处理配对：成员被重新生成 embedding (内容已变化，旧分数不再可信)，
+    或成员的 embedding 已被清除。被删除版本的配对由外键 CASCADE 自动删除。
+    已评审 (confirmed/ignored) 的配对保留，若仍然相似，会在本次扫描中刷新分数。
+    """
+    stale = Q(version_a__embedding__isnull=True) | Q(version_b__embedding__isnull=True)
+    if changed_version_ids:
+        stale |= Q(version_a_id__in=changed_version_ids) | Q(version_b_id__in=changed_version_ids)
+    queryset = PotentialDuplicatePair.objects.filter(stale, status='pending')
+    if project_id is not None:
+        queryset = queryset.filter(version_a__project_id=project_id)
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+def retire_unseen_pairs(project_id: Optional[int], scan_started_at) -> int:
+    """
+    全量扫描之后撤销本次没有再检出的待处理配对 (last_seen_at 早于扫描开始时间)：成员的 embedding 已被清除、
+    重新生成后不再相似，或 (active_only 扫描时) 成员已停用。扫描期间由逐版本任务写入的配对 last_seen_at 更晚，不受影响。
+    """
+    queryset = PotentialDuplicatePair.objects.filter(status='pending', last_seen_at__lt=scan_started_at)
+    if project_id is not None:
+        queryset = queryset.filter(version_a__project_id=project_id)
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+def query_neighbours(version_id: int, embedding, project_id: Optional[int], similarity_threshold: float,
+                     limit: int, active_only: bool = False) -> List[Tuple[int, float]]:
+    """通过 HNSW 索引查询单个版本在项目内的近邻，返回 [(neighbour_id, similarity)]。"""
+    queryset = similar_versions_queryset(
+        embedding,
+        similarity_threshold=similarity_threshold,
+        project_id=project_id,
+        active_only=active_only,
+        exclude_id=version_id,
+    )
+    with hnsw_search_params(ef_search=ef_search_for_limit(limit)):
+        neighbours = list(queryset.values_list('id', 'distance')[:limit])
+    return [(neighbour_id, 1.0 - distance) for neighbour_id, distance in neighbours]
+
+
+def _cosine_similarity(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denominator = float(np.linalg.norm(a) * np.linalg.norm(b)) or 1.0
+    return min(float(a @ b) / denominator, 1.0)
+
+
+def prefilter_changed_versions(changed_embeddings: Dict[int, object], project_id: Optional[int],
+                               similarity_threshold: float,
+                               active_only: bool = False) -> Tuple[Dict[Tuple[int, int], float], set]:
+    """
+    增量模式的预过滤：变化的版本若与项目内其他版本近重复，直接与组内另一成员配对。
+    非代表版本不再查询 HNSW 索引；代表版本仍然查询，以找到整组的语义近邻。
+    只为变化的版本补算签名，候选版本按哈希与 LSH 分段键从索引中取出，开销与变化量成正比。
+
+    Returns:
+        (预过滤得到的配对, 可跳过向量检索的版本 ID 集合)
+    """
+    if not is_prefilter_enabled() or not changed_embeddings:
+        return {}, set()
+    queryset = embedded_versions_queryset(project_id, active_only)
+    ensure_text_signatures(queryset.filter(pk__in=list(changed_embeddings)))
+    partner_of = {}
+    for group in find_near_duplicate_groups(find_candidate_rows(queryset, changed_embeddings)):
+        for member in group:
+            if member in changed_embeddings:
+                partner_of[member] = group[0] if member != group[0] else group[1]
+    if not partner_of:
+        return {}, set()
+
+    embeddings = dict(changed_embeddings)
+    missing = set(partner_of.values()) - set(embeddings)
+    if missing:
+        embeddings.update(
+            embedded_versions_queryset(project_id, active_only).filter(pk__in=missing).values_list('id', 'embedding')
+        )
+
+    pairs = {}
+    skip_ids = set()
+    for member, partner in partner_of.items():
+        if partner not in embeddings:
+            continue
+        similarity = _cosine_similarity(embeddings[member], embeddings[partner])
+        if similarity > similarity_threshold:
+            pairs[(member, partner) if member < partner else (partner, member)] = similarity
+            if member > partner:
+                skip_ids.add(member)
+    return pairs, skip_ids
+
+
+def find_duplicates_incremental(project_id: Optional[int], since, similarity_threshold: float = 0.90,
+                                limit_per_source: int = 50, active_only: bool = False) -> dict:
+    """
+    只对 embedding_updated_at >= since 的版本查询近邻，先撤销失效配对，再批量写入新结果。
+    """
+    stats = {'project_id': project_id, 'versions': 0, 'pairs': 0, 'retired': 0, 'prefiltered': 0}
+
+    changed = embedded_versions_queryset(project_id, active_only).filter(embedding_updated_at__gte=since)
+    changed_rows = list(changed.order_by('id').values_list('id', 'embedding'))
+    changed_ids = [version_id for version_id, _ in changed_rows]
+    stats['versions'] = len(changed_ids)
+
+    start_time = time.perf_counter()
+    stats['retired'] = retire_stale_pairs(project_id, changed_ids)
+
+    prefiltered_pairs, skip_ids = prefilter_changed_versions(
+        dict(changed_rows), project_id, similarity_threshold, active_only
+    )
+    stats['prefiltered'] = len(skip_ids)
+
+    def iter_pairs():
+        yield from ((a, b, similarity) for (a, b), similarity in prefiltered_pairs.items())
+        for version_id, embedding in changed_rows:
+            if version_id in skip_ids:
+                continue
+            for neighbour_id, similarity in query_neighbours(
+                    version_id, embedding, project_id, similarity_threshold, limit_per_source, active_only):
+                yield version_id, neighbour_id, min(similarity, 1.0)
+
+    pairs = collect_unique_pairs(iter_pairs())
+    stats['pairs'] = store_pairs(pairs)
+
+    # 受影响的簇：变化版本及其新近邻所在的簇，以及含有已清除 embedding 成员的簇 (其配对刚被撤销)
+    affected_ids = set(changed_ids)
+    for version_a, version_b in pairs:
+        affected_ids.update((version_a, version_b))
+    reclaimed_members = DuplicateClusterMember.objects.filter(version__embedding__isnull=True)
+    if project_id is not None:
+        reclaimed_members = reclaimed_members.filter(cluster__project_id=project_id)
+    affected_ids.update(reclaimed_members.values_list('version_id', flat=True))
+    stats['clusters_changed'] = sum(update_clusters_for_versions(affected_ids).values())
+    stats['seconds'] = round(time.perf_counter() - start_time, 3)
+
+    logger.info(
+        f"Incremental duplicate detection for project {project_id} since {since}: {stats['versions']} changed versions, "
+        f"{stats['pairs']} pairs stored ({stats['prefiltered']} versions resolved by shingle prefilter), "
+        f"{stats['retired']} stale pairs retired in {stats['seconds']}s."
+    )
+    return stats
+
+
+def run_duplicate_scan(project_id: Optional[int], incremental: bool = False, similarity_threshold: float = 0.90,
+                       limit_per_source: int = 50, active_only: bool = False) -> dict:
+    """
+    执行一次项目级扫描并记录 DuplicateScanRun。
+    增量模式下如果该项目还没有完成过扫描，或上次扫描之后切换/回滚过 embedding 模型，则退化为全量扫描。
+    """
+    last_scan = get_last_completed_scan(project_id) if incremental else None
+    # 水位线前移安全余量：覆盖上次扫描开始时尚未提交的 embedding 写入 (以及应用与数据库之间的时钟偏差)
+    watermark = last_scan.started_at - get_watermark_margin() if last_scan else None
+    model_switched_at = get_last_model_switch() if last_scan else None
+    if model_switched_at is not None and model_switched_at >= watermark:
+        # 模型切换/回滚替换了全部向量，旧的配对分数与簇需要全量重新计算
+        logger.info(f"Embedding model switched at {model_switched_at}, running a full duplicate scan "
+                    f"for project {project_id} instead of an incremental one.")
+        last_scan = watermark = None
+    mode = 'incremental' if last_scan else 'full'
+    scan = DuplicateScanRun.objects.create(
+        project_id=project_id,
+        mode=mode,
+        watermark=watermark,
+    )
+    try:
+        if last_scan:
+            stats = find_duplicates_incremental(
+                project_id, watermark, similarity_threshold, limit_per_source, active_only
+            )
+        else:
+            stats = find_duplicates_bulk(project_id, similarity_threshold, limit_per_source, active_only)
+            stats['retired'] = retire_unseen_pairs(project_id, scan.started_at)
+            stats['clusters_changed'] = sum(
+                rebuild_clusters(project_id)[key] for key in ('created', 'updated', 'deleted')
+            )
+    except Exception:
+        scan.status = 'failed'
+        scan.finished_at = timezone.now()
+        scan.save(update_fields=['status', 'finished_at'])
+        raise
+
+    scan.status = 'completed'
+    scan.finished_at = timezone.now()
+    scan.versions_scanned = stats['versions']
+    scan.pairs_stored = stats['pairs']
+    scan.pairs_retired = stats['retired']
+    scan.save(update_fields=['status', 'finished_at', 'versions_scanned', 'pairs_stored', 'pairs_retired'])
+    stats['mode'] = mode
+    return stats
@@ -0,0 +1,179 @@
+# back/apps/analysis/embedding_cache.py
+"""
+基于内容哈希的 embedding 缓存。
+
+键为 (模型版本号 + 规范化后的文本) 的 SHA-256，值为压缩存储的向量字节 (float16/float32)。
+文本相同的版本 (例如克隆出的版本、未修改内容的重复保存、--force-rebuild) 直接复用缓存向量，
+不再调用模型。缓存分两层：进程内 LRU，以及可选的 Redis 共享 LRU (所有 worker 共用)。
+"""
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = 'tcms:analysis:embcache:'
+REDIS_LRU_KEY = 'tcms:analysis:embcache:lru'
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：Unicode NFKC、合并空白字符，使仅空白不同的文本命中同一缓存项。"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return ' '.join(text.split())
+
+
+def make_cache_key(text: str, model_version: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(model_version.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(normalize_text(text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    两层 LRU 缓存。向量以 dtype 字节存储 (float16 时 768 维约 1.5 KB)，读取时还原为 float 列表。
+    """
+
+    def __init__(self, max_local_entries: int = 10000, max_shared_entries: int = 200000,
+                 dtype: str = 'float16', use_redis: bool = True):
+        self.max_local_entries = max_local_entries
+        self.max_shared_entries = max_shared_entries
+        self.dtype = np.dtype(dtype)
+        self.use_redis = use_redis
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # --- 序列化 ---
+    def _to_bytes(self, vector) -> bytes:
+        return np.asarray(vector, dtype=self.dtype).tobytes()
+
+    def _from_bytes(self, data: bytes) -> List[float]:
+        return np.frombuffer(data, dtype=self.dtype).astype(np.float32).tolist()
+
+    # --- 进程内 LRU ---
+    def _local_get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._local.get(key)
+            if data is not None:
+                self._local.move_to_end(key)
+            return data
+
+    def _local_set(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._local[key] = data
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    # --- Redis 共享 LRU ---
+    def _redis(self):
+        if not self.use_redis:
+            return None
+        try:
+            from .batching import get_redis
+            return get_redis()
+        except Exception as e:
+            logger.warning(f"Embedding cache Redis tier unavailable: {e}")
+            return None
+
+    def _shared_get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        client = self._redis()
+        if client is None or not keys:
+            return {}
+        try:
+            values = client.mget([REDIS_KEY_PREFIX + key for key in keys])
+            found = {key: value for key, value in zip(keys, values) if value is not None}
+            if found:
+                # 刷新访问时间，实现跨进程的 LRU
+                client.zadd(REDIS_LRU_KEY, {key: time.time() for key in found})
+            return found
+        except Exception as e:
+            logger.warning(f"Embedding cache Redis read failed: {e}")
+            return {}
+
+    def _shared_set_many(self, items: Dict[str, bytes]) -> None:
+        client = self._redis()
+        if client is None or not items:
+            return
+        try:
+            now = time.time()
+            pipe = client.pipeline()
+            pipe.mset({REDIS_KEY_PREFIX + key: value for key, value in items.items()})
+            pipe.zadd(REDIS_LRU_KEY, {key: now for key in items})
+            pipe.zcard(REDIS_LRU_KEY)
+            total = pipe.execute()[-1]
+            overflow = total - self.max_shared_entries
+            if overflow > 0:
+                evicted = [key.decode() if isinstance(key, bytes) else key
+                           for key, _ in client.zpopmin(REDIS_LRU_KEY, overflow)]
+                if evicted:
+                    client.delete(*[REDIS_KEY_PREFIX + key for key in evicted])
+        except Exception as e:
+            logger.warning(f"Embedding cache Redis write failed: {e}")
+
+    # --- 对外接口 ---
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """批量读取，返回命中的 {key: 向量}。同时累计命中/未命中次数。"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        remote_keys = []
+        for key in keys:
+            data = self._local_get(key)
+            if data is not None:
+                found[key] = data
+            else:
+                remote_keys.append(key)
+        for key, data in self._shared_get_many(remote_keys).items():
+            self._local_set(key, data)
+            found[key] = data
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return {key: self._from_bytes(data) for key, data in found.items()}
+
+    def set_many(self, vectors: Dict[str, Iterable[float]]) -> None:
+        items = {key: self._to_bytes(vector) for key, vector in vectors.items()}
+        for key, data in items.items():
+            self._local_set(key, data)
+        self._shared_set_many(items)
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key]).get(key)
+
+    def set(self, key: str, vector: Iterable[float]) -> None:
+        self.set_many({key: vector})
+
+    def clear_local(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_cache = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """获取进程级缓存实例；settings.EMBEDDING_CACHE_ENABLED 为 False 时返回 None。"""
+    global _cache
+    if not getattr(settings, 'EMBEDDING_CACHE_ENABLED', True):
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(
+            max_local_entries=getattr(settings, 'EMBEDDING_CACHE_LOCAL_MAX_ENTRIES', 10000),
+            max_shared_entries=getattr(settings, 'EMBEDDING_CACHE_SHARED_MAX_ENTRIES', 200000),
+            dtype=getattr(settings, 'EMBEDDING_CACHE_DTYPE', 'float16'),
+            use_redis=getattr(settings, 'EMBEDDING_CACHE_USE_REDIS', True),
+        )
+    return _cache
@@ -1,39 +1,58 @@
 # back/apps/analysis/management/commands/backfill_embeddings.py
 
 import time
-from django.core.management.base import BaseCommand
-from django.db.models import Q
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
 from apps.testcases.models import TestCaseVersion
+from apps.analysis.models import EmbeddingBackfillRun
+from apps.analysis.utils import enable_embedding_model, get_embedding_model
+from apps.analysis.policy import eager_versions_queryset, get_embedding_policy
+from apps.analysis.queues import EMBEDDING_BULK_QUEUE, wait_for_queue_capacity
 # 导入批量 Celery 任务
-from apps.analysis.tasks import generate_embeddings_batch_task # Uncommented original import
-
-# --- 移除调试代码 ---
-# print("Attempting basic import from tasks...")
-# try:
-#     from apps.analysis.tasks import generate_version_embedding_task # Known existing task
-#     print("Successfully imported generate_version_embedding_task.")
-#     import apps.analysis.tasks
-#     print("Attributes found in tasks.py:", dir(apps.analysis.tasks))
-# except ImportError as e:
-#     print(f"Basic import failed: {e}")
-# --- 结束移除调试代码 ---
+from apps.analysis.tasks import (
+    generate_embeddings_batch_task, prepare_version_embeddings, save_version_embeddings
+)
 
 from logging import getLogger
-from itertools import islice # 用于批处理迭代
 
 logger = getLogger(__name__)
 
-# Helper function to chunk data
-def chunked(iterable, size):
-    iterator = iter(iterable)
+# 进程内编码模式读取的字段 (不读取已有的 embedding 列，减少传输量)
+TEXT_FIELDS = ['id', 'title', 'precondition', 'steps_data']
+# 进程内编码模式最多同时在途的写回批次
+MAX_PENDING_WRITES = 2
+
+
+def iter_id_pages(queryset, after_id, page_size):
+    """按主键做 keyset 分页 (WHERE id > 检查点 ORDER BY id LIMIT N)，不把全部 ID 读入内存。"""
     while True:
-        chunk = tuple(islice(iterator, size))
-        if not chunk:
+        ids = list(queryset.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:page_size])
+        if not ids:
             return
-        yield chunk
+        yield ids
+        after_id = ids[-1]
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def close_thread_connection():
+    """关闭当前线程的数据库连接 (Django 的连接按线程创建)。"""
+    connection.close()
+
 
 class Command(BaseCommand):
-    help = '为缺失 embedding 的现有 TestCaseVersion 派发批量 Celery 任务以生成 embedding。'
+    help = ('为缺失 embedding 的现有 TestCaseVersion 生成 embedding。按版本 ID 流式分页并持久化检查点，'
+            '中断后重新执行会从检查点继续。默认派发批量 Celery 任务，--local 则在当前进程内流水线编码。')
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -45,43 +64,90 @@ class Command(BaseCommand):
             '--batch-size',
             type=int,
             default=500, # 默认批次大小可以调整
-            help='发送给 Celery 任务的每个批次包含的版本 ID 数量。',
+            help='每页 (每个 Celery 任务 / 每次进程内编码) 包含的版本数量。',
         )
         parser.add_argument(
             '--delay-ms',
             type=int,
-            default=50, # 在批次之间添加少量延迟可能有助于 Celery 调度
-            help='派发每个批次任务之间的延迟（毫秒）。',
+            default=0, # 派发节奏由 --max-queue-depth 背压控制，一般不再需要固定延迟
+            help='派发每个批次任务之间的额外延迟（毫秒），仅用于派发模式，默认 0。',
+        )
+        parser.add_argument(
+            '--max-queue-depth',
+            type=int,
+            default=getattr(settings, 'EMBEDDING_BULK_MAX_QUEUE_DEPTH', 20),
+            help='embedding_bulk 队列中等待的批次数达到该值时暂停派发 (0 表示不限制)，仅用于派发模式。',
+        )
+        parser.add_argument(
+            '--local',
+            action='store_true',
+            help='在当前进程内编码：读取下一页、编码当前页、写回上一页三者由线程池流水线并行执行。',
+        )
+        parser.add_argument(
+            '--encode-batch-size',
+            type=int,
+            default=32,
+            help='进程内编码模式下传给 model.encode 的 batch_size。',
+        )
+        parser.add_argument(
+            '--include-inactive',
+            action='store_true',
+            help='同时处理非活动 (历史) 版本。默认按 EMBEDDING_POLICY，"active" 策略下只处理活动版本。',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='忽略未完成回填的检查点，从头开始。',
         )
 
     def handle(self, *args, **options):
         force_rebuild = options['force_rebuild']
         batch_size = options['batch_size']
-        delay_ms = options['delay_ms']
-        delay_seconds = delay_ms / 1000.0
+        local = options['local']
+        mode = 'local' if local else 'dispatch'
 
         if batch_size <= 0:
              self.stderr.write(self.style.ERROR("批处理大小必须大于 0。"))
              return
 
-        self.stdout.write(self.style.NOTICE(
-            f"开始派发批量 embedding 回填任务。强制重建: {force_rebuild}, Celery 批处理大小: {batch_size}, 批次间延迟: {delay_ms}ms"
-        ))
+        if local:
+            enable_embedding_model()
+            if get_embedding_model() is None:
+                raise CommandError("模型加载失败，无法使用 --local 模式，请查看日志。")
 
         # 构建基础查询集
         queryset = TestCaseVersion.objects.all()
+        if not options['include_inactive']:
+            queryset = eager_versions_queryset(queryset)
+            if get_embedding_policy() == 'active':
+                self.stdout.write("EMBEDDING_POLICY=active：只处理活动版本，历史版本在需要时按需生成。")
         if not force_rebuild:
             queryset = queryset.filter(embedding__isnull=True)
-            self.stdout.write("将仅为 embedding 为空的版本生成任务。")
+            self.stdout.write("将仅为 embedding 为空的版本生成 embedding。")
         else:
             self.stdout.write(self.style.WARNING("警告：将为所有版本强制重新生成 embedding！"))
 
-        # 获取所有需要处理的 ID 列表 (一次性获取，对于超大数据量可能需要优化)
-        # 对于百万级数据，values_list().iterator() 仍然是内存友好的
-        all_version_ids = list(queryset.values_list('id', flat=True))
-        total_versions = len(all_version_ids)
+        run = None
+        if not options['restart']:
+            run = EmbeddingBackfillRun.objects.filter(force_rebuild=force_rebuild).exclude(status='completed').first()
+        if run:
+            self.stdout.write(self.style.NOTICE(
+                f"从回填 #{run.pk} 的检查点继续 (版本 ID > {run.last_version_id}，此前已处理 {run.versions_processed} 个)。"
+            ))
+            run.mode = mode
+            run.status = 'running'
+            run.finished_at = None
+        else:
+            run = EmbeddingBackfillRun(mode=mode, force_rebuild=force_rebuild)
+
+        remaining = queryset.filter(id__gt=run.last_version_id).count()
+        run.total_estimate = run.versions_processed + remaining
+        run.save()
 
-        if total_versions == 0:
+        if remaining == 0:
+            run.status = 'completed'
+            run.finished_at = timezone.now()
+            run.save(update_fields=['status', 'finished_at', 'updated_at'])
             if not force_rebuild:
                  self.stdout.write(self.style.WARNING(
                 "没有找到需要生成 embedding 的版本。如果需要为所有版本重新生成，请使用 --force-rebuild 参数。"
@@ -91,41 +157,132 @@ class Command(BaseCommand):
                 ))
             return
 
-        self.stdout.write(f"找到 {total_versions} 个版本需要处理。将按每批 {batch_size} 个派发任务...")
+        self.stdout.write(self.style.NOTICE(
+            f"开始 embedding 回填 #{run.pk}。模式: {run.get_mode_display()}, 强制重建: {force_rebuild}, "
+            f"每页: {batch_size}, 剩余版本: {remaining}"
+        ))
 
-        total_dispatched_tasks = 0
-        total_dispatched_versions = 0
         start_time = time.time()
+        try:
+            if local:
+                self.run_local(run, queryset, batch_size, options['encode_batch_size'], remaining, start_time)
+            else:
+                self.run_dispatch(run, queryset, batch_size, options['delay_ms'] / 1000.0,
+                                  options['max_queue_depth'], remaining, start_time)
+        except KeyboardInterrupt:
+            self.stderr.write(self.style.WARNING(
+                f"\n已中断。检查点: 版本 ID {self.current_checkpoint(run)}，重新执行命令即可继续。"
+            ))
+            return
+        except Exception as e:
+            logger.error(f"Embedding backfill #{run.pk} failed: {e}")
+            EmbeddingBackfillRun.objects.filter(pk=run.pk).update(status='failed', updated_at=timezone.now())
+            raise CommandError(f"回填失败，检查点: 版本 ID {self.current_checkpoint(run)}。错误: {e}")
 
-        # 将 ID 列表分块并派发批量任务
-        for id_batch in chunked(all_version_ids, batch_size):
-            try:
-                generate_embeddings_batch_task.delay(list(id_batch))
-                total_dispatched_tasks += 1
-                current_batch_size = len(id_batch)
-                total_dispatched_versions += current_batch_size
-                self.stdout.write(f"已派发批次任务 {total_dispatched_tasks} (包含 {current_batch_size} 个版本, 累计: {total_dispatched_versions}/{total_versions})")
-
-                if delay_seconds > 0:
-                    time.sleep(delay_seconds)
-
-            except Exception as e:
-                # 记录并报告派发过程中的错误
-                batch_start_id = id_batch[0] if id_batch else 'N/A'
-                logger.error(f"派发批次任务时出错 (批次起始 ID: {batch_start_id}): {e}")
-                self.stderr.write(self.style.ERROR(
-                    f"派发批次任务失败 (批次起始 ID: {batch_start_id})。错误: {e}"
-                ))
-
-        end_time = time.time()
-        duration = end_time - start_time
+        EmbeddingBackfillRun.objects.filter(pk=run.pk).update(
+            status='completed', finished_at=timezone.now(), updated_at=timezone.now()
+        )
+        run.refresh_from_db()
+        duration = time.time() - start_time
 
         self.stdout.write(self.style.SUCCESS(
-            f"\n批量任务派发完成。"
+            f"\n回填 #{run.pk} 完成。"
         ))
-        self.stdout.write(f"总共派发的批次任务数: {total_dispatched_tasks}")
-        self.stdout.write(f"总共处理的版本数: {total_dispatched_versions}")
-        self.stdout.write(f"总耗时: {duration:.2f} 秒")
-        self.stdout.write(self.style.NOTICE(
-            "Celery worker 现在将在后台处理这些批量任务。"
-        )) 
\ No newline at end of file
+        self.stdout.write(f"总共处理的版本数: {run.versions_processed}")
+        if local:
+            self.stdout.write(f"写回 embedding 的版本数: {run.versions_updated}")
+        self.stdout.write(f"本次耗时: {duration:.2f} 秒")
+        if not local:
+            self.stdout.write(self.style.NOTICE(
+                "Celery worker 现在将在后台处理这些批量任务。"
+            ))
+
+    def current_checkpoint(self, run):
+        return EmbeddingBackfillRun.objects.filter(pk=run.pk).values_list('last_version_id', flat=True).first()
+
+    def report_progress(self, done, remaining, start_time, label, last_id):
+        elapsed = time.time() - start_time
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (remaining - done) / rate if rate > 0 else None
+        self.stdout.write(
+            f"{label}: {done}/{remaining} ({done * 100 / remaining:.1f}%), "
+            f"{rate:.1f} texts/sec, ETA {format_eta(max(eta, 0) if eta is not None else None)}, 检查点 {last_id}"
+        )
+
+    def run_dispatch(self, run, queryset, batch_size, delay_seconds, max_queue_depth, remaining, start_time):
+        """
+        派发模式：每页 ID 派发一个批量任务，派发成功后推进检查点。
+        embedding_bulk 队列积压达到 max_queue_depth 时暂停派发，等 worker 消化后再继续。
+        """
+        dispatched = 0
+
+        def on_wait(depth):
+            self.stdout.write(f"队列 {EMBEDDING_BULK_QUEUE} 积压 {depth} 个批次，等待 worker 处理...")
+
+        for id_batch in iter_id_pages(queryset, run.last_version_id, batch_size):
+            wait_for_queue_capacity(EMBEDDING_BULK_QUEUE, max_queue_depth, on_wait=on_wait)
+            generate_embeddings_batch_task.delay(id_batch)
+            dispatched += len(id_batch)
+            EmbeddingBackfillRun.objects.filter(pk=run.pk).update(
+                last_version_id=id_batch[-1],
+                versions_processed=F('versions_processed') + len(id_batch),
+                updated_at=timezone.now(),
+            )
+            self.report_progress(dispatched, remaining, start_time, '已派发', id_batch[-1])
+
+            if delay_seconds > 0:
+                time.sleep(delay_seconds)
+
+    def run_local(self, run, queryset, batch_size, encode_batch_size, remaining, start_time):
+        """
+        进程内模式：读取线程预取下一页，主线程编码当前页，写回线程 bulk_update 上一页。
+        写回线程只有一个，按页顺序写入并在写入后推进检查点，因此检查点之前的版本一定已经落库。
+        """
+        text_queryset = queryset.only(*TEXT_FIELDS).order_by('id')
+
+        def read_page(after_id):
+            return list(text_queryset.filter(id__gt=after_id)[:batch_size])
+
+        def write_page(versions, last_id, page_size):
+            updated = save_version_embeddings(versions)
+            EmbeddingBackfillRun.objects.filter(pk=run.pk).update(
+                last_version_id=last_id,
+                versions_processed=F('versions_processed') + page_size,
+                versions_updated=F('versions_updated') + updated,
+                updated_at=timezone.now(),
+            )
+            return page_size, last_id
+
+        done = 0
+
+        def collect(future):
+            nonlocal done
+            page_size, last_id = future.result()
+            done += page_size
+            self.report_progress(done, remaining, start_time, '已写回', last_id)
+
+        reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backfill-read')
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backfill-write')
+        pending_writes = deque()
+        try:
+            next_page = reader.submit(read_page, run.last_version_id)
+            while True:
+                versions = next_page.result()
+                if not versions:
+                    break
+                last_id = versions[-1].id
+                # 编码当前页的同时预取下一页
+                next_page = reader.submit(read_page, last_id)
+
+                versions_to_update, _ = prepare_version_embeddings(versions, batch_size=encode_batch_size)
+                while len(pending_writes) >= MAX_PENDING_WRITES:
+                    collect(pending_writes.popleft())
+                pending_writes.append(writer.submit(write_page, versions_to_update, last_id, len(versions)))
+            while pending_writes:
+                collect(pending_writes.popleft())
+        finally:
+            # 等待已提交的写回完成，保证检查点与已落库的数据一致
+            reader.submit(close_thread_connection)
+            writer.submit(close_thread_connection)
+            reader.shutdown(wait=True)
+            writer.shutdown(wait=True)
@@ -0,0 +1,108 @@
+# back/apps/analysis/management/commands/benchmark_embedding_backends.py
+
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.backends import create_backend
+from apps.analysis.utils import MODEL_NAME, extract_version_text
+from apps.analysis.management.commands.benchmark_vector_search import percentile
+
+# 后端规格: 名称 -> (EMBEDDING_BACKEND, 额外参数)
+BACKEND_SPECS = {
+    'sentence_transformers': ('sentence_transformers', {}),
+    'onnx': ('onnx', {'quantized': False}),
+    'onnx-int8': ('onnx', {'quantized': True}),
+}
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class Command(BaseCommand):
+    help = ('对比各 embedding 后端的加载耗时、批量吞吐量 (texts/sec)、单条延迟，以及与基准后端 (第一个) '
+            '的余弦一致性和近邻一致性 (样本内 top-k 重合率)。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default='sentence_transformers,onnx,onnx-int8',
+                            help=f"逗号分隔的后端，可选: {', '.join(BACKEND_SPECS)}。第一个作为基准。")
+        parser.add_argument('--sample', type=int, default=256, help='参与测试的版本数量。')
+        parser.add_argument('--batch-size', type=int, default=32, help='批量编码的 batch_size。')
+        parser.add_argument('--latency-samples', type=int, default=50, help='测量单条延迟的文本数量。')
+        parser.add_argument('--top-k', type=int, default=10, help='近邻一致性比较的 k。')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in BACKEND_SPECS]
+        if unknown:
+            raise CommandError(f"未知的后端: {', '.join(unknown)}")
+
+        texts = []
+        for version in TestCaseVersion.objects.order_by('id').only('id', 'title', 'precondition', 'steps_data').iterator(chunk_size=500):
+            text = extract_version_text(version)
+            if text:
+                texts.append(text)
+            if len(texts) >= options['sample']:
+                break
+        if not texts:
+            self.stdout.write(self.style.WARNING("没有找到有文本内容的版本。"))
+            return
+
+        self.stdout.write(self.style.NOTICE(f"模型: {MODEL_NAME}, 样本: {len(texts)}, batch_size: {options['batch_size']}"))
+        self.stdout.write(
+            f"{'backend':<24}{'load s':>8}{'texts/s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'cos mean':>10}{'cos min':>9}{'top-k':>8}"
+        )
+
+        reference = None
+        reference_neighbours = None
+        k = min(options['top_k'], len(texts) - 1)
+        for name in names:
+            backend_name, kwargs = BACKEND_SPECS[name]
+            backend = create_backend(MODEL_NAME, backend_name, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                backend.load()
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"{name}: 加载失败: {e}"))
+                continue
+            load_seconds = time.perf_counter() - start_time
+
+            backend.encode(texts[:1])  # 预热
+            start_time = time.perf_counter()
+            vectors = np.asarray(backend.encode(texts, batch_size=options['batch_size']), dtype=np.float32)
+            throughput = len(texts) / (time.perf_counter() - start_time)
+
+            latencies = []
+            for text in texts[:options['latency_samples']]:
+                start_time = time.perf_counter()
+                backend.encode([text])
+                latencies.append((time.perf_counter() - start_time) * 1000)
+
+            normalized = normalize_rows(vectors)
+            neighbours = None
+            if k > 0:
+                similarities = normalized @ normalized.T
+                np.fill_diagonal(similarities, -np.inf)
+                neighbours = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+
+            if reference is None:
+                reference, reference_neighbours = normalized, neighbours
+                cos_mean = cos_min = overlap = 1.0
+            else:
+                cosines = (normalized * reference).sum(axis=1)
+                cos_mean, cos_min = float(cosines.mean()), float(cosines.min())
+                overlap = 1.0
+                if neighbours is not None:
+                    overlap = float(np.mean([
+                        len(set(row) & set(ref_row)) / k for row, ref_row in zip(neighbours, reference_neighbours)
+                    ]))
+
+            self.stdout.write(
+                f"{name:<24}"
+                f"{load_seconds:>8.2f}{throughput:>10.1f}{percentile(latencies, 0.5):>9.2f}{percentile(latencies, 0.95):>9.2f}"
+                f"{cos_mean:>10.4f}{cos_min:>9.4f}{overlap:>8.3f}"
+            )
@@ -0,0 +1,101 @@
+# back/apps/analysis/management/commands/benchmark_embedding_throughput.py
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.utils import (
+    MODEL_NAME, enable_embedding_model, get_embedding_model, get_embedding_model_version, extract_version_text
+)
+
+
+class Command(BaseCommand):
+    help = '对比单版本任务路径 (逐条 encode + save) 与微批路径 (批量 encode + bulk_update) 的吞吐量 (texts/sec)。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=256,
+            help='参与测试的版本数量 (取有文本内容的前 N 个版本)。',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'EMBEDDING_MICRO_BATCH_SIZE', 64),
+            help='微批路径每批的版本数量，默认与 EMBEDDING_MICRO_BATCH_SIZE 一致。',
+        )
+        parser.add_argument(
+            '--with-db-writes',
+            action='store_true',
+            help='同时测量写回数据库的开销 (在事务中执行并回滚，不会修改数据)。',
+        )
+
+    def handle(self, *args, **options):
+        sample_size = options['sample']
+        batch_size = options['batch_size']
+        with_db_writes = options['with_db_writes']
+
+        if sample_size <= 0 or batch_size <= 0:
+            self.stderr.write(self.style.ERROR("样本数量和批大小必须大于 0。"))
+            return
+
+        enable_embedding_model()
+        model = get_embedding_model()
+        if model is None:
+            self.stderr.write(self.style.ERROR("模型加载失败，请查看日志。"))
+            return
+
+        versions = []
+        texts = []
+        for version in TestCaseVersion.objects.order_by('id').iterator(chunk_size=500):
+            text = extract_version_text(version)
+            if text:
+                versions.append(version)
+                texts.append(text)
+            if len(versions) >= sample_size:
+                break
+
+        if not versions:
+            self.stdout.write(self.style.WARNING("没有找到有文本内容的版本。"))
+            return
+
+        self.stdout.write(self.style.NOTICE(
+            f"模型: {MODEL_NAME} ({model.name} 后端), 样本: {len(versions)} 个版本, 微批大小: {batch_size}, 包含数据库写入: {with_db_writes}"
+        ))
+
+        # 预热，避免首次调用的初始化开销计入任一路径
+        model.encode(texts[:1])
+
+        # 1. 当前路径：每个版本一个任务，逐条 encode 并单独 save
+        start_time = time.perf_counter()
+        with transaction.atomic():
+            for version, text in zip(versions, texts):
+                version.embedding = model.encode(text).tolist()
+                version.embedding_model_version = get_embedding_model_version()
+                if with_db_writes:
+                    version.save(update_fields=['embedding', 'embedding_model_version'])
+            transaction.set_rollback(True)
+        single_duration = time.perf_counter() - start_time
+
+        # 2. 微批路径：每批一次 encode，一次 bulk_update
+        start_time = time.perf_counter()
+        with transaction.atomic():
+            for offset in range(0, len(versions), batch_size):
+                batch_versions = versions[offset:offset + batch_size]
+                embeddings = model.encode(texts[offset:offset + batch_size], batch_size=32).tolist()
+                for version, embedding in zip(batch_versions, embeddings):
+                    version.embedding = embedding
+                    version.embedding_model_version = get_embedding_model_version()
+                if with_db_writes:
+                    TestCaseVersion.objects.bulk_update(batch_versions, fields=['embedding', 'embedding_model_version'])
+            transaction.set_rollback(True)
+        batch_duration = time.perf_counter() - start_time
+
+        single_rate = len(versions) / single_duration if single_duration > 0 else 0
+        batch_rate = len(versions) / batch_duration if batch_duration > 0 else 0
+        self.stdout.write(f"单版本路径: {single_duration:.2f} 秒, {single_rate:.1f} texts/sec")
+        self.stdout.write(f"微批路径:   {batch_duration:.2f} 秒, {batch_rate:.1f} texts/sec")
+        if single_rate > 0:
+            self.stdout.write(self.style.SUCCESS(f"加速比: {batch_rate / single_rate:.2f}x"))
@@ -0,0 +1,83 @@
+# back/apps/analysis/management/commands/benchmark_vector_search.py
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.utils import similar_versions_queryset, hnsw_search_params
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = '测量各检索模式 (全局 / 项目内 / 仅活动版本 / 项目内活动版本) 在不同 hnsw.ef_search 下的召回率与延迟。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, required=True, help='用于项目内检索模式的项目 ID，查询样本也从该项目中抽取。')
+        parser.add_argument('--samples', type=int, default=50, help='查询样本数量。')
+        parser.add_argument('--limit', type=int, default=10, help='每次查询返回的近邻数量 (recall@k 中的 k)。')
+        parser.add_argument('--ef-search', type=str, default='40,100,200', help='逗号分隔的 hnsw.ef_search 取值。')
+        parser.add_argument('--iterative-scan', type=str, default=None, help='hnsw.iterative_scan 取值 (pgvector >= 0.8)。')
+
+    def exact_neighbours(self, queryset, limit):
+        """禁用索引扫描，得到精确的 top-k 作为召回率基准。"""
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            return list(queryset.values_list('id', flat=True)[:limit])
+
+    def handle(self, *args, **options):
+        project_id = options['project']
+        limit = options['limit']
+        ef_values = [int(value) for value in options['ef_search'].split(',') if value.strip()]
+
+        samples = list(
+            TestCaseVersion.objects.filter(project_id=project_id, embedding__isnull=False)
+            .order_by('?')
+            .values_list('id', 'embedding')[:options['samples']]
+        )
+        if not samples:
+            self.stdout.write(self.style.WARNING(f"项目 {project_id} 中没有已生成 embedding 的版本。"))
+            return
+
+        modes = {
+            'global': {},
+            'project': {'project_id': project_id},
+            'active': {'active_only': True},
+            'project_active': {'project_id': project_id, 'active_only': True},
+        }
+
+        self.stdout.write(self.style.NOTICE(
+            f"样本: {len(samples)}, k={limit}, ef_search={ef_values}, iterative_scan={options['iterative_scan']}"
+        ))
+        self.stdout.write(f"{'mode':<16}{'ef_search':>10}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+        for mode_name, filters in modes.items():
+            baselines = {}
+            for version_id, embedding in samples:
+                queryset = similar_versions_queryset(embedding, exclude_id=version_id, storage_mode='float32', **filters)
+                baselines[version_id] = set(self.exact_neighbours(queryset, limit))
+
+            for ef_search in ef_values:
+                latencies = []
+                recalls = []
+                for version_id, embedding in samples:
+                    queryset = similar_versions_queryset(embedding, exclude_id=version_id, **filters)
+                    with hnsw_search_params(ef_search=ef_search, iterative_scan=options['iterative_scan']):
+                        start_time = time.perf_counter()
+                        found = set(queryset.values_list('id', flat=True)[:limit])
+                        latencies.append((time.perf_counter() - start_time) * 1000)
+                    expected = baselines[version_id]
+                    if expected:
+                        recalls.append(len(found & expected) / len(expected))
+                recall = sum(recalls) / len(recalls) if recalls else 1.0
+                self.stdout.write(
+                    f"{mode_name:<16}{ef_search:>10}{recall:>10.3f}"
+                    f"{percentile(latencies, 0.5):>10.2f}{percentile(latencies, 0.95):>10.2f}"
+                )
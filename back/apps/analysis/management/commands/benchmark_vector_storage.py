@@ -0,0 +1,125 @@
+# back/apps/analysis/management/commands/benchmark_vector_storage.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.utils import (
+    VECTOR_STORAGE_MODES, similar_versions_queryset, hnsw_search_params, ef_search_for_limit,
+    get_model_dimension, get_rerank_candidates
+)
+from apps.analysis.management.commands.benchmark_vector_search import percentile
+from apps.analysis.management.commands.vector_indexes import quantized_index_sql
+
+
+class Command(BaseCommand):
+    help = ('对比 float32 / halfvec / binary (汉明距离候选 + float32 重排) 三种向量布局的'
+            '索引体积、构建耗时、单向量存储、recall@k 与检索延迟。'
+            '基准索引以 tcversion_emb_bench_ 为前缀临时创建，测量结束后删除。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layouts', type=str, default=','.join(VECTOR_STORAGE_MODES),
+                            help='逗号分隔的待测布局 (float32,halfvec,binary)。')
+        parser.add_argument('--samples', type=int, default=50, help='查询样本数量。')
+        parser.add_argument('--limit', type=int, default=10, help='每次查询返回的近邻数量 (recall@k 中的 k)。')
+        parser.add_argument('--active-only', action='store_true', help='只在活动版本上建索引和检索。')
+        parser.add_argument('--m', type=int, default=16, help='HNSW 参数 m。')
+        parser.add_argument('--ef-construction', type=int, default=64, help='HNSW 参数 ef_construction。')
+
+    def bench_index_sql(self, table, index_name, layout, active_only, options):
+        if layout == 'float32':
+            sql = (
+                f"CREATE INDEX {index_name} ON {table} USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {int(options['m'])}, ef_construction = {int(options['ef_construction'])})"
+            )
+            return sql + (" WHERE is_active" if active_only else "")
+        return quantized_index_sql(
+            table, index_name, layout, active_only, options['m'], options['ef_construction'], concurrently=False
+        )
+
+    def exact_neighbours(self, embedding, version_id, active_only, limit):
+        """禁用索引扫描，用 float32 精确检索得到 top-k 作为召回率基准。"""
+        queryset = similar_versions_queryset(
+            embedding, active_only=active_only, exclude_id=version_id, storage_mode='float32'
+        )
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            return set(queryset.values_list('id', flat=True)[:limit])
+
+    def handle(self, *args, **options):
+        table = TestCaseVersion._meta.db_table
+        limit = options['limit']
+        active_only = options['active_only']
+        layouts = [layout.strip() for layout in options['layouts'].split(',') if layout.strip()]
+        invalid = [layout for layout in layouts if layout not in VECTOR_STORAGE_MODES]
+        if invalid:
+            raise CommandError(f"未知的布局: {', '.join(invalid)}")
+
+        base = TestCaseVersion.objects.filter(embedding__isnull=False)
+        if active_only:
+            base = base.filter(is_active=True)
+        samples = list(base.order_by('?').values_list('id', 'embedding')[:options['samples']])
+        if not samples:
+            self.stdout.write(self.style.WARNING("没有已生成 embedding 的版本。"))
+            return
+
+        dimension = get_model_dimension()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*), avg(pg_column_size(embedding)), "
+                f"avg(pg_column_size(embedding::halfvec({dimension}))), "
+                f"avg(pg_column_size(binary_quantize(embedding)::bit({dimension}))) "
+                f"FROM {table} WHERE embedding IS NOT NULL{' AND is_active' if active_only else ''}"
+            )
+            total, float_bytes, half_bytes, bit_bytes = cursor.fetchone()
+        vector_bytes = {'float32': float_bytes, 'halfvec': half_bytes, 'binary': bit_bytes}
+
+        self.stdout.write(self.style.NOTICE(
+            f"向量数: {total}, 样本: {len(samples)}, k={limit}, 仅活动版本: {active_only}, "
+            f"binary 重排候选数: {get_rerank_candidates()}"
+        ))
+        baselines = {
+            version_id: self.exact_neighbours(embedding, version_id, active_only, limit)
+            for version_id, embedding in samples
+        }
+
+        self.stdout.write(
+            f"{'layout':<10}{'build s':>10}{'index size':>14}{'bytes/vec':>11}"
+            f"{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        )
+        for layout in layouts:
+            index_name = f"tcversion_emb_bench_{layout}_idx"
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+                start_time = time.perf_counter()
+                cursor.execute(self.bench_index_sql(table, index_name, layout, active_only, options))
+                build_seconds = time.perf_counter() - start_time
+                cursor.execute("SELECT pg_size_pretty(pg_relation_size(%s::regclass))", [index_name])
+                index_size = cursor.fetchone()[0]
+
+            try:
+                latencies = []
+                recalls = []
+                for version_id, embedding in samples:
+                    queryset = similar_versions_queryset(
+                        embedding, active_only=active_only, exclude_id=version_id, storage_mode=layout
+                    )
+                    # 基准索引之外仍可能存在同布局的正式索引，二者结构相同，不影响测量
+                    with hnsw_search_params(ef_search=max(ef_search_for_limit(limit),
+                                                          get_rerank_candidates() if layout == 'binary' else 0)):
+                        start_time = time.perf_counter()
+                        found = set(queryset.values_list('id', flat=True)[:limit])
+                        latencies.append((time.perf_counter() - start_time) * 1000)
+                    expected = baselines[version_id]
+                    if expected:
+                        recalls.append(len(found & expected) / len(expected))
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+            recall = sum(recalls) / len(recalls) if recalls else 1.0
+            self.stdout.write(
+                f"{layout:<10}{build_seconds:>10.2f}{index_size:>14}{float(vector_bytes[layout] or 0):>11.0f}"
+                f"{recall:>10.3f}{percentile(latencies, 0.5):>10.2f}{percentile(latencies, 0.95):>10.2f}"
+            )
@@ -0,0 +1,37 @@
+# back/apps/analysis/management/commands/compute_text_signatures.py
+
+import time
+from django.core.management.base import BaseCommand
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.shingles import ensure_text_signatures, find_near_duplicate_groups
+
+
+class Command(BaseCommand):
+    help = ('计算测试用例版本的规范化文本哈希与 MinHash 签名 (shingle 预过滤使用)。'
+            '保存版本时信号会自动计算，此命令用于存量数据或修改 SHINGLE_SIZE/MINHASH_PERMUTATIONS 之后。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='只处理指定项目的版本。')
+        parser.add_argument('--force', action='store_true', help='重算全部签名，而不只是缺失或长度不符的签名。')
+        parser.add_argument('--report', action='store_true', help='完成后统计完全相同/几乎相同的版本分组。')
+
+    def handle(self, *args, **options):
+        queryset = TestCaseVersion.objects.all()
+        if options['project']:
+            queryset = queryset.filter(project_id=options['project'])
+
+        start_time = time.time()
+        updated = ensure_text_signatures(queryset, force=options['force'])
+        duration = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(f"已计算 {updated} 个版本的文本签名，耗时: {duration:.2f} 秒"))
+
+        if options['report']:
+            start_time = time.time()
+            groups = find_near_duplicate_groups(
+                queryset.order_by('id').values_list('id', 'text_hash', 'text_minhash').iterator(chunk_size=5000)
+            )
+            duration = time.time() - start_time
+            self.stdout.write(
+                f"近重复分组: {len(groups)} 组, 涉及 {sum(len(group) for group in groups)} 个版本 "
+                f"(可跳过向量检索的版本: {sum(len(group) - 1 for group in groups)})，分组耗时: {duration:.2f} 秒"
+            )
@@ -0,0 +1,46 @@
+# back/apps/analysis/management/commands/embedding_model_info.py
+
+import os
+import time
+from django.core.management.base import BaseCommand
+from apps.analysis.utils import (
+    enable_embedding_model, get_active_model_spec, get_embedding_model, get_embedding_model_stats,
+    get_embedding_model_version
+)
+
+
+class Command(BaseCommand):
+    help = '输出当前进程的 embedding 模型加载状态、加载耗时和内存占用，用于对比按需加载前后的启动开销。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--load',
+            action='store_true',
+            help='在本进程中加载模型并测量加载耗时和峰值内存变化。',
+        )
+
+    def handle(self, *args, **options):
+        stats = get_embedding_model_stats()
+        model_name, backend_name, _ = get_active_model_spec()
+        self.stdout.write(self.style.NOTICE(
+            f"模型: {model_name}, 后端: {backend_name}, 版本号: {get_embedding_model_version()}, 进程 PID: {os.getpid()}"
+        ))
+        self.stdout.write(f"启动后 (未加载模型) 峰值 RSS: {stats['current_max_rss_kb']} KB")
+        self.stdout.write(f"本进程是否允许加载模型: {stats['enabled']}, 是否已加载: {stats['loaded']}")
+
+        if not options['load']:
+            return
+
+        enable_embedding_model()
+        start_time = time.perf_counter()
+        model = get_embedding_model()
+        duration = time.perf_counter() - start_time
+        if model is None:
+            self.stderr.write(self.style.ERROR("模型加载失败，请查看日志。"))
+            return
+
+        stats = get_embedding_model_stats()
+        rss_delta = stats['rss_after_kb'] - stats['rss_before_kb']
+        self.stdout.write(self.style.SUCCESS(f"模型加载完成，耗时: {duration:.2f} 秒"))
+        self.stdout.write(f"加载前峰值 RSS: {stats['rss_before_kb']} KB")
+        self.stdout.write(f"加载后峰值 RSS: {stats['rss_after_kb']} KB (增加 {rss_delta} KB)")
@@ -0,0 +1,49 @@
+# back/apps/analysis/management/commands/export_onnx_model.py
+
+import os
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from apps.analysis.backends import ONNX_FP32_FILE, ONNX_INT8_FILE, get_onnx_model_dir
+from apps.analysis.utils import MODEL_NAME
+
+
+class Command(BaseCommand):
+    help = ('准备 ONNX 后端 (EMBEDDING_BACKEND=onnx) 使用的模型文件：从 HuggingFace 下载 '
+            f'{MODEL_NAME} 的 ONNX 导出与 tokenizer，可选地生成 int8 动态量化模型。'
+            '需要安装 huggingface_hub 和 onnxruntime。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', default=f'sentence-transformers/{MODEL_NAME}', help='HuggingFace 模型仓库。')
+        parser.add_argument('--output-dir', default=None, help='输出目录，默认为 EMBEDDING_ONNX_MODEL_DIR。')
+        parser.add_argument('--quantize', action='store_true', help=f'额外生成 int8 动态量化模型 ({ONNX_INT8_FILE})。')
+
+    def handle(self, *args, **options):
+        try:
+            from huggingface_hub import hf_hub_download
+        except ImportError:
+            raise CommandError("需要安装 huggingface_hub。")
+
+        output_dir = options['output_dir'] or get_onnx_model_dir(MODEL_NAME)
+        os.makedirs(output_dir, exist_ok=True)
+        fp32_path = os.path.join(output_dir, ONNX_FP32_FILE)
+
+        with tempfile.TemporaryDirectory() as download_dir:
+            self.stdout.write(f"正在从 {options['repo']} 下载 tokenizer 和 ONNX 模型...")
+            tokenizer_path = hf_hub_download(options['repo'], 'tokenizer.json', local_dir=download_dir)
+            model_path = hf_hub_download(options['repo'], 'onnx/model.onnx', local_dir=download_dir)
+            shutil.copy(tokenizer_path, os.path.join(output_dir, 'tokenizer.json'))
+            shutil.copy(model_path, fp32_path)
+        self.stdout.write(self.style.SUCCESS(f"已写入 {fp32_path}"))
+
+        if options['quantize']:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+            self.stdout.write("正在生成 int8 动态量化模型...")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+            self.stdout.write(self.style.SUCCESS(f"已写入 {int8_path}"))
+
+        self.stdout.write(self.style.NOTICE(
+            "设置 TCMS_EMBEDDING_BACKEND=onnx (int8 另需 TCMS_EMBEDDING_ONNX_INT8=1) 后，"
+            "可先用 benchmark_embedding_backends 核对与当前后端的一致性。"
+        ))
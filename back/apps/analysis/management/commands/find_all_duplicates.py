@@ -1,19 +1,48 @@
 # back/apps/analysis/management/commands/find_all_duplicates.py
 
 import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from apps.testcases.models import TestCaseVersion
 # 导入需要触发的任务
-from apps.analysis.tasks import find_and_store_duplicate_pairs_task
+from apps.analysis.tasks import find_and_store_duplicate_pairs_task, find_duplicates_bulk_task
+from apps.analysis.duplicates import run_duplicate_scan, get_projects_with_embeddings
+from apps.analysis.queues import DUPLICATES_QUEUE, wait_for_queue_capacity
 from logging import getLogger
 from itertools import islice # 用于批处理数据库查询迭代
 
 logger = getLogger(__name__)
 
+# 每派发多少个任务检查一次队列深度
+BACKPRESSURE_CHECK_EVERY = 100
+
 class Command(BaseCommand):
-    help = '为所有已生成 embedding 的 TestCaseVersion 派发 Celery 任务以查找并存储潜在重复对。'
+    help = '为所有已生成 embedding 的 TestCaseVersion 查找并存储潜在重复对 (逐版本派发 Celery 任务，或按项目批量计算)。'
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=['fanout', 'bulk', 'incremental'],
+            default='fanout',
+            help='fanout: 每个版本派发一个查找任务 (原有方式)；bulk: 按项目将 embedding 读入矩阵批量计算 top-k 并批量写入；'
+                 'incremental: 只比较上次完成扫描之后 embedding 新增或变化的版本 (没有历史扫描时退化为 bulk)。',
+        )
+        parser.add_argument(
+            '--project',
+            type=int,
+            default=None,
+            help='(bulk/incremental 模式) 只处理指定项目 ID。默认处理所有存在 embedding 的项目。',
+        )
+        parser.add_argument(
+            '--active-only',
+            action='store_true',
+            help='(bulk/incremental 模式) 只比较活动版本。',
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='(bulk/incremental 模式) 在当前进程中直接执行，而不是派发 Celery 任务。',
+        )
         parser.add_argument(
             '--threshold',
             type=float,
@@ -35,8 +64,14 @@ class Command(BaseCommand):
         parser.add_argument(
             '--delay-ms',
             type=int,
-            default=10, # 在派发每个任务之间添加少量延迟，防止瞬间冲击 Celery
-            help='派发每个查找任务之间的延迟（毫秒）。',
+            default=0, # 派发节奏由 --max-queue-depth 背压控制，一般不再需要固定延迟
+            help='派发每个查找任务之间的额外延迟（毫秒），默认 0。',
+        )
+        parser.add_argument(
+            '--max-queue-depth',
+            type=int,
+            default=getattr(settings, 'DUPLICATES_MAX_QUEUE_DEPTH', 500),
+            help='duplicates 队列中等待的任务数达到该值时暂停派发 (0 表示不限制)。',
         )
 
     def handle(self, *args, **options):
@@ -57,8 +92,13 @@ class Command(BaseCommand):
              self.stderr.write(self.style.ERROR("数据库查询批处理大小必须大于 0。"))
              return
 
+        if options['mode'] in ('bulk', 'incremental'):
+            self.handle_bulk(similarity_threshold, limit_per_source, options)
+            return
+
         self.stdout.write(self.style.NOTICE(
-            f"开始派发相似度查找任务。阈值: {similarity_threshold}, 每个源限制: {limit_per_source}, 派发延迟: {delay_ms}ms"
+            f"开始派发相似度查找任务。阈值: {similarity_threshold}, 每个源限制: {limit_per_source}, "
+            f"队列深度上限: {options['max_queue_depth']}, 派发延迟: {delay_ms}ms"
         ))
 
         # 查询所有 embedding 不为空的版本 ID
@@ -79,6 +119,8 @@ class Command(BaseCommand):
 
         # 遍历版本 ID 并派发任务
         for version_id in version_ids_iterator:
+            if total_dispatched % BACKPRESSURE_CHECK_EVERY == 0:
+                wait_for_queue_capacity(DUPLICATES_QUEUE, options['max_queue_depth'])
             try:
                 # 异步调用 Celery 任务，传递参数
                 find_and_store_duplicate_pairs_task.delay(
@@ -119,4 +161,51 @@ class Command(BaseCommand):
         self.stdout.write(f"总耗时: {duration:.2f} 秒")
         self.stdout.write(self.style.NOTICE(
             "Celery worker 现在将在后台处理这些相似度查找和存储任务。"
-        )) 
\ No newline at end of file
+        )) 
+
+    def handle_bulk(self, similarity_threshold, limit_per_source, options):
+        """按项目批量 (或增量) 检测：每个项目一次计算、一次批量 upsert。"""
+        project_id = options['project']
+        active_only = options['active_only']
+        incremental = options['mode'] == 'incremental'
+
+        if not options['sync']:
+            find_duplicates_bulk_task.delay(
+                project_id=project_id,
+                similarity_threshold=similarity_threshold,
+                limit_per_source=limit_per_source,
+                active_only=active_only,
+                incremental=incremental,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"已派发{'增量' if incremental else '批量'}重复检测任务 (项目: {project_id or '全部'}, 阈值: {similarity_threshold}, 每个源限制: {limit_per_source})。"
+            ))
+            return
+
+        project_ids = [project_id] if project_id is not None else get_projects_with_embeddings()
+        if not project_ids:
+            self.stdout.write(self.style.WARNING("没有找到任何已生成 embedding 的版本。"))
+            return
+
+        self.stdout.write(self.style.NOTICE(
+            f"开始{'增量' if incremental else '批量'}重复检测。项目数: {len(project_ids)}, 阈值: {similarity_threshold}, 每个源限制: {limit_per_source}, 仅活动版本: {active_only}"
+        ))
+        start_time = time.time()
+        total_pairs = 0
+        for current_project_id in project_ids:
+            stats = run_duplicate_scan(
+                project_id=current_project_id,
+                incremental=incremental,
+                similarity_threshold=similarity_threshold,
+                limit_per_source=limit_per_source,
+                active_only=active_only,
+            )
+            total_pairs += stats['pairs']
+            mode_display = '增量' if stats['mode'] == 'incremental' else '全量'
+            self.stdout.write(
+                f"项目 {current_project_id} ({mode_display}): 扫描 {stats['versions']} 个版本, "
+                f"写入 {stats['pairs']} 对, 撤销 {stats['retired']} 对失效配对, 更新 {stats['clusters_changed']} 个重复簇"
+            )
+
+        duration = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(f"\n重复检测完成。共写入 {total_pairs} 对，总耗时: {duration:.2f} 秒"))
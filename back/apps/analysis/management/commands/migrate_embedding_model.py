@@ -0,0 +1,164 @@
+# back/apps/analysis/management/commands/migrate_embedding_model.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.analysis.backends import EMBEDDING_BACKENDS, get_backend_name
+from apps.analysis.models import EmbeddingModelMigration
+from apps.analysis.model_migration import (
+    ModelMigrationError, build_shadow_indexes, cancel, cutover, finalize, get_active_migration,
+    missing_shadow_indexes, outdated_versions_queryset, refresh_progress, rollback, run_migration, start_migration
+)
+from apps.analysis.queues import EMBEDDING_BULK_QUEUE
+from apps.analysis.tasks import generate_embeddings_batch_task, run_embedding_model_migration_task
+from apps.analysis.utils import get_embedding_model_version
+
+
+class Command(BaseCommand):
+    help = ('在影子列中用新模型重新生成 embedding，覆盖完成后原子切换，线上检索全程使用同一模型的向量。'
+            '典型流程: --start --model NAME -> --dispatch (或 --run) -> --build-indexes -> --cutover '
+            '-> (--rollback) -> --finalize。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true', help='显示进行中迁移的进度 (默认操作)。')
+        parser.add_argument('--start', action='store_true', help='开始迁移到 --model/--backend 指定的模型。')
+        parser.add_argument('--model', type=str, help='目标模型名称。')
+        parser.add_argument('--backend', choices=EMBEDDING_BACKENDS, help='目标推理后端 (默认 settings.EMBEDDING_BACKEND)。')
+        parser.add_argument('--quantized', action='store_true', help='onnx 后端使用 int8 量化模型。')
+        parser.add_argument('--run', action='store_true', help='在当前进程内为影子列生成向量，直到覆盖完成。')
+        parser.add_argument('--dispatch', action='store_true', help='派发 Celery 任务在 embedding_bulk 队列后台生成。')
+        parser.add_argument('--batch-size', type=int, default=256, help='每批处理的版本数。')
+        parser.add_argument('--encode-batch-size', type=int, default=32, help='--run 时传给 encode 的 batch_size。')
+        parser.add_argument('--build-indexes', action='store_true', help='并发建立指向影子列的孪生索引。')
+        parser.add_argument('--cutover', action='store_true', help='原子切换到新模型的向量。')
+        parser.add_argument('--rollback', action='store_true', help='切回旧模型的向量。')
+        parser.add_argument('--finalize', action='store_true', help='删除旧向量的孪生索引并清空影子列。')
+        parser.add_argument('--cancel', action='store_true', help='放弃尚未切换的迁移。')
+        parser.add_argument('--repair', action='store_true',
+                            help='为线上向量不是当前模型生成的版本派发重新生成任务 (切换后执行)。')
+
+    def handle(self, *args, **options):
+        try:
+            if options['start']:
+                return self.handle_start(options)
+            if options['repair']:
+                return self.handle_repair(options)
+
+            migration = get_active_migration()
+            if migration is None:
+                self.stdout.write(f"没有进行中的模型迁移。当前模型版本: {get_embedding_model_version()}")
+                return
+
+            if options['run']:
+                self.handle_run(migration, options)
+            elif options['dispatch']:
+                run_embedding_model_migration_task.delay(migration.pk, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"已派发模型迁移 #{migration.pk} 的后台任务 (队列 {EMBEDDING_BULK_QUEUE})，可用 --status 查看进度。"
+                ))
+            elif options['build_indexes']:
+                self.handle_build_indexes()
+            elif options['cutover']:
+                cutover(migration)
+                self.stdout.write(self.style.SUCCESS(
+                    f"已切换到 {migration.model_version}。各进程将在 EMBEDDING_MODEL_SPEC_TTL 秒内加载新模型。"
+                    f"确认无误后执行 --finalize；切换瞬间的少量旧模型写入可用 --repair 修复。"
+                ))
+            elif options['rollback']:
+                invalidated = rollback(migration)
+                self.stdout.write(self.style.SUCCESS(f"已切回 {migration.source_model_version}。"))
+                if invalidated:
+                    self.stdout.write(self.style.WARNING(
+                        f"{invalidated} 个版本在切换后被修改，其 embedding 已清空，请执行 backfill_embeddings。"
+                    ))
+            elif options['finalize']:
+                stats = finalize(migration)
+                self.stdout.write(self.style.SUCCESS(
+                    f"模型迁移 #{migration.pk} 完成。删除孪生索引 {stats['indexes_dropped']} 个，"
+                    f"清空影子列 {stats['versions_cleared']} 行。"
+                ))
+            elif options['cancel']:
+                stats = cancel(migration)
+                self.stdout.write(self.style.SUCCESS(
+                    f"模型迁移 #{migration.pk} 已取消。删除孪生索引 {stats['indexes_dropped']} 个，"
+                    f"清空影子列 {stats['versions_cleared']} 行。"
+                ))
+            else:
+                self.show_status(migration)
+        except ModelMigrationError as e:
+            raise CommandError(str(e))
+
+    def handle_start(self, options):
+        if not options['model']:
+            raise CommandError("--start 需要 --model。")
+        migration = start_migration(options['model'], options['backend'] or get_backend_name(),
+                                    quantized=options['quantized'])
+        self.stdout.write(self.style.SUCCESS(
+            f"已创建模型迁移 #{migration.pk}: {migration.source_model_version} -> {migration.model_version}，"
+            f"需迁移 {migration.versions_total} 个版本。接下来执行 --dispatch 或 --run。"
+        ))
+
+    def handle_run(self, migration, options):
+        start_time = time.time()
+        done = 0
+
+        def on_progress(current, processed):
+            nonlocal done
+            done += processed
+            rate = done / max(time.time() - start_time, 1e-6)
+            self.stdout.write(
+                f"  第 {current.passes + 1} 轮, 检查点 {current.last_version_id}, 本次已生成 {done} 个 ({rate:.1f} 个/秒)"
+            )
+
+        self.stdout.write(self.style.NOTICE(
+            f"为模型迁移 #{migration.pk} 生成影子向量 ({migration.model_version})，待生成约 {migration.versions_pending} 个。"
+        ))
+        try:
+            migration = run_migration(migration, batch_size=options['batch_size'],
+                                      encode_batch_size=options['encode_batch_size'], on_progress=on_progress)
+        except KeyboardInterrupt:
+            self.stderr.write(self.style.WARNING("\n已中断，重新执行 --run 会从检查点继续。"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"影子向量已全部生成，耗时 {time.time() - start_time:.2f} 秒。接下来执行 --build-indexes 和 --cutover。"
+        ))
+
+    def handle_build_indexes(self):
+        start_time = time.time()
+        created = build_shadow_indexes(on_index=lambda name: self.stdout.write(f"  建立孪生索引 {name} ..."))
+        self.stdout.write(self.style.SUCCESS(
+            f"新建孪生索引 {len(created)} 个，耗时 {time.time() - start_time:.2f} 秒。"
+        ))
+
+    def handle_repair(self, options):
+        queryset = outdated_versions_queryset().order_by('id')
+        total = queryset.count()
+        if not total:
+            self.stdout.write(self.style.SUCCESS("所有线上向量都由当前模型生成。"))
+            return
+        after_id = 0
+        dispatched = 0
+        while True:
+            ids = list(queryset.filter(id__gt=after_id).values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            generate_embeddings_batch_task.delay(ids)
+            dispatched += len(ids)
+            after_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f"已为 {dispatched} 个版本派发重新生成任务 (当前模型版本 {get_embedding_model_version()})。"
+        ))
+
+    def show_status(self, migration: EmbeddingModelMigration):
+        if migration.status in ('embedding', 'ready'):
+            refresh_progress(migration)
+        self.stdout.write(f"模型迁移 #{migration.pk}: {migration.source_model_version} -> {migration.model_version}")
+        self.stdout.write(f"  状态: {migration.get_status_display()}, 开始于 {migration.started_at:%Y-%m-%d %H:%M:%S}")
+        self.stdout.write(
+            f"  覆盖率: {migration.coverage:.1%} ({migration.versions_total - migration.versions_pending}"
+            f"/{migration.versions_total}), 待生成 {migration.versions_pending}, 已完成扫描 {migration.passes} 轮"
+        )
+        if migration.status in ('embedding', 'ready'):
+            missing = missing_shadow_indexes()
+            self.stdout.write(f"  缺少孪生索引: {', '.join(missing) if missing else '无'}")
+        if migration.cutover_at:
+            self.stdout.write(f"  切换时间: {migration.cutover_at:%Y-%m-%d %H:%M:%S}")
@@ -0,0 +1,34 @@
+# back/apps/analysis/management/commands/rebuild_duplicate_clusters.py
+
+import time
+from django.core.management.base import BaseCommand
+from apps.analysis.clusters import rebuild_clusters, get_cluster_threshold
+from apps.analysis.duplicates import get_projects_with_embeddings
+
+
+class Command(BaseCommand):
+    help = ('根据已有的重复配对全量重建重复簇 (union-find 连通分量)。'
+            '重复扫描会自动维护簇，此命令用于首次上线或调整 DUPLICATE_CLUSTER_THRESHOLD 之后。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='只重建指定项目的簇。')
+        parser.add_argument('--threshold', type=float,
+                            help='参与聚类的最低相似度 (默认 settings.DUPLICATE_CLUSTER_THRESHOLD)。')
+
+    def handle(self, *args, **options):
+        threshold = options['threshold'] if options['threshold'] is not None else get_cluster_threshold()
+        project_ids = [options['project']] if options['project'] else get_projects_with_embeddings()
+        self.stdout.write(self.style.NOTICE(f"重建 {len(project_ids)} 个项目的重复簇，阈值 {threshold}"))
+
+        start_time = time.time()
+        total_clusters = 0
+        for project_id in project_ids:
+            stats = rebuild_clusters(project_id, threshold=threshold)
+            total_clusters += stats['clusters']
+            self.stdout.write(
+                f"项目 {project_id}: {stats['clusters']} 个簇, {stats['versions']} 个版本 "
+                f"(新建 {stats['created']}, 更新 {stats['updated']}, 删除 {stats['deleted']})"
+            )
+
+        duration = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(f"完成。共 {total_clusters} 个重复簇，耗时: {duration:.2f} 秒"))
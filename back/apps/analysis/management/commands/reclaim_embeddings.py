@@ -0,0 +1,30 @@
+# back/apps/analysis/management/commands/reclaim_embeddings.py
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.policy import get_embedding_policy, get_on_demand_ttl, reclaim_embeddings
+
+
+class Command(BaseCommand):
+    help = ('按 EMBEDDING_POLICY=active 回收非活动 (历史) 版本的 embedding。'
+            '版本停用时信号会自动回收，此命令用于清理切换策略之前积累的历史向量，'
+            '以及超过 EMBEDDING_ON_DEMAND_TTL_HOURS 的按需生成的向量。'
+            '回收后建议执行 REINDEX INDEX CONCURRENTLY 收缩 HNSW 索引。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计可回收的版本数量，不做修改。')
+
+    def handle(self, *args, **options):
+        if get_embedding_policy() != 'active':
+            self.stdout.write(self.style.WARNING("当前 EMBEDDING_POLICY 不是 active，不回收任何向量。"))
+            return
+
+        candidates = TestCaseVersion.objects.filter(is_active=False, embedding__isnull=False).exclude(
+            embedding_updated_at__gte=timezone.now() - get_on_demand_ttl()).count()
+        if options['dry_run']:
+            self.stdout.write(f"可回收 embedding 的非活动版本: {candidates}")
+            return
+
+        reclaimed = reclaim_embeddings()
+        self.stdout.write(self.style.SUCCESS(f"已回收 {reclaimed} 个非活动版本的 embedding。"))
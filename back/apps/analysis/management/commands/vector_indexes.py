@@ -0,0 +1,108 @@
+# back/apps/analysis/management/commands/vector_indexes.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from apps.testcases.models import TestCaseVersion
+from apps.analysis.utils import get_model_dimension
+
+INDEX_PREFIX = 'tcversion_emb_p'
+
+# 量化布局的索引表达式与操作符类，必须与 utils.similar_versions_queryset 中的检索表达式一致
+QUANTIZED_LAYOUTS = {
+    'halfvec': ('(embedding::halfvec({dim}))', 'halfvec_cosine_ops', 'half'),
+    'binary': ('(binary_quantize(embedding)::bit({dim}))', 'bit_hamming_ops', 'bin'),
+}
+
+
+def project_index_name(project_id: int, active_only: bool) -> str:
+    return f"{INDEX_PREFIX}{project_id}{'a' if active_only else ''}_hnsw_idx"
+
+
+def quantized_index_name(layout: str, active_only: bool) -> str:
+    return f"tcversion_emb_{QUANTIZED_LAYOUTS[layout][2]}{'a' if active_only else ''}_hnsw_idx"
+
+
+def quantized_index_sql(table: str, index_name: str, layout: str, active_only: bool,
+                        m: int = 16, ef_construction: int = 64, concurrently: bool = True) -> str:
+    expression, opclass, _ = QUANTIZED_LAYOUTS[layout]
+    sql = (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {index_name} ON {table} "
+        f"USING hnsw ({expression.format(dim=get_model_dimension())} {opclass}) "
+        f"WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+    )
+    if active_only:
+        sql += " WHERE is_active"
+    return sql
+
+
+class Command(BaseCommand):
+    help = ('管理按项目划分的部分 HNSW 向量索引 (WHERE project_id = N)，以及量化布局 (halfvec / binary) 的 HNSW 索引。'
+            '大项目使用专属索引后，项目内检索不再需要扫描全局 HNSW 图再做后过滤。'
+            '切换到量化布局的步骤：--create-quantized 建索引 -> benchmark_vector_storage 核对召回率 -> '
+            '设置 TCMS_VECTOR_STORAGE；回退只需把 TCMS_VECTOR_STORAGE 改回 float32。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='列出 TestCaseVersion 表上的所有 HNSW 索引及其大小。')
+        parser.add_argument('--create-project', type=int, metavar='PROJECT_ID', help='为指定项目创建部分 HNSW 索引。')
+        parser.add_argument('--drop-project', type=int, metavar='PROJECT_ID', help='删除指定项目的部分 HNSW 索引。')
+        parser.add_argument('--create-quantized', choices=sorted(QUANTIZED_LAYOUTS), help='创建量化布局的 HNSW 索引。')
+        parser.add_argument('--drop-quantized', choices=sorted(QUANTIZED_LAYOUTS), help='删除量化布局的 HNSW 索引。')
+        parser.add_argument('--active-only', action='store_true', help='索引只包含该项目的活动版本。')
+        parser.add_argument('--m', type=int, default=16, help='HNSW 参数 m (默认 16，与全局索引一致)。')
+        parser.add_argument('--ef-construction', type=int, default=64, help='HNSW 参数 ef_construction (默认 64)。')
+
+    def handle(self, *args, **options):
+        table = TestCaseVersion._meta.db_table
+        active_only = options['active_only']
+
+        if options['create_project'] is not None:
+            project_id = options['create_project']
+            index_name = project_index_name(project_id, active_only)
+            condition = f"project_id = {int(project_id)}"
+            if active_only:
+                condition += " AND is_active"
+            self.stdout.write(f"正在创建索引 {index_name} (CONCURRENTLY，不阻塞写入)...")
+            # CREATE INDEX CONCURRENTLY 不能在事务中执行，管理命令默认处于 autocommit 模式
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} "
+                    f"USING hnsw (embedding vector_cosine_ops) "
+                    f"WITH (m = {int(options['m'])}, ef_construction = {int(options['ef_construction'])}) "
+                    f"WHERE {condition}"
+                )
+            self.stdout.write(self.style.SUCCESS(f"索引 {index_name} 已创建。"))
+        elif options['drop_project'] is not None:
+            index_name = project_index_name(options['drop_project'], active_only)
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            self.stdout.write(self.style.SUCCESS(f"索引 {index_name} 已删除。"))
+        elif options['create_quantized']:
+            layout = options['create_quantized']
+            index_name = quantized_index_name(layout, active_only)
+            self.stdout.write(f"正在创建索引 {index_name} (CONCURRENTLY，不阻塞写入)...")
+            with connection.cursor() as cursor:
+                cursor.execute(quantized_index_sql(
+                    table, index_name, layout, active_only, options['m'], options['ef_construction']
+                ))
+            self.stdout.write(self.style.SUCCESS(
+                f"索引 {index_name} 已创建。设置 TCMS_VECTOR_STORAGE={layout} 后检索将使用该索引。"
+            ))
+        elif options['drop_quantized']:
+            index_name = quantized_index_name(options['drop_quantized'], active_only)
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            self.stdout.write(self.style.SUCCESS(f"索引 {index_name} 已删除。"))
+        elif options['list']:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT indexname, pg_size_pretty(pg_relation_size(quote_ident(indexname)::regclass)), indexdef "
+                    "FROM pg_indexes WHERE tablename = %s AND indexdef ILIKE %s ORDER BY indexname",
+                    [table, '%USING hnsw%'],
+                )
+                rows = cursor.fetchall()
+            if not rows:
+                self.stdout.write(self.style.WARNING("没有找到 HNSW 索引。"))
+            for name, size, definition in rows:
+                self.stdout.write(f"{name} ({size})\n    {definition}")
+        else:
+            raise CommandError("请指定 --list、--create-project、--drop-project、--create-quantized 或 --drop-quantized。")
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("projects", "0001_initial"),
+        ("analysis", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DuplicateScanRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "mode",
+                    models.CharField(
+                        choices=[("full", "全量"), ("incremental", "增量")],
+                        default="full",
+                        max_length=20,
+                        verbose_name="扫描模式",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "运行中"),
+                            ("completed", "已完成"),
+                            ("failed", "失败"),
+                        ],
+                        default="running",
+                        max_length=20,
+                        verbose_name="状态",
+                    ),
+                ),
+                (
+                    "watermark",
+                    models.DateTimeField(blank=True, null=True, verbose_name="水位线"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="开始时间"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="完成时间"
+                    ),
+                ),
+                (
+                    "versions_scanned",
+                    models.PositiveIntegerField(default=0, verbose_name="扫描版本数"),
+                ),
+                (
+                    "pairs_stored",
+                    models.PositiveIntegerField(default=0, verbose_name="写入配对数"),
+                ),
+                (
+                    "pairs_retired",
+                    models.PositiveIntegerField(default=0, verbose_name="撤销配对数"),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="duplicate_scan_runs",
+                        to="projects.project",
+                        verbose_name="所属项目",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "重复检测扫描记录",
+                "verbose_name_plural": "重复检测扫描记录",
+                "ordering": ["-started_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["project", "status", "-started_at"],
+                        name="dupscan_proj_status_idx",
+                    )
+                ],
+            },
+        ),
+    ]
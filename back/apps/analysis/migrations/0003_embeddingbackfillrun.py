@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analysis", "0002_duplicatescanrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingBackfillRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "mode",
+                    models.CharField(
+                        choices=[
+                            ("dispatch", "派发 Celery 任务"),
+                            ("local", "进程内编码"),
+                        ],
+                        default="dispatch",
+                        max_length=20,
+                        verbose_name="回填模式",
+                    ),
+                ),
+                (
+                    "force_rebuild",
+                    models.BooleanField(default=False, verbose_name="强制重建"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "运行中"),
+                            ("completed", "已完成"),
+                            ("failed", "失败"),
+                        ],
+                        default="running",
+                        max_length=20,
+                        verbose_name="状态",
+                    ),
+                ),
+                (
+                    "last_version_id",
+                    models.BigIntegerField(default=0, verbose_name="检查点版本ID"),
+                ),
+                (
+                    "total_estimate",
+                    models.PositiveIntegerField(default=0, verbose_name="预计版本数"),
+                ),
+                (
+                    "versions_processed",
+                    models.PositiveIntegerField(default=0, verbose_name="已处理版本数"),
+                ),
+                (
+                    "versions_updated",
+                    models.PositiveIntegerField(default=0, verbose_name="已写回版本数"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="开始时间"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="完成时间"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Embedding 回填记录",
+                "verbose_name_plural": "Embedding 回填记录",
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
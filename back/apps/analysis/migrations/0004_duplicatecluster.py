@@ -0,0 +1,144 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("projects", "0001_initial"),
+        ("testcases", "0007_testcaseversion_project_and_active_index"),
+        ("analysis", "0003_embeddingbackfillrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DuplicateCluster",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("size", models.PositiveIntegerField(default=0, verbose_name="成员数")),
+                (
+                    "max_similarity",
+                    models.FloatField(default=0.0, verbose_name="最高相似度"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "待处理"),
+                            ("confirmed", "已确认重复"),
+                            ("ignored", "非重复"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="状态",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "重复用例簇",
+                "verbose_name_plural": "重复用例簇",
+                "ordering": ["-size", "-max_similarity"],
+            },
+        ),
+        migrations.CreateModel(
+            name="DuplicateClusterMember",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "similarity_to_representative",
+                    models.FloatField(
+                        blank=True, null=True, verbose_name="与代表版本的相似度"
+                    ),
+                ),
+                (
+                    "cluster",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="memberships",
+                        to="analysis.duplicatecluster",
+                        verbose_name="所属簇",
+                    ),
+                ),
+                (
+                    "version",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="duplicate_cluster_membership",
+                        to="testcases.testcaseversion",
+                        verbose_name="版本",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "重复簇成员",
+                "verbose_name_plural": "重复簇成员",
+                "ordering": ["cluster", "-similarity_to_representative"],
+            },
+        ),
+        migrations.AddField(
+            model_name="duplicatecluster",
+            name="members",
+            field=models.ManyToManyField(
+                related_name="duplicate_clusters",
+                through="analysis.DuplicateClusterMember",
+                to="testcases.testcaseversion",
+                verbose_name="成员版本",
+            ),
+        ),
+        migrations.AddField(
+            model_name="duplicatecluster",
+            name="project",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="duplicate_clusters",
+                to="projects.project",
+                verbose_name="所属项目",
+            ),
+        ),
+        migrations.AddField(
+            model_name="duplicatecluster",
+            name="representative",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="represented_duplicate_clusters",
+                to="testcases.testcaseversion",
+                verbose_name="代表版本",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="duplicatecluster",
+            index=models.Index(
+                fields=["project", "status"], name="dupcluster_proj_status_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analysis", "0004_duplicatecluster"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingModelMigration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model_name",
+                    models.CharField(max_length=200, verbose_name="目标模型"),
+                ),
+                ("backend", models.CharField(max_length=50, verbose_name="推理后端")),
+                (
+                    "quantized",
+                    models.BooleanField(default=False, verbose_name="int8 量化"),
+                ),
+                (
+                    "model_version",
+                    models.CharField(max_length=100, verbose_name="目标模型版本号"),
+                ),
+                (
+                    "source_model_version",
+                    models.CharField(
+                        blank=True, max_length=100, verbose_name="原模型版本号"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("embedding", "生成影子向量中"),
+                            ("ready", "可切换"),
+                            ("cutover", "已切换"),
+                            ("finalized", "已完成"),
+                            ("rolled_back", "已回滚"),
+                            ("cancelled", "已取消"),
+                        ],
+                        default="embedding",
+                        max_length=20,
+                        verbose_name="状态",
+                    ),
+                ),
+                (
+                    "last_version_id",
+                    models.BigIntegerField(default=0, verbose_name="检查点版本ID"),
+                ),
+                (
+                    "passes",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="已完成扫描轮数"
+                    ),
+                ),
+                (
+                    "versions_total",
+                    models.PositiveIntegerField(default=0, verbose_name="需迁移版本数"),
+                ),
+                (
+                    "versions_pending",
+                    models.PositiveIntegerField(default=0, verbose_name="待生成版本数"),
+                ),
+                (
+                    "versions_embedded",
+                    models.PositiveIntegerField(default=0, verbose_name="已生成版本数"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="开始时间"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+                (
+                    "cutover_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="切换时间"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="结束时间"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Embedding 模型迁移",
+                "verbose_name_plural": "Embedding 模型迁移",
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
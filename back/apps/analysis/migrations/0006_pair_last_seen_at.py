@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 13:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analysis", "0005_embeddingmodelmigration"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="potentialduplicatepair",
+            name="last_seen_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name="最近检出时间"),
+        ),
+    ]
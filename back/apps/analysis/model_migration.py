@@ -0,0 +1,409 @@
+# back/apps/analysis/model_migration.py
+"""
+Embedding 模型迁移：影子列 + 原子切换。
+
+更换模型 (MODEL_NAME、后端或量化方式) 时不再 --force-rebuild 原地覆盖向量 (覆盖期间新旧向量混在
+同一个索引里，检索质量下降)，而是分阶段进行：
+
+    1. start     创建 EmbeddingModelMigration，记录目标模型版本号。
+    2. run       后台按版本 ID 分批用目标模型编码，写入影子列 embedding_shadow /
+                 embedding_shadow_model_version / embedding_shadow_updated_at。线上检索和增量
+                 embedding 仍使用旧模型与 embedding 列。影子向量对应的内容时间早于
+                 embedding_updated_at (迁移期间内容被修改) 的版本会在下一轮扫描中重新生成。
+    3. indexes   为 embedding 列上的每个索引 (HNSW、部分索引、量化表达式索引等) 用
+                 CREATE INDEX CONCURRENTLY 建立指向影子列的孪生索引 (名称加 _shadow 后缀)。
+    4. cutover   在一个事务内锁表 (EXCLUSIVE，复核期间只阻塞写入)、复核覆盖率，然后把三组列与每对索引互相改名。
+                 改名需要 ACCESS EXCLUSIVE 锁，从改名到提交期间读取也会等待，因此事务内只做改名和
+                 更新迁移记录；改名只修改系统目录，瞬间完成。迁移记录变为 cutover 后，get_active_model_spec()
+                 据此切换到新模型，各进程在 EMBEDDING_MODEL_SPEC_TTL 秒内跟进。
+                 切换 (及回滚) 之后的第一次重复扫描自动以全量模式重新计算配对分数与簇 (见 duplicates.run_duplicate_scan)。
+    5. rollback  切换后发现问题时再做一次互换即可回到旧向量 (切换后内容被修改的版本会清空 embedding，
+                 需要重新回填)。
+       finalize  确认后删除旧向量所在的孪生索引并清空影子列。
+
+新模型的输出维度必须与 embedding 字段一致 (768)；维度不同需要先通过 schema 迁移修改字段定义。
+"""
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from django.db import connection, transaction
+from django.db.models import F, Q, QuerySet
+from django.utils import timezone
+from apps.testcases.models import TestCaseVersion
+from .backends import EMBEDDING_BACKENDS, get_onnx_quantized, model_version_for
+from .models import EmbeddingModelMigration
+from .policy import eager_versions_queryset
+from .utils import (
+    EmbeddingBackend, encode_texts, extract_version_text, get_embedding_model_version,
+    invalidate_active_model_spec, load_backend
+)
+
+logger = logging.getLogger(__name__)
+
+# 切换时互换的列：线上列 -> 影子列
+SHADOW_COLUMNS = {
+    'embedding': 'embedding_shadow',
+    'embedding_model_version': 'embedding_shadow_model_version',
+    'embedding_updated_at': 'embedding_shadow_updated_at',
+}
+SHADOW_INDEX_SUFFIX = '_shadow'
+SWAP_SUFFIX = '_swap'
+# 基准测试命令创建的临时索引不需要孪生索引
+IGNORED_INDEX_PREFIXES = ('tcversion_emb_bench_',)
+ACTIVE_STATUSES = ('embedding', 'ready', 'cutover')
+# 切换事务等待表锁的上限，避免排在长查询之后阻塞全部读写
+CUTOVER_LOCK_TIMEOUT = '5s'
+
+_LIVE_COLUMN_RE = re.compile(r'\b(' + '|'.join(SHADOW_COLUMNS) + r')\b')
+_target_backends: Dict[str, EmbeddingBackend] = {}
+
+
+class ModelMigrationError(Exception):
+    """迁移状态不允许执行该操作。"""
+
+
+def get_active_migration() -> Optional[EmbeddingModelMigration]:
+    """返回进行中 (尚未 finalize/回滚/取消) 的迁移。同一时间只允许一个。"""
+    return EmbeddingModelMigration.objects.filter(status__in=ACTIVE_STATUSES).order_by('-started_at').first()
+
+
+def start_migration(model_name: str, backend_name: str, quantized: Optional[bool] = None) -> EmbeddingModelMigration:
+    if backend_name not in EMBEDDING_BACKENDS:
+        raise ModelMigrationError(f"未知的推理后端: {backend_name}")
+    active = get_active_migration()
+    if active:
+        raise ModelMigrationError(f"模型迁移 #{active.pk} 尚未结束 ({active.get_status_display()})。")
+    quantized = bool(get_onnx_quantized() if quantized is None else quantized) and backend_name == 'onnx'
+    model_version = model_version_for(backend_name, model_name, quantized)
+    source_version = get_embedding_model_version()
+    if model_version == source_version:
+        raise ModelMigrationError(f"目标模型版本 {model_version} 与当前生效的版本相同。")
+    migration = EmbeddingModelMigration.objects.create(
+        model_name=model_name,
+        backend=backend_name,
+        quantized=quantized,
+        model_version=model_version,
+        source_model_version=source_version,
+    )
+    refresh_progress(migration)
+    logger.info(f"Started embedding model migration #{migration.pk}: {source_version} -> {model_version}.")
+    return migration
+
+
+def get_target_backend(migration: EmbeddingModelMigration) -> EmbeddingBackend:
+    """加载迁移目标模型 (与当前生效模型相互独立，按版本号缓存在进程内)。"""
+    backend = _target_backends.get(migration.model_version)
+    if backend is None:
+        backend = load_backend(migration.model_name, migration.backend, migration.quantized)
+        _target_backends.clear()
+        _target_backends[migration.model_version] = backend
+    return backend
+
+
+def migration_scope_queryset() -> QuerySet:
+    """需要迁移的版本：当前已有线上向量的版本 (没有线上向量的版本切换后由正常流程生成)。"""
+    return eager_versions_queryset().filter(embedding__isnull=False)
+
+
+def pending_shadow_queryset(migration: EmbeddingModelMigration) -> QuerySet:
+    """影子向量缺失、不是目标版本，或内容在影子向量生成之后被修改过的版本。"""
+    return migration_scope_queryset().filter(
+        Q(embedding_shadow_model_version__isnull=True)
+        | ~Q(embedding_shadow_model_version=migration.model_version)
+        | Q(embedding_shadow_updated_at__lt=F('embedding_updated_at'))
+    )
+
+
+def refresh_progress(migration: EmbeddingModelMigration) -> EmbeddingModelMigration:
+    migration.versions_total = migration_scope_queryset().count()
+    migration.versions_pending = pending_shadow_queryset(migration).count()
+    migration.save(update_fields=['versions_total', 'versions_pending', 'updated_at'])
+    return migration
+
+
+def embed_shadow_batch(migration: EmbeddingModelMigration, backend: EmbeddingBackend,
+                       batch_size: int, encode_batch_size: int = 32) -> Optional[int]:
+    """
+    处理检查点之后的一页待迁移版本，返回处理的版本数；本轮已扫到末尾时返回 None。
+    影子向量的时间取读取文本之前的时刻，之后的任何内容修改都会让它被判定为过期。
+    """
+    read_at = timezone.now()
+    versions = list(
+        pending_shadow_queryset(migration)
+        .filter(id__gt=migration.last_version_id)
+        .order_by('id')
+        .only('id', 'title', 'precondition', 'steps_data')[:batch_size]
+    )
+    if not versions:
+        return None
+
+    texts = [extract_version_text(version) for version in versions]
+    with_text = [(version, text) for version, text in zip(versions, texts) if text]
+    vectors, _ = encode_texts([text for _, text in with_text], batch_size=encode_batch_size, backend=backend) \
+        if with_text else ([], 0)
+    vector_of = {version.id: vector for (version, _), vector in zip(with_text, vectors)}
+    for version in versions:
+        # 没有文本的版本切换后不应有向量，同样标记为已迁移
+        version.embedding_shadow = vector_of.get(version.id)
+        version.embedding_shadow_model_version = migration.model_version
+        version.embedding_shadow_updated_at = read_at
+    TestCaseVersion.objects.bulk_update(
+        versions, ['embedding_shadow', 'embedding_shadow_model_version', 'embedding_shadow_updated_at']
+    )
+
+    migration.last_version_id = versions[-1].id
+    migration.versions_embedded += len(versions)
+    migration.save(update_fields=['last_version_id', 'versions_embedded', 'updated_at'])
+    return len(versions)
+
+
+def run_migration(migration: EmbeddingModelMigration, batch_size: int = 256, encode_batch_size: int = 32,
+                  max_batches: Optional[int] = None,
+                  on_progress: Optional[Callable[[EmbeddingModelMigration, int], None]] = None) -> EmbeddingModelMigration:
+    """
+    为影子列生成向量，直到全部覆盖 (状态变为 ready) 或处理了 max_batches 批。
+    每轮扫到末尾后重新统计：仍有待迁移版本 (期间被修改) 则从头再扫一轮。
+    """
+    if migration.status not in ('embedding', 'ready'):
+        raise ModelMigrationError(f"模型迁移 #{migration.pk} 的状态为 {migration.get_status_display()}，不能继续生成。")
+    backend = get_target_backend(migration)
+    if migration.status == 'ready':
+        migration.status = 'embedding'
+        migration.save(update_fields=['status', 'updated_at'])
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        processed = embed_shadow_batch(migration, backend, batch_size, encode_batch_size)
+        if processed is None:
+            migration.passes += 1
+            migration.last_version_id = 0
+            migration.save(update_fields=['passes', 'last_version_id', 'updated_at'])
+            refresh_progress(migration)
+            if migration.versions_pending == 0:
+                migration.status = 'ready'
+                migration.save(update_fields=['status', 'updated_at'])
+                logger.info(f"Embedding model migration #{migration.pk} is ready for cutover.")
+                break
+            continue
+        batches += 1
+        if on_progress:
+            on_progress(migration, processed)
+    return migration
+
+
+# --- 孪生索引 ---
+
+def _suffixed(name: str, suffix: str) -> str:
+    # PostgreSQL 标识符最长 63 字节
+    return name[:63 - len(suffix)] + suffix
+
+
+def _index_definitions() -> Dict[str, Tuple[str, bool]]:
+    """返回表上全部索引 {名称: (定义, 是否有效)}。"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisvalid "
+            "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass",
+            [TestCaseVersion._meta.db_table],
+        )
+        return {name: (definition, valid) for name, definition, valid in cursor.fetchall()}
+
+
+def live_index_definitions() -> Dict[str, str]:
+    """引用了线上向量列 (embedding / embedding_model_version / embedding_updated_at) 的索引。"""
+    live = {}
+    for name, (definition, _) in _index_definitions().items():
+        if name.endswith(SHADOW_INDEX_SUFFIX) or name.startswith(IGNORED_INDEX_PREFIXES):
+            continue
+        if _LIVE_COLUMN_RE.search(definition.split(' USING ', 1)[-1]):
+            live[name] = definition
+    return live
+
+
+def shadow_index_sql(name: str, definition: str) -> str:
+    """把索引定义中的线上列替换为影子列，生成 CREATE INDEX CONCURRENTLY 语句。"""
+    head, body = definition.split(' ON ', 1)
+    body = _LIVE_COLUMN_RE.sub(lambda match: SHADOW_COLUMNS[match.group(1)], body)
+    head = head.replace(f"INDEX {name}", f"INDEX CONCURRENTLY IF NOT EXISTS {_suffixed(name, SHADOW_INDEX_SUFFIX)}", 1)
+    return f"{head} ON {body}"
+
+
+def missing_shadow_indexes() -> List[str]:
+    """还没有有效孪生索引的线上索引。"""
+    definitions = _index_definitions()
+    return [
+        name for name in live_index_definitions()
+        if not definitions.get(_suffixed(name, SHADOW_INDEX_SUFFIX), ('', False))[1]
+    ]
+
+
+def build_shadow_indexes(on_index: Optional[Callable[[str], None]] = None) -> List[str]:
+    """
+    为缺少孪生索引的线上索引并发建立孪生索引 (不能在事务中调用)。
+    之前中断留下的无效索引会先删除再重建。
+    """
+    definitions = _index_definitions()
+    created = []
+    with connection.cursor() as cursor:
+        for name, definition in live_index_definitions().items():
+            shadow_name = _suffixed(name, SHADOW_INDEX_SUFFIX)
+            if shadow_name in definitions:
+                if definitions[shadow_name][1]:
+                    continue
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {shadow_name}")
+            if on_index:
+                on_index(shadow_name)
+            cursor.execute(shadow_index_sql(name, definition))
+            created.append(shadow_name)
+    return created
+
+
+def drop_shadow_indexes() -> List[str]:
+    """删除全部孪生索引 (不能在事务中调用)。"""
+    dropped = []
+    with connection.cursor() as cursor:
+        for name in _index_definitions():
+            if name.endswith(SHADOW_INDEX_SUFFIX):
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                dropped.append(name)
+    return dropped
+
+
+# --- 切换 ---
+
+def _swap_columns_and_indexes(cursor) -> None:
+    """互换线上列与影子列，以及每对线上索引与孪生索引的名称。调用方负责事务与锁。"""
+    table = TestCaseVersion._meta.db_table
+    # 必须在改列名之前确定线上索引：改名后索引定义引用的列名随之变化
+    index_names = list(live_index_definitions())
+    for live, shadow in SHADOW_COLUMNS.items():
+        swap = live + SWAP_SUFFIX
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {live} TO {swap}")
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {shadow} TO {live}")
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {swap} TO {shadow}")
+    for name in index_names:
+        shadow_name = _suffixed(name, SHADOW_INDEX_SUFFIX)
+        swap_name = _suffixed(name, SWAP_SUFFIX)
+        cursor.execute(f"ALTER INDEX {name} RENAME TO {swap_name}")
+        cursor.execute(f"ALTER INDEX {shadow_name} RENAME TO {name}")
+        cursor.execute(f"ALTER INDEX {swap_name} RENAME TO {shadow_name}")
+
+
+def _clear_in_batches(queryset: QuerySet, fields: Tuple[str, ...], batch_size: int = 5000) -> int:
+    """按 ID 分批把 queryset 中各行的 fields 设为 NULL (每批一条短 UPDATE)，返回更新的行数。更新后的行须不再匹配 queryset。"""
+    cleared = 0
+    updates = {field: None for field in fields}
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return cleared
+        cleared += TestCaseVersion.objects.filter(pk__in=ids).update(**updates)
+
+
+def cutover(migration: EmbeddingModelMigration) -> EmbeddingModelMigration:
+    """
+    原子切换到新模型的向量。复核期间 (EXCLUSIVE 锁) 只阻塞写入；改名取得 ACCESS EXCLUSIVE 锁后读取也会等待，
+    直到事务提交，因此事务内不做任何与行数相关的操作。复核仍有待迁移版本或缺少孪生索引时放弃切换。
+    """
+    if migration.status != 'ready':
+        raise ModelMigrationError(f"模型迁移 #{migration.pk} 的状态为 {migration.get_status_display()}，不能切换。")
+    missing = missing_shadow_indexes()
+    if missing:
+        raise ModelMigrationError(f"以下索引还没有孪生索引: {', '.join(missing)}")
+
+    # 迁移范围之外的行 (例如按需生成的历史版本) 影子列可能是其他模型的残留向量，切换前 (不持锁) 分批清空，
+    # 换上线后这些行的 embedding 为空，需要时按需重新生成
+    _clear_in_batches(
+        TestCaseVersion.objects.filter(embedding_shadow__isnull=False).exclude(
+            embedding_shadow_model_version=migration.model_version
+        ),
+        tuple(SHADOW_COLUMNS.values()),
+    )
+
+    table = TestCaseVersion._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{CUTOVER_LOCK_TIMEOUT}'")
+            # EXCLUSIVE 阻塞写入但允许读取，复核期间检索不受影响
+            cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+            pending = pending_shadow_queryset(migration).count()
+            if pending:
+                raise ModelMigrationError(f"仍有 {pending} 个版本的影子向量缺失或过期，请先执行 --run。")
+            # 改名升级为 ACCESS EXCLUSIVE：此后读取也会等待，之后只更新迁移记录即提交
+            _swap_columns_and_indexes(cursor)
+        migration.status = 'cutover'
+        migration.cutover_at = timezone.now()
+        migration.versions_pending = 0
+        migration.save(update_fields=['status', 'cutover_at', 'versions_pending', 'updated_at'])
+    invalidate_active_model_spec()
+    logger.info(f"Embedding model migration #{migration.pk} cut over to {migration.model_version}.")
+    return migration
+
+
+def rollback(migration: EmbeddingModelMigration) -> int:
+    """
+    切回旧向量。切换之后内容被修改过的版本在旧列中的向量已过期，清空后由回填重新生成。
+
+    Returns:
+        需要重新生成 embedding 的版本数。
+    """
+    if migration.status != 'cutover':
+        raise ModelMigrationError(f"模型迁移 #{migration.pk} 的状态为 {migration.get_status_display()}，不能回滚。")
+    table = TestCaseVersion._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{CUTOVER_LOCK_TIMEOUT}'")
+            cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+            _swap_columns_and_indexes(cursor)
+        migration.status = 'rolled_back'
+        migration.finished_at = timezone.now()
+        migration.save(update_fields=['status', 'finished_at', 'updated_at'])
+    invalidate_active_model_spec()
+    # 提交后 (不持锁) 分批清空过期的旧向量
+    invalidated = _clear_in_batches(
+        TestCaseVersion.objects.filter(embedding_shadow_updated_at__gt=migration.cutover_at, embedding__isnull=False),
+        tuple(SHADOW_COLUMNS),
+    )
+    logger.info(f"Embedding model migration #{migration.pk} rolled back, {invalidated} versions need re-embedding.")
+    return invalidated
+
+
+def clear_shadow_columns(batch_size: int = 5000) -> int:
+    """分批清空影子列，避免一条 UPDATE 长时间持有大量行锁。"""
+    return _clear_in_batches(
+        TestCaseVersion.objects.filter(
+            Q(embedding_shadow__isnull=False) | Q(embedding_shadow_model_version__isnull=False)
+        ),
+        tuple(SHADOW_COLUMNS.values()),
+        batch_size=batch_size,
+    )
+
+
+def finalize(migration: EmbeddingModelMigration) -> dict:
+    """删除旧向量的孪生索引并清空影子列 (不能在事务中调用)。"""
+    if migration.status != 'cutover':
+        raise ModelMigrationError(f"模型迁移 #{migration.pk} 的状态为 {migration.get_status_display()}，不能完成。")
+    stats = {'indexes_dropped': len(drop_shadow_indexes()), 'versions_cleared': clear_shadow_columns()}
+    migration.status = 'finalized'
+    migration.finished_at = timezone.now()
+    migration.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return stats
+
+
+def cancel(migration: EmbeddingModelMigration) -> dict:
+    """放弃尚未切换的迁移：删除孪生索引并清空影子列。"""
+    if migration.status not in ('embedding', 'ready'):
+        raise ModelMigrationError(f"模型迁移 #{migration.pk} 的状态为 {migration.get_status_display()}，不能取消。")
+    stats = {'indexes_dropped': len(drop_shadow_indexes()), 'versions_cleared': clear_shadow_columns()}
+    migration.status = 'cancelled'
+    migration.finished_at = timezone.now()
+    migration.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return stats
+
+
+def outdated_versions_queryset() -> QuerySet:
+    """线上向量不是由当前生效模型生成的版本 (例如切换瞬间仍使用旧模型的进程写入的向量)。"""
+    return TestCaseVersion.objects.filter(embedding__isnull=False).exclude(
+        embedding_model_version=get_embedding_model_version()
+    )
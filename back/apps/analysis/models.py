@@ -1,11 +1,70 @@
 # back/apps/analysis/models.py
-from django.db import models
+from django.db import models, connections
+from django.utils import timezone
+from typing import Iterable, Tuple
 # 从 testcases 应用导入 TestCaseVersion 模型
 from apps.testcases.models import TestCaseVersion
 
 # Create your models here.
 
-# We will define the PotentialDuplicatePair model here later.
+class PotentialDuplicatePairManager(models.Manager):
+
+    def bulk_upsert(self, pairs: Iterable[Tuple[int, int, float]], batch_size: int = 5000) -> Tuple[int, int]:
+        """
+        批量写入配对：每批一条 INSERT ... ON CONFLICT (version_a, version_b) DO UPDATE 语句。
+
+        - 自动把 (a, b) 规范化为 a < b，丢弃自身配对，同一对只保留最高分 (同一语句中
+          ON CONFLICT 不能两次更新同一行)。
+        - 冲突时只更新 similarity_score 与 last_seen_at，已评审 (confirmed/ignored) 的状态保持不变。
+
+        Args:
+            pairs: (version_a_id, version_b_id, similarity_score) 的可迭代对象。
+
+        Returns:
+            (新建数量, 更新数量)。
+        """
+        unique_pairs = {}
+        for version_a_id, version_b_id, similarity_score in pairs:
+            if version_a_id == version_b_id:
+                continue
+            key = (version_a_id, version_b_id) if version_a_id < version_b_id else (version_b_id, version_a_id)
+            if similarity_score > unique_pairs.get(key, float('-inf')):
+                unique_pairs[key] = similarity_score
+        if not unique_pairs:
+            return 0, 0
+
+        connection = connections[self.db]
+        meta = self.model._meta
+        table = connection.ops.quote_name(meta.db_table)
+        column_a = connection.ops.quote_name(meta.get_field('version_a').column)
+        column_b = connection.ops.quote_name(meta.get_field('version_b').column)
+        now = timezone.now()
+        rows = [(a, b, score, 'pending', now, now) for (a, b), score in unique_pairs.items()]
+
+        created = 0
+        updated = 0
+        with connection.cursor() as cursor:
+            for offset in range(0, len(rows), batch_size):
+                batch = rows[offset:offset + batch_size]
+                placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+                params = [value for row in batch for value in row]
+                # xmax = 0 表示该行由本语句插入，否则为冲突后更新
+                cursor.execute(
+                    f"INSERT INTO {table} ({column_a}, {column_b}, similarity_score, status, created_at, last_seen_at) "
+                    f"VALUES {placeholders} "
+                    f"ON CONFLICT ({column_a}, {column_b}) DO UPDATE SET similarity_score = EXCLUDED.similarity_score, "
+                    f"last_seen_at = EXCLUDED.last_seen_at "
+                    f"RETURNING (xmax = 0)",
+                    params,
+                )
+                for (inserted,) in cursor.fetchall():
+                    if inserted:
+                        created += 1
+                    else:
+                        updated += 1
+        return created, updated
+
+
 class PotentialDuplicatePair(models.Model):
     """
     存储通过相似度分析识别出的潜在重复测试用例版本对。
@@ -38,6 +97,10 @@ class PotentialDuplicatePair(models.Model):
         verbose_name="状态"
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="检测时间")
+    # 最近一次被检出 (写入或刷新分数) 的时间。全量扫描结束后，本次扫描没有再检出的待处理配对被撤销
+    last_seen_at = models.DateTimeField(default=timezone.now, verbose_name="最近检出时间")
+
+    objects = PotentialDuplicatePairManager()
 
     class Meta:
         verbose_name = "潜在重复用例对"
@@ -57,4 +120,208 @@ class PotentialDuplicatePair(models.Model):
 
     def __str__(self):
         # 提供更易读的字符串表示
-        return f"潜在重复: {self.version_a} vs {self.version_b} (分数: {self.similarity_score:.4f})" 
\ No newline at end of file
+        return f"潜在重复: {self.version_a} vs {self.version_b} (分数: {self.similarity_score:.4f})" 
+
+
+class DuplicateScanRun(models.Model):
+    """
+    记录一次 (项目级) 重复检测扫描。最近一次成功完成的扫描的开始时间 (减去 DUPLICATE_SCAN_WATERMARK_MARGIN_SECONDS)
+    作为增量扫描的水位线：之后 embedding 有新增或变化的版本才需要重新与语料比较。
+    """
+    MODE_CHOICES = [
+        ('full', '全量'),
+        ('incremental', '增量'),
+    ]
+    STATUS_CHOICES = [
+        ('running', '运行中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='duplicate_scan_runs',
+        verbose_name="所属项目"
+    )
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='full', verbose_name="扫描模式")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running', verbose_name="状态")
+    # 本次扫描所依据的水位线 (上一次完成扫描的开始时间减去安全余量)，全量扫描为空
+    watermark = models.DateTimeField(null=True, blank=True, verbose_name="水位线")
+    started_at = models.DateTimeField(default=timezone.now, verbose_name="开始时间")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完成时间")
+    versions_scanned = models.PositiveIntegerField(default=0, verbose_name="扫描版本数")
+    pairs_stored = models.PositiveIntegerField(default=0, verbose_name="写入配对数")
+    pairs_retired = models.PositiveIntegerField(default=0, verbose_name="撤销配对数")
+
+    class Meta:
+        verbose_name = "重复检测扫描记录"
+        verbose_name_plural = verbose_name
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['project', 'status', '-started_at'], name='dupscan_proj_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"扫描 #{self.pk} [{self.get_mode_display()}] 项目 {self.project_id} - {self.get_status_display()}"
+
+
+class EmbeddingBackfillRun(models.Model):
+    """
+    记录一次 backfill_embeddings 回填。按版本 ID 顺序 (keyset) 推进，last_version_id 为检查点：
+    中断后重新执行命令会从检查点之后继续，而不是从头开始。
+    """
+    MODE_CHOICES = [
+        ('dispatch', '派发 Celery 任务'),
+        ('local', '进程内编码'),
+    ]
+    STATUS_CHOICES = [
+        ('running', '运行中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='dispatch', verbose_name="回填模式")
+    force_rebuild = models.BooleanField(default=False, verbose_name="强制重建")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running', verbose_name="状态")
+    # 检查点：已处理 (派发或写回) 的最大版本 ID
+    last_version_id = models.BigIntegerField(default=0, verbose_name="检查点版本ID")
+    total_estimate = models.PositiveIntegerField(default=0, verbose_name="预计版本数")
+    versions_processed = models.PositiveIntegerField(default=0, verbose_name="已处理版本数")
+    versions_updated = models.PositiveIntegerField(default=0, verbose_name="已写回版本数")
+    started_at = models.DateTimeField(default=timezone.now, verbose_name="开始时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完成时间")
+
+    class Meta:
+        verbose_name = "Embedding 回填记录"
+        verbose_name_plural = verbose_name
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"回填 #{self.pk} [{self.get_mode_display()}] 检查点 {self.last_version_id} - {self.get_status_display()}"
+
+
+class EmbeddingModelMigration(models.Model):
+    """
+    一次 embedding 模型迁移 (更换模型/后端/量化方式)。
+
+    新模型的向量写入 TestCaseVersion 的影子列 (embedding_shadow 等)，期间检索仍使用旧向量；
+    影子列覆盖全部已索引版本、影子索引建好后，通过列与索引的重命名在一个事务内切换 (cutover)，
+    切换后可回滚，确认无误后 finalize 清理旧向量。见 apps.analysis.model_migration。
+    """
+    STATUS_CHOICES = [
+        ('embedding', '生成影子向量中'),
+        ('ready', '可切换'),
+        ('cutover', '已切换'),
+        ('finalized', '已完成'),
+        ('rolled_back', '已回滚'),
+        ('cancelled', '已取消'),
+    ]
+
+    model_name = models.CharField(max_length=200, verbose_name="目标模型")
+    backend = models.CharField(max_length=50, verbose_name="推理后端")
+    quantized = models.BooleanField(default=False, verbose_name="int8 量化")
+    # 目标版本号 (写入 embedding_shadow_model_version，切换后即为 embedding_model_version)
+    model_version = models.CharField(max_length=100, verbose_name="目标模型版本号")
+    source_model_version = models.CharField(max_length=100, blank=True, verbose_name="原模型版本号")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='embedding', verbose_name="状态")
+    # 当前一轮扫描的检查点；扫到末尾后从头再扫一轮，补上期间内容被修改的版本
+    last_version_id = models.BigIntegerField(default=0, verbose_name="检查点版本ID")
+    passes = models.PositiveIntegerField(default=0, verbose_name="已完成扫描轮数")
+    versions_total = models.PositiveIntegerField(default=0, verbose_name="需迁移版本数")
+    versions_pending = models.PositiveIntegerField(default=0, verbose_name="待生成版本数")
+    versions_embedded = models.PositiveIntegerField(default=0, verbose_name="已生成版本数")
+    started_at = models.DateTimeField(default=timezone.now, verbose_name="开始时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    cutover_at = models.DateTimeField(null=True, blank=True, verbose_name="切换时间")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="结束时间")
+
+    class Meta:
+        verbose_name = "Embedding 模型迁移"
+        verbose_name_plural = verbose_name
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"模型迁移 #{self.pk} {self.source_model_version} -> {self.model_version} - {self.get_status_display()}"
+
+    @property
+    def coverage(self) -> float:
+        if not self.versions_total:
+            return 1.0
+        return max(self.versions_total - self.versions_pending, 0) / self.versions_total
+
+
+class DuplicateCluster(models.Model):
+    """
+    重复用例簇：把相似度不低于阈值的配对图做连通分量 (union-find) 得到的一组版本。
+    评审页面按簇展示 (一簇一行)，而不是逐个翻阅簇内 n(n-1)/2 个配对。
+    """
+    STATUS_CHOICES = [
+        ('pending', '待处理'),
+        ('confirmed', '已确认重复'),
+        ('ignored', '非重复'),
+    ]
+
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='duplicate_clusters',
+        verbose_name="所属项目"
+    )
+    # 代表版本：簇内与其他成员相似度之和最高的版本 (优先选择活动版本)
+    representative = models.ForeignKey(
+        TestCaseVersion,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='represented_duplicate_clusters',
+        verbose_name="代表版本"
+    )
+    members = models.ManyToManyField(
+        TestCaseVersion,
+        through='DuplicateClusterMember',
+        related_name='duplicate_clusters',
+        verbose_name="成员版本"
+    )
+    size = models.PositiveIntegerField(default=0, verbose_name="成员数")
+    max_similarity = models.FloatField(default=0.0, verbose_name="最高相似度")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="状态")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        verbose_name = "重复用例簇"
+        verbose_name_plural = verbose_name
+        ordering = ['-size', '-max_similarity']
+        indexes = [
+            models.Index(fields=['project', 'status'], name='dupcluster_proj_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"重复簇 #{self.pk} ({self.size} 个版本, 代表版本 {self.representative_id})"
+
+
+class DuplicateClusterMember(models.Model):
+    """簇成员。一个版本同一时间只属于一个簇。"""
+    cluster = models.ForeignKey(DuplicateCluster, on_delete=models.CASCADE, related_name='memberships', verbose_name="所属簇")
+    version = models.OneToOneField(
+        TestCaseVersion,
+        on_delete=models.CASCADE,
+        related_name='duplicate_cluster_membership',
+        verbose_name="版本"
+    )
+    # 与代表版本之间存在直接配对时的相似度，否则为空 (经由其他成员间接相连)
+    similarity_to_representative = models.FloatField(null=True, blank=True, verbose_name="与代表版本的相似度")
+
+    class Meta:
+        verbose_name = "重复簇成员"
+        verbose_name_plural = verbose_name
+        ordering = ['cluster', '-similarity_to_representative']
+
+    def __str__(self):
+        return f"簇 #{self.cluster_id} 成员 {self.version_id}"
@@ -0,0 +1,133 @@
+# back/apps/analysis/policy.py
+"""
+Embedding 生成策略。
+
+settings.EMBEDDING_POLICY:
+    'active' (默认): 只为活动版本主动生成 embedding 并进入 HNSW 索引；历史 (非活动) 版本
+                    在需要时 (例如在重复评审中打开历史版本) 才按需生成。版本被停用时回收其向量。
+                    微批/批量任务在处理时会再次按策略过滤，排队期间被停用的版本不会被编码。
+    'all':          与旧行为一致，所有版本都生成 embedding。
+
+每个用例通常有多个历史版本，只索引活动版本可使索引体积和回填耗时按"每用例版本数"成比例下降。
+"""
+import logging
+from datetime import timedelta
+from typing import List, Optional
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from apps.testcases.models import TestCaseVersion
+from .utils import ClockTimestamp, generate_embedding, get_embedding_model_version, is_embedding_model_enabled
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_POLICIES = ('active', 'all')
+# 按需生成任务的派发去重键 (加版本 ID)：窗口内同一版本只派发一次
+ON_DEMAND_DISPATCH_KEY_PREFIX = 'tcms:analysis:embedding:on-demand:'
+
+
+def get_embedding_policy() -> str:
+    policy = getattr(settings, 'EMBEDDING_POLICY', 'active')
+    if policy not in EMBEDDING_POLICIES:
+        raise ValueError(f"Invalid EMBEDDING_POLICY: {policy}")
+    return policy
+
+
+def embeds_eagerly(version: TestCaseVersion) -> bool:
+    """该版本是否应在保存后立即生成 embedding。"""
+    return get_embedding_policy() == 'all' or version.is_active
+
+
+def eager_versions_queryset(queryset: Optional[QuerySet] = None) -> QuerySet:
+    """限定为需要主动生成 embedding 的版本 (回填、重建等批量操作使用)。"""
+    if queryset is None:
+        queryset = TestCaseVersion.objects.all()
+    if get_embedding_policy() == 'active':
+        queryset = queryset.filter(is_active=True)
+    return queryset
+
+
+def get_on_demand_ttl() -> timedelta:
+    return timedelta(hours=getattr(settings, 'EMBEDDING_ON_DEMAND_TTL_HOURS', 168))
+
+
+def get_on_demand_dedupe_seconds() -> int:
+    return getattr(settings, 'EMBEDDING_ON_DEMAND_DEDUPE_SECONDS', 60)
+
+
+def claim_on_demand_dispatch(version_id: int) -> bool:
+    """
+    以 Redis SET NX 占用该版本的派发窗口，返回本次是否应派发。客户端轮询 (每次返回 202) 时
+    窗口内只有第一次请求派发任务，不会挤占交互队列。Redis 不可用时退化为直接派发。
+    """
+    from .batching import get_redis
+
+    try:
+        return bool(get_redis().set(f"{ON_DEMAND_DISPATCH_KEY_PREFIX}{version_id}", 1, nx=True,
+                                    ex=get_on_demand_dedupe_seconds()))
+    except Exception as e:
+        logger.warning(f"Failed to dedupe on-demand embedding for TestCaseVersion {version_id}: {e}")
+        return True
+
+
+def reclaim_embeddings(version_ids: Optional[List[int]] = None) -> int:
+    """
+    清除非活动版本的 embedding (策略为 'all' 时不做任何事)。
+    清除后的行不再出现在 HNSW 索引中；引用这些版本的待处理重复配对会在下一次重复扫描中被撤销。
+
+    Args:
+        version_ids: 只处理这些版本 (版本停用时)；为 None 时处理全部非活动版本，
+                     但跳过 EMBEDDING_ON_DEMAND_TTL_HOURS 内生成的向量 (按需生成的历史版本向量保留一段时间)。
+
+    Returns:
+        被清除 embedding 的版本数量。
+    """
+    if get_embedding_policy() != 'active':
+        return 0
+    queryset = TestCaseVersion.objects.filter(is_active=False, embedding__isnull=False)
+    if version_ids is not None:
+        queryset = queryset.filter(pk__in=version_ids)
+    else:
+        queryset = queryset.exclude(embedding_updated_at__gte=timezone.now() - get_on_demand_ttl())
+    # 模型迁移中的影子向量一并清除，否则切换后非活动版本会重新带上向量
+    reclaimed = queryset.update(
+        embedding=None, embedding_model_version=None, embedding_updated_at=None,
+        embedding_shadow=None, embedding_shadow_model_version=None, embedding_shadow_updated_at=None,
+    )
+    if reclaimed:
+        logger.info(f"Reclaimed embeddings from {reclaimed} inactive versions.")
+    return reclaimed
+
+
+def ensure_version_embedding(version: TestCaseVersion, synchronous: bool = True) -> Optional[List[float]]:
+    """
+    按需为 (通常是历史) 版本生成 embedding。
+
+    已有 embedding 时直接返回。synchronous 为 True 且当前进程已开启模型 (embedding worker 或显式开启的进程)
+    时在当前进程内生成并保存；否则 (Web 进程默认不加载模型) 派发按需任务，返回 None，由调用方提示稍后重试。
+    按需任务不受 'active' 策略限制，生成的向量在 EMBEDDING_ON_DEMAND_TTL_HOURS 内不会被全量回收清除；
+    同一版本在 EMBEDDING_ON_DEMAND_DEDUPE_SECONDS 内只派发一次 (见 claim_on_demand_dispatch)。
+    """
+    from .queues import EMBEDDING_QUEUE, PRIORITY_INTERACTIVE
+    from .tasks import generate_version_embedding_task
+
+    if version.embedding is not None:
+        return version.embedding
+
+    if synchronous and is_embedding_model_enabled():
+        embedding = generate_embedding(version)
+        if embedding is not None:
+            version.embedding = embedding
+            version.embedding_model_version = get_embedding_model_version()
+            version.embedding_updated_at = ClockTimestamp()
+            version.save(update_fields=['embedding', 'embedding_model_version', 'embedding_updated_at'])
+            logger.info(f"Embedded TestCaseVersion {version.id} on demand.")
+            return embedding
+
+    if not claim_on_demand_dispatch(version.id):
+        # 窗口内已派发过 (客户端在轮询)，等待该任务完成
+        return None
+    generate_version_embedding_task.apply_async(args=[version.id], kwargs={'on_demand': True},
+                                                queue=EMBEDDING_QUEUE, priority=PRIORITY_INTERACTIVE)
+    logger.info(f"Queued on-demand embedding for TestCaseVersion {version.id}.")
+    return None
@@ -0,0 +1,79 @@
+# back/apps/analysis/queues.py
+"""
+分析任务的 Celery 队列与背压。
+
+任务按 settings.CELERY_TASK_ROUTES 路由到三个专用队列：
+    embedding      - 交互式的单版本 embedding 与微批 flush (保存用例后触发)
+    duplicates     - 重复检测 (逐版本 HNSW 查询、项目级批量扫描)
+    embedding_bulk - 回填等大批量 embedding 任务
+建议至少为 embedding 队列单独启动 worker，使交互式更新不会排在大批量回填之后：
+    celery -A tcms worker -Q embedding -c 2 -n embedding@%h
+    celery -A tcms worker -Q embedding,duplicates,embedding_bulk -O fair -n bulk@%h
+同一 worker 消费多个队列时，任务优先级 (Redis 下 0 最高、9 最低) 保证交互式任务先被取走。
+
+生产者 (backfill_embeddings、find_all_duplicates) 在派发前检查目标队列的深度，
+超过上限时等待，而不是固定间隔 sleep。
+"""
+import logging
+import time
+from typing import Callable, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_QUEUE = 'embedding'
+DUPLICATES_QUEUE = 'duplicates'
+EMBEDDING_BULK_QUEUE = 'embedding_bulk'
+
+# 任务优先级 (kombu Redis 传输：数值越小越先被消费)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DUPLICATES = 5
+PRIORITY_BULK = 9
+
+_broker_client = None
+
+
+def get_broker_redis():
+    """返回 Celery broker 的 Redis 连接 (队列以 Redis list 的形式存放在 broker 中)。"""
+    global _broker_client
+    if _broker_client is None:
+        import redis
+        _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _broker_client
+
+
+def get_queue_depth(queue: str) -> int:
+    """
+    返回队列中等待的消息数。开启优先级后 kombu 为每个优先级使用单独的 list：
+    优先级 0 为队列名本身，其余为 "队列名 + sep + 优先级"。
+    """
+    options = getattr(settings, 'CELERY_BROKER_TRANSPORT_OPTIONS', {}) or {}
+    steps = options.get('priority_steps') or [0]
+    sep = options.get('sep', '\x06\x16')
+    keys = [queue if step == 0 else f"{queue}{sep}{step}" for step in steps]
+    client = get_broker_redis()
+    pipe = client.pipeline()
+    for key in keys:
+        pipe.llen(key)
+    return sum(pipe.execute())
+
+
+def wait_for_queue_capacity(queue: str, max_depth: int, poll_seconds: float = 1.0,
+                            on_wait: Optional[Callable[[int], None]] = None) -> int:
+    """
+    阻塞直到队列深度低于 max_depth (max_depth <= 0 表示不限制)，返回最后一次观测到的深度。
+    无法读取队列深度 (例如 broker 不可达) 时不阻塞，交给随后的派发去报错。
+    """
+    if max_depth <= 0:
+        return 0
+    while True:
+        try:
+            depth = get_queue_depth(queue)
+        except Exception as e:
+            logger.warning(f"Could not read depth of queue '{queue}': {e}")
+            return 0
+        if depth < max_depth:
+            return depth
+        if on_wait:
+            on_wait(depth)
+        time.sleep(poll_seconds)
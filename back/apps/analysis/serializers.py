@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from apps.testcases.models import TestCaseVersion
-from .models import PotentialDuplicatePair
+from .models import PotentialDuplicatePair, DuplicateCluster, DuplicateClusterMember
 
 class NestedTestCaseVersionSerializer(serializers.ModelSerializer):
     """
@@ -37,4 +37,42 @@ class PotentialDuplicatePairSerializer(serializers.ModelSerializer):
 
     def get_similarity_percentage(self, obj):
         # 将相似度分数转换为更易读的百分比，保留两位小数
-        return f"{obj.similarity_score * 100:.2f}%" 
\ No newline at end of file
+        return f"{obj.similarity_score * 100:.2f}%" 
+
+
+class DuplicateClusterSerializer(serializers.ModelSerializer):
+    """
+    重复簇列表：一簇一行，只带代表版本和成员数。
+    """
+    representative = NestedTestCaseVersionSerializer(read_only=True)
+
+    class Meta:
+        model = DuplicateCluster
+        fields = ['id', 'project', 'representative', 'size', 'max_similarity', 'status', 'created_at', 'updated_at']
+        read_only_fields = ['project', 'size', 'max_similarity', 'created_at', 'updated_at']
+
+
+class DuplicateClusterMemberSerializer(serializers.ModelSerializer):
+    version = NestedTestCaseVersionSerializer(read_only=True)
+
+    class Meta:
+        model = DuplicateClusterMember
+        fields = ['version', 'similarity_to_representative']
+
+
+class DuplicateClusterDetailSerializer(DuplicateClusterSerializer):
+    """
+    重复簇详情：附带全部成员。
+    """
+    members = DuplicateClusterMemberSerializer(source='memberships', many=True, read_only=True)
+
+    class Meta(DuplicateClusterSerializer.Meta):
+        fields = DuplicateClusterSerializer.Meta.fields + ['members']
+
+
+class DuplicateClusterReviewSerializer(serializers.Serializer):
+    """
+    整簇评审：confirmed 把簇内待处理配对标记为已确认；ignored 把簇内配对标记为非重复，簇随之解散。
+    """
+    status = serializers.ChoiceField(choices=['confirmed', 'ignored'])
+
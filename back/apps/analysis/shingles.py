@@ -0,0 +1,241 @@
+# back/apps/analysis/shingles.py
+"""
+基于文本 shingle 的 MinHash/LSH 预过滤。
+
+用例库中最常见的重复是复制粘贴后只改了几个字。这类重复不需要模型和向量检索就能找到：
+    1. 规范化文本 (去富文本标记、大小写折叠、去掉空白和标点) 的哈希相同 -> 完全重复
+    2. 字符 k-gram (shingle) 集合的 MinHash 签名分段 (LSH band) 落入同一桶，
+       且签名估计的 Jaccard 相似度 >= settings.SHINGLE_PREFILTER_JACCARD -> 几乎相同
+两步都是对版本数线性的分组操作。分组后每组只保留一个代表版本进入向量检索，
+其余成员直接与代表版本配对 (见 duplicates.py)，重复簇 (clusters.py) 再把它们连起来。
+各 band 的键另存于 TestCaseVersion.text_lsh_bands (GIN 索引)，增量扫描用 find_candidate_rows
+只取与变化版本同哈希或同桶的版本，分组开销与变化量成正比。
+
+字符级 shingle 同时适用于中文 (无空格分词) 和英文。签名保存在 TestCaseVersion.text_hash /
+text_minhash / text_lsh_bands 上，版本内容变化时由信号刷新；修改 SHINGLE_SIZE 或 MINHASH_PERMUTATIONS 后
+需执行 compute_text_signatures --force (只修改 MINHASH_LSH_BANDS 时不带 --force 即可补算分段键)。
+"""
+import hashlib
+import logging
+import unicodedata
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.db.models.functions import Length
+from apps.testcases.models import TestCaseVersion
+from .utils import extract_version_text
+from .clusters import UnionFind
+
+logger = logging.getLogger(__name__)
+
+# 通用哈希 (a * x + b) mod p，p 为梅森素数 2^61 - 1。a、b 取 [0, p) 内的随机数，
+# 乘积按 uint64 回绕 (与 datasketch 的做法相同)，对最小值的分布没有可见影响
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_PERMUTATION_SEED = 1014
+SIGNATURE_DTYPE = np.uint32
+SIGNATURE_FIELDS = ['text_hash', 'text_minhash', 'text_lsh_bands']
+# 签名不足以区分时 (例如极短文本)，同一 LSH 桶最多保留的组长数量，避免桶内两两比较退化为平方
+MAX_BUCKET_LEADERS = 64
+
+
+def get_shingle_size() -> int:
+    return getattr(settings, 'SHINGLE_SIZE', 5)
+
+
+def get_num_permutations() -> int:
+    return getattr(settings, 'MINHASH_PERMUTATIONS', 64)
+
+
+def get_lsh_bands() -> int:
+    bands = getattr(settings, 'MINHASH_LSH_BANDS', 8)
+    if get_num_permutations() % bands:
+        raise ValueError("MINHASH_PERMUTATIONS must be divisible by MINHASH_LSH_BANDS")
+    return bands
+
+
+def get_prefilter_threshold() -> float:
+    return getattr(settings, 'SHINGLE_PREFILTER_JACCARD', 0.9)
+
+
+def is_prefilter_enabled() -> bool:
+    return getattr(settings, 'SHINGLE_PREFILTER_ENABLED', True)
+
+
+def shingle_normalize(text: str) -> str:
+    """NFKC + 大小写折叠，并去掉空白、标点和符号，只比较文字本身。"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return ''.join(char for char in text if unicodedata.category(char)[0] not in ('Z', 'P', 'S', 'C'))
+
+
+def shingle_set(normalized: str, size: Optional[int] = None) -> Set[int]:
+    """字符 k-gram 的 32 位哈希集合。短于 k 的文本整体作为一个 shingle。"""
+    size = size or get_shingle_size()
+    if not normalized:
+        return set()
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode('utf-8'))}
+    return {zlib.crc32(normalized[i:i + size].encode('utf-8')) for i in range(len(normalized) - size + 1)}
+
+
+@lru_cache(maxsize=4)
+def _permutations(num_permutations: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(_PERMUTATION_SEED)
+    a = rng.randint(1, (1 << 61) - 1, size=num_permutations, dtype=np.uint64)
+    b = rng.randint(0, (1 << 61) - 1, size=num_permutations, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(shingles: Set[int], num_permutations: Optional[int] = None) -> np.ndarray:
+    num_permutations = num_permutations or get_num_permutations()
+    if not shingles:
+        return np.full(num_permutations, np.iinfo(SIGNATURE_DTYPE).max, dtype=SIGNATURE_DTYPE)
+    a, b = _permutations(num_permutations)
+    values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    hashed = (values[:, None] * a + b) % _MERSENNE_PRIME
+    return (hashed.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(SIGNATURE_DTYPE)
+
+
+def lsh_band_keys(signature: np.ndarray) -> List[int]:
+    """签名每个 LSH band 的 64 位键 (键中包含 band 序号，不同 band 的相同取值不会落入同一桶)。"""
+    bands = get_lsh_bands()
+    rows_per_band = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        digest = hashlib.blake2b(
+            band.to_bytes(2, 'big') + signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes(),
+            digest_size=8,
+        ).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def compute_text_signature(text: str) -> Tuple[Optional[str], Optional[bytes], Optional[List[int]]]:
+    """返回 (text_hash, MinHash 签名字节, LSH 分段键)。没有可比较文字时返回 (None, None, None)。"""
+    normalized = shingle_normalize(text)
+    if not normalized:
+        return None, None, None
+    text_hash = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    signature = minhash_signature(shingle_set(normalized))
+    return text_hash, signature.tobytes(), lsh_band_keys(signature)
+
+
+def signature_from_bytes(raw) -> Optional[np.ndarray]:
+    if raw is None:
+        return None
+    signature = np.frombuffer(bytes(raw), dtype=SIGNATURE_DTYPE)
+    return signature if len(signature) == get_num_permutations() else None
+
+
+def estimated_jaccard(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    return float(np.count_nonzero(signature_a == signature_b)) / len(signature_a)
+
+
+def store_text_signature(version: TestCaseVersion) -> None:
+    """计算并保存单个版本的签名 (使用 update，不触发 post_save)。"""
+    text_hash, minhash, band_keys = compute_text_signature(extract_version_text(version))
+    TestCaseVersion.objects.filter(pk=version.pk).update(text_hash=text_hash, text_minhash=minhash,
+                                                         text_lsh_bands=band_keys)
+    version.text_hash, version.text_minhash, version.text_lsh_bands = text_hash, minhash, band_keys
+
+
+def ensure_text_signatures(queryset: Optional[QuerySet] = None, force: bool = False,
+                           batch_size: int = 500) -> int:
+    """
+    为缺少签名 (或签名长度与当前 MINHASH_PERMUTATIONS 不符、分段键数与 MINHASH_LSH_BANDS 不符)
+    的版本补算签名，返回更新的版本数。
+    force 为 True 时重算 queryset 内的全部版本。
+    """
+    if queryset is None:
+        queryset = TestCaseVersion.objects.all()
+    if not force:
+        queryset = queryset.annotate(minhash_length=Length('text_minhash')).filter(
+            Q(text_hash__isnull=True) | Q(text_minhash__isnull=True)
+            | ~Q(minhash_length=get_num_permutations() * SIGNATURE_DTYPE().itemsize)
+            | Q(text_lsh_bands__isnull=True) | ~Q(text_lsh_bands__len=get_lsh_bands())
+        )
+    queryset = queryset.only('id', 'title', 'precondition', 'steps_data').order_by('id')
+
+    updated = 0
+    batch = []
+    for version in queryset.iterator(chunk_size=batch_size):
+        version.text_hash, version.text_minhash, version.text_lsh_bands = \
+            compute_text_signature(extract_version_text(version))
+        batch.append(version)
+        if len(batch) >= batch_size:
+            updated += TestCaseVersion.objects.bulk_update(batch, SIGNATURE_FIELDS)
+            batch = []
+    if batch:
+        updated += TestCaseVersion.objects.bulk_update(batch, SIGNATURE_FIELDS)
+    if updated:
+        logger.info(f"Computed text signatures for {updated} versions.")
+    return updated
+
+
+def find_candidate_rows(queryset: QuerySet, version_ids: Iterable[int]) -> List[Tuple[int, Optional[str], object]]:
+    """
+    返回 queryset 中可能与 version_ids 近重复的版本 [(version_id, text_hash, text_minhash)] (含这些版本自身)：
+    规范化文本哈希相同，或至少一个 LSH 分段键相同 (分别使用 text_hash 的 B 树索引和 text_lsh_bands 的 GIN 索引)。
+    结果交给 find_near_duplicate_groups，与对整个 queryset 分组相比只涉及同桶的版本。
+    """
+    version_ids = list(version_ids)
+    own = list(queryset.filter(pk__in=version_ids).values_list('text_hash', 'text_lsh_bands'))
+    hashes = {text_hash for text_hash, _ in own if text_hash}
+    band_keys = sorted({key for _, keys in own for key in (keys or [])})
+    if not hashes and not band_keys:
+        return []
+    condition = Q(pk__in=version_ids)
+    if hashes:
+        condition |= Q(text_hash__in=hashes)
+    if band_keys:
+        condition |= Q(text_lsh_bands__overlap=band_keys)
+    return list(queryset.filter(condition).order_by('id').values_list('id', 'text_hash', 'text_minhash'))
+
+
+def find_near_duplicate_groups(rows: Iterable[Tuple[int, Optional[str], object]],
+                               threshold: Optional[float] = None) -> List[List[int]]:
+    """
+    对 [(version_id, text_hash, text_minhash)] 做线性时间的近重复分组。
+
+    Returns:
+        每组按 ID 升序排列的版本列表 (只包含两个及以上成员的组)，组内第一个为代表版本。
+    """
+    threshold = get_prefilter_threshold() if threshold is None else threshold
+    bands = get_lsh_bands()
+    rows_per_band = get_num_permutations() // bands
+    uf = UnionFind()
+
+    # 1. 规范化文本完全相同：按哈希分组，每组只留一个组长参加 LSH
+    leaders: Dict[str, int] = {}
+    signatures: Dict[int, np.ndarray] = {}
+    for version_id, text_hash, raw_signature in rows:
+        if text_hash is None:
+            continue
+        leader = leaders.get(text_hash)
+        if leader is not None:
+            uf.union(leader, version_id)
+            continue
+        leaders[text_hash] = version_id
+        signature = signature_from_bytes(raw_signature)
+        if signature is not None:
+            signatures[version_id] = signature
+
+    # 2. LSH：逐个 band 分桶；桶内只与已有的桶组长比较，相似则合并，否则成为新的桶组长
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        start, end = band * rows_per_band, (band + 1) * rows_per_band
+        for version_id, signature in signatures.items():
+            bucket_leaders = buckets[signature[start:end].tobytes()]
+            for bucket_leader in bucket_leaders:
+                if uf.find(bucket_leader) == uf.find(version_id) or \
+                        estimated_jaccard(signatures[bucket_leader], signature) >= threshold:
+                    uf.union(bucket_leader, version_id)
+                    break
+            else:
+                if len(bucket_leaders) < MAX_BUCKET_LEADERS:
+                    bucket_leaders.append(version_id)
+
+    return sorted(sorted(component) for component in uf.components() if len(component) > 1)
@@ -1,7 +1,9 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from apps.testcases.models import TestCaseVersion
-from .tasks import generate_version_embedding_task
+from .batching import request_version_embeddings
+from .policy import embeds_eagerly, reclaim_embeddings
+from .shingles import store_text_signature
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,10 +14,21 @@ def trigger_embedding_generation(sender, instance: TestCaseVersion, created: boo
     """
     当 TestCaseVersion 创建或更新时，触发 embedding 生成任务。
     只有在相关内容字段被更新时，或者新创建且 embedding 为空时才触发。
+    请求记入当前事务的派发缓冲区，提交后统一派发：同一请求中多次保存同一版本
+    (例如 TestCaseViewSet.create 先创建、再 save(update_fields=['steps_data'])) 只派发一次，
+    多个版本合并为一个批次。
     """
     # 定义需要关注的内容字段 (这些字段的变化应该触发 embedding 更新)
     content_fields = {'title', 'precondition', 'steps_data'}
 
+    # 版本被停用 (TestCaseViewSet.update 创建新版本后): 按 EMBEDDING_POLICY 回收其向量
+    if update_fields is not None and 'is_active' in update_fields and not instance.is_active:
+        try:
+            reclaim_embeddings([instance.id])
+        except Exception as e:
+            logger.error(f"Failed to reclaim embedding for deactivated Version {instance.id}: {e}")
+        return
+
     # 检查是否应该触发任务
     should_trigger = False
     if created and not instance.embedding:
@@ -27,18 +40,41 @@ def trigger_embedding_generation(sender, instance: TestCaseVersion, created: boo
         if any(field in content_fields for field in update_fields):
             should_trigger = True
             logger.info(f"Content fields {content_fields.intersection(update_fields)} updated for Version {instance.id}, triggering embedding generation.")
+        elif 'is_active' in update_fields and instance.is_active and instance.embedding is None:
+            # 历史版本被重新启用，补齐 embedding
+            should_trigger = True
+            logger.info(f"Version {instance.id} reactivated without embedding, triggering embedding generation.")
     else:
         # 如果没有提供 update_fields (意味着可能所有字段都更新了，或者 save() 没有指定 update_fields)，
-        # 为了安全起见，也触发任务。
+        # 为了安全起见，也触发任务 (同一事务内的重复请求由派发缓冲区合并)。
         # 更精确的做法可以在这里比较 instance 和旧值的差异 (如果需要且性能允许)
         should_trigger = True
         logger.warning(f"post_save for Version {instance.id} called without update_fields. Triggering embedding generation as a precaution.")
 
-    # 如果需要触发，则异步调用 Celery 任务
+    # 非活动版本在 'active' 策略下不主动生成，等需要时再按需生成 (见 policy.ensure_version_embedding)
+    if should_trigger and not embeds_eagerly(instance):
+        logger.info(f"Version {instance.id} is inactive, embedding deferred until requested.")
+        should_trigger = False
+
+    # 如果需要触发，则在事务提交后放入微批缓冲区 (由 flush 任务合并编码)
     if should_trigger:
         try:
-            generate_version_embedding_task.delay(instance.id)
-            logger.info(f"Celery task generate_version_embedding_task dispatched for Version {instance.id}.")
+            request_version_embeddings([instance.id], using=kwargs.get('using'))
         except Exception as e:
-            # 处理调用 task.delay 可能出现的异常 (比如 Celery 连接问题)
-            logger.error(f"Failed to dispatch Celery task for Version {instance.id}: {e}") 
\ No newline at end of file
+            # 处理调用 task.delay 可能出现的异常 (比如 Celery 连接问题，autocommit 下会立即派发)
+            logger.error(f"Failed to dispatch Celery task for Version {instance.id}: {e}") 
+
+
+@receiver(post_save, sender=TestCaseVersion)
+def refresh_text_signature(sender, instance: TestCaseVersion, created: bool, update_fields=None, **kwargs):
+    """
+    内容变化时刷新规范化文本哈希与 MinHash 签名 (供重复检测的 shingle 预过滤使用)。
+    计算只涉及字符串处理，直接在保存请求内完成。
+    """
+    if update_fields is not None and not {'title', 'precondition', 'steps_data'}.intersection(update_fields):
+        return
+    try:
+        store_text_signature(instance)
+    except Exception as e:
+        # 签名缺失时重复扫描会补算，这里不影响保存
+        logger.error(f"Failed to compute text signature for Version {instance.id}: {e}")
@@ -1,17 +1,24 @@
 from celery import shared_task
 from apps.testcases.models import TestCaseVersion
-from .utils import generate_embedding, get_embedding_model, model_dimension, MODEL_NAME, extract_version_text # 导入工具函数、模型维度和模型名称
+from .utils import QUERY_REPLY_TTL, ClockTimestamp, generate_embedding, get_embedding_model, get_model_dimension, get_embedding_model_version, extract_version_text, encode_texts, find_similar_testcases, hnsw_search_params, ef_search_for_limit # 导入工具函数、模型维度和模型名称
+from .embedding_cache import get_embedding_cache
 import logging
-from .models import PotentialDuplicatePair # 导入结果模型
-from django.db import IntegrityError # 用于捕获唯一约束冲突
-from typing import List
+from .models import PotentialDuplicatePair, EmbeddingModelMigration # 导入结果模型
+from django.db import IntegrityError, DatabaseError # 用于捕获唯一约束冲突和数据库错误
+from . import batching
+from .queues import PRIORITY_INTERACTIVE, PRIORITY_DUPLICATES, PRIORITY_BULK
+from .duplicates import run_duplicate_scan, get_projects_with_embeddings
+from .clusters import update_clusters_for_versions
+from .policy import embeds_eagerly
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60) # 允许绑定实例，设置重试
-def generate_version_embedding_task(self, version_id: int):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, priority=PRIORITY_INTERACTIVE) # 允许绑定实例，设置重试
+def generate_version_embedding_task(self, version_id: int, on_demand: bool = False):
     """
     Celery 任务：为单个 TestCaseVersion 生成并保存 embedding。
+    on_demand 为 True 表示按需请求 (policy.ensure_version_embedding)，不受 'active' 策略限制。
     """
     # 检查模型是否已加载，如果未加载，则任务失败并稍后重试
     if not get_embedding_model():
@@ -23,21 +30,30 @@ def generate_version_embedding_task(self, version_id: int):
     except TestCaseVersion.DoesNotExist:
         logger.error(f"TestCaseVersion with id {version_id} not found. Task cannot proceed.")
         return f"Version {version_id} not found."
+    if not on_demand and not embeds_eagerly(version):
+        logger.info(f"Version {version_id} is no longer active, skipping eager embedding.")
+        return f"Version {version_id} skipped by embedding policy."
 
     logger.info(f"Starting embedding generation for Version {version_id}...")
+    cache = get_embedding_cache()
+    cache_hits_before = cache.hits if cache else 0
     embedding_vector = generate_embedding(version)
+    cache_hit = bool(cache) and cache.hits > cache_hits_before
 
     if embedding_vector:
         # 确保向量维度与数据库字段匹配 (虽然 utils 中也检查了模型加载时的维度)
+        model_dimension = get_model_dimension()
         if len(embedding_vector) == model_dimension:
             try:
                 version.embedding = embedding_vector
                 # 同时设置模型版本
-                version.embedding_model_version = MODEL_NAME
-                # 更新 embedding 和 model_version 两个字段
-                version.save(update_fields=['embedding', 'embedding_model_version'])
+                version.embedding_model_version = get_embedding_model_version()
+                # 记录向量更新时间 (写入时的数据库时钟)，供增量重复检测使用
+                version.embedding_updated_at = ClockTimestamp()
+                # 更新 embedding、model_version 和更新时间字段
+                version.save(update_fields=['embedding', 'embedding_model_version', 'embedding_updated_at'])
                 logger.info(f"Successfully generated and saved embedding and model version for Version {version.id}.")
-                return f"Embedding generated for Version {version.id} using model {MODEL_NAME}."
+                return f"Embedding generated for Version {version.id} using model {get_embedding_model_version()} (cache hit: {cache_hit})."
             except Exception as e:
                 logger.error(f"Error saving embedding/model version for Version {version.id}: {e}")
                 # 数据库保存失败也应该重试
@@ -62,11 +78,13 @@ def generate_version_embedding_task(self, version_id: int):
 # def find_duplicate_versions_task(project_id):
 #     ... 
 
-@shared_task(bind=True, max_retries=2, default_retry_delay=180) # 增加重试延迟
-def find_and_store_duplicate_pairs_task(self, source_version_id: int, similarity_threshold: float = 0.90, limit_per_source: int = 50):
+@shared_task(bind=True, max_retries=2, default_retry_delay=180, priority=PRIORITY_DUPLICATES) # 增加重试延迟
+def find_and_store_duplicate_pairs_task(self, source_version_id: int, similarity_threshold: float = 0.90, limit_per_source: int = 50,
+                                        same_project: bool = False, active_only: bool = False):
     """
     Celery 任务：查找与给定版本相似的版本，并将潜在的重复对存储到 PotentialDuplicatePair 模型。
-    使用 update_or_create 来处理已存在记录的更新。
+    使用 bulk_upsert 一条语句写入全部结果，已评审 (confirmed/ignored) 的状态不会被重置，随后增量更新重复簇。
+    same_project=True 时只在源版本所属项目内查找。
     """
     logger.info(f"Starting similarity search and storage for source version {source_version_id} with threshold {similarity_threshold}...")
 
@@ -75,71 +93,48 @@ def find_and_store_duplicate_pairs_task(self, source_version_id: int, similarity
         similar_versions_qs = find_similar_testcases(
             source_version_id=source_version_id,
             similarity_threshold=similarity_threshold,
-            limit=limit_per_source
+            limit=limit_per_source,
+            same_project=same_project,
+            active_only=active_only,
         )
+        # 在设置了 hnsw.ef_search 的事务内求值，保证能返回 limit_per_source 个结果
+        with hnsw_search_params(ef_search=ef_search_for_limit(limit_per_source)):
+            similar_versions = list(similar_versions_qs.only('id'))
 
-        # 检查是否有结果
-        if not similar_versions_qs.exists():
-            logger.info(f"No similar versions found for source version {source_version_id} above threshold {similarity_threshold}.")
-            return f"No similar versions found for {source_version_id}."
-
-        # 获取源版本对象，避免在循环中重复查询
-        try:
-            source_version = TestCaseVersion.objects.get(pk=source_version_id)
-        except TestCaseVersion.DoesNotExist:
-             logger.error(f"Source TestCaseVersion {source_version_id} disappeared during task execution.")
-             return f"Source version {source_version_id} not found during pair creation."
-
-        processed_count = 0
-        created_count = 0
-        updated_count = 0
+        # 2. 收集配对信息 (bulk_upsert 会保证 version_a.id < version_b.id)
+        pairs_to_store = []
         error_count = 0
-
-        # 2. 遍历相似版本并存储配对信息
-        for similar_version in similar_versions_qs:
+        for similar_version in similar_versions:
             # 获取距离并计算相似度
             distance = getattr(similar_version, 'distance', None) # distance 是 annotate 添加的
             if distance is None:
                 logger.warning(f"Could not find distance for similar version {similar_version.id}. Skipping.")
                 error_count += 1
                 continue
-            similarity_score = 1.0 - distance
+            pairs_to_store.append((source_version_id, similar_version.id, 1.0 - distance))
+
+        if not pairs_to_store:
+            logger.info(f"No similar versions found for source version {source_version_id} above threshold {similarity_threshold}.")
+            return f"No similar versions found for {source_version_id}."
 
-            # 确保 version_a.id < version_b.id 以满足 unique_together
-            if source_version.id < similar_version.id:
-                version_a = source_version
-                version_b = similar_version
-            else:
-                version_a = similar_version
-                version_b = source_version
+        # 3. 一条 INSERT ... ON CONFLICT 语句写入全部配对
+        try:
+            created_count, updated_count = PotentialDuplicatePair.objects.bulk_upsert(pairs_to_store)
+        except IntegrityError as e:
+            # 例如源版本在任务执行期间被删除 (外键约束失败)
+            logger.error(f"Integrity error storing pairs for source version {source_version_id}: {e}")
+            return f"Source version {source_version_id} not found during pair creation."
 
-            # 3. 使用 update_or_create 存储或更新记录
-            try:
-                pair, created = PotentialDuplicatePair.objects.update_or_create(
-                    version_a=version_a,
-                    version_b=version_b,
-                    defaults={
-                        'similarity_score': similarity_score,
-                        'status': 'pending' # 每次找到都重置为待处理，或根据需求调整逻辑
-                    }
-                )
-                processed_count += 1
-                if created:
-                    created_count += 1
-                    # logger.info(f"Created pair: ({version_a.id}, {version_b.id}), Score: {similarity_score:.4f}")
-                else:
-                    updated_count += 1
-                    # logger.info(f"Updated pair: ({version_a.id}, {version_b.id}), Score: {similarity_score:.4f}")
-
-            except IntegrityError as e:
-                # 理论上 update_or_create 能处理并发，但以防万一
-                logger.error(f"Integrity error creating/updating pair ({version_a.id}, {version_b.id}): {e}")
-                error_count += 1
-            except Exception as e:
-                logger.exception(f"Unexpected error creating/updating pair ({version_a.id}, {version_b.id})") # 使用 exception 记录 traceback
-                error_count += 1
+        # 4. 增量更新源版本及其近邻所在的重复簇
+        cluster_stats = update_clusters_for_versions(
+            [source_version_id] + [version_id for _, version_id, _ in pairs_to_store]
+        )
 
-        summary = f"Finished for source {source_version_id}. Pairs created: {created_count}, updated: {updated_count}, errors: {error_count}."
+        summary = (
+            f"Finished for source {source_version_id}. Pairs created: {created_count}, updated: {updated_count}, "
+            f"errors: {error_count}. Clusters created: {cluster_stats['created']}, updated: {cluster_stats['updated']}, "
+            f"deleted: {cluster_stats['deleted']}."
+        )
         logger.info(summary)
         return summary
 
@@ -149,26 +144,19 @@ def find_and_store_duplicate_pairs_task(self, source_version_id: int, similarity
         raise self.retry(exc=e) 
 
 # +++ 强制重新添加批量任务 +++
-@shared_task(bind=True, max_retries=2, default_retry_delay=120) # 批量任务重试次数和延迟可以调整
-def generate_embeddings_batch_task(self, version_ids: List[int]):
-    """
-    Celery 任务：为一批 TestCaseVersion 生成并批量保存 embedding。
+def prepare_version_embeddings(versions: List[TestCaseVersion],
+                               batch_size: int = 32) -> Tuple[List[TestCaseVersion], dict]:
     """
-    model = get_embedding_model()
-    if not model:
-        logger.error("Embedding model not loaded. Retrying batch task later.")
-        raise self.retry(exc=RuntimeError("Embedding model not loaded"), countdown=300)
-
-    logger.info(f"Starting batch embedding generation for {len(version_ids)} versions...")
-
-    versions_to_process = list(TestCaseVersion.objects.filter(pk__in=version_ids))
-    if not versions_to_process:
-        logger.warning("No valid versions found for the provided IDs in this batch.")
-        return "No valid versions found in batch."
+    为一组已加载的 TestCaseVersion 编码文本并把结果设置到实例上 (不写数据库)。
+    编码失败时直接抛出异常。
 
+    Returns:
+        (需要写回的版本列表, 统计信息: encoded / cache_hits)。
+    """
+    stats = {'encoded': 0, 'cache_hits': 0}
     texts_to_encode = []
     original_order_versions = []
-    for version in versions_to_process:
+    for version in versions:
         text = extract_version_text(version)
         if text:
             texts_to_encode.append(text)
@@ -178,48 +166,233 @@ def generate_embeddings_batch_task(self, version_ids: List[int]):
 
     if not texts_to_encode:
         logger.info("No text content found for any version in this batch.")
-        return "No text content found in batch."
+        return [], stats
+
+    logger.info(f"Encoding {len(texts_to_encode)} texts in batch...")
+    embeddings_list, stats['cache_hits'] = encode_texts(texts_to_encode, batch_size=batch_size)
+    stats['encoded'] = len(embeddings_list)
+    logger.info(f"Successfully encoded {len(embeddings_list)} texts ({stats['cache_hits']} from cache).")
+
+    versions_to_update = []
+    model_dimension = get_model_dimension()
+    if len(embeddings_list) != len(original_order_versions):
+        logger.error(f"Mismatch between embedding count ({len(embeddings_list)}) and versions with text ({len(original_order_versions)}).")
+        return [], stats
+    for version, embedding in zip(original_order_versions, embeddings_list):
+        if len(embedding) == model_dimension:
+            version.embedding = embedding
+            version.embedding_model_version = get_embedding_model_version()
+            # 写回时取数据库时钟 (而不是编码前的应用时间)，见 duplicates.py 中的水位线说明
+            version.embedding_updated_at = ClockTimestamp()
+            versions_to_update.append(version)
+        else:
+            logger.error(f"Dimension mismatch for Version {version.id} in batch processing. Expected {model_dimension}, got {len(embedding)}.")
+    return versions_to_update, stats
+
+
+def save_version_embeddings(versions: List[TestCaseVersion]) -> int:
+    """用一次 bulk_update 写回 prepare_version_embeddings 设置好的 embedding，返回更新的行数。"""
+    if not versions:
+        return 0
+    updated = TestCaseVersion.objects.bulk_update(
+        versions,
+        fields=['embedding', 'embedding_model_version', 'embedding_updated_at']
+    )
+    logger.info(f"Successfully bulk updated embeddings for {updated} versions.")
+    return updated
+
+
+def embed_versions_in_batch(version_ids: List[int]) -> dict:
+    """
+    为一批 TestCaseVersion 生成 embedding，并用一次 bulk_update 写回。
+    generate_embeddings_batch_task 和微批任务 flush_embedding_batch_task 共用这段逻辑。
+    编码失败时直接抛出异常，由调用方决定是否重试。
+    按 EMBEDDING_POLICY 再过滤一次：排队期间被停用的版本不再编码 (否则会绕过回收)。
+
+    Returns:
+        统计信息字典: found (找到的版本数), skipped (被策略跳过的版本数), encoded (得到向量的文本数),
+        cache_hits (其中命中内容哈希缓存、未调用模型的数量), updated (写回的版本数)。
+    """
+    stats = {'found': 0, 'skipped': 0, 'encoded': 0, 'cache_hits': 0, 'updated': 0}
+
+    versions = list(TestCaseVersion.objects.filter(pk__in=version_ids))
+    versions_to_process = [version for version in versions if embeds_eagerly(version)]
+    stats['found'] = len(versions_to_process)
+    stats['skipped'] = len(versions) - len(versions_to_process)
+    if stats['skipped']:
+        logger.info(f"Skipped {stats['skipped']} inactive versions in batch (EMBEDDING_POLICY=active).")
+    if not versions_to_process:
+        logger.warning("No valid versions found for the provided IDs in this batch.")
+        return stats
+
+    versions_to_update, encode_stats = prepare_version_embeddings(versions_to_process)
+    stats.update(encode_stats)
+    stats['updated'] = save_version_embeddings(versions_to_update)
+    return stats
+
+
+def _format_hit_rate(stats: dict) -> str:
+    if not stats['encoded']:
+        return "n/a"
+    return f"{stats['cache_hits']}/{stats['encoded']} ({stats['cache_hits'] / stats['encoded']:.1%})"
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=120, priority=PRIORITY_BULK) # 批量任务重试次数和延迟可以调整
+def generate_embeddings_batch_task(self, version_ids: List[int]):
+    """
+    Celery 任务：为一批 TestCaseVersion 生成并批量保存 embedding。
+    """
+    if not get_embedding_model():
+        logger.error("Embedding model not loaded. Retrying batch task later.")
+        raise self.retry(exc=RuntimeError("Embedding model not loaded"), countdown=300)
+
+    logger.info(f"Starting batch embedding generation for {len(version_ids)} versions...")
 
     try:
-        logger.info(f"Encoding {len(texts_to_encode)} texts in batch...")
-        embeddings_np = model.encode(texts_to_encode, batch_size=32)
-        embeddings_list = embeddings_np.tolist()
-        logger.info(f"Successfully encoded {len(embeddings_list)} texts.")
+        stats = embed_versions_in_batch(version_ids)
+    except DatabaseError as e:
+        logger.error(f"Error during bulk update: {e}")
+        return f"Error during bulk update for batch starting with version ID {version_ids[0]}."
     except Exception as e:
         logger.error(f"Error during batch encoding: {e}")
         raise self.retry(exc=e)
 
-    versions_to_update = []
-    if len(embeddings_list) == len(original_order_versions):
-        for version, embedding in zip(original_order_versions, embeddings_list):
-             if len(embedding) == model_dimension:
-                 version.embedding = embedding
-                 version.embedding_model_version = MODEL_NAME
-                 versions_to_update.append(version)
-             else:
-                 logger.error(f"Dimension mismatch for Version {version.id} in batch processing. Expected {model_dimension}, got {len(embedding)}.")
-    else:
-         logger.error(f"Mismatch between embedding count ({len(embeddings_list)}) and versions with text ({len(original_order_versions)}).")
-         return "Error: Mismatch in embedding results count."
-
-    if versions_to_update:
-        try:
-            updated_count = TestCaseVersion.objects.bulk_update(
-                versions_to_update,
-                fields=['embedding', 'embedding_model_version']
-            )
-            logger.info(f"Successfully bulk updated embeddings for {updated_count} versions.")
-            return f"Batch processed. Updated embeddings for {updated_count} versions using model {MODEL_NAME}."
-        except Exception as e:
-            logger.error(f"Error during bulk update: {e}")
-            return f"Error during bulk update for batch starting with version ID {version_ids[0]}."
-    else:
+    if not stats['found']:
+        return "No valid versions found in batch."
+    if not stats['encoded']:
+        return "No text content found in batch."
+    if not stats['updated']:
         logger.info("No versions prepared for bulk update in this batch.")
         return "No versions updated in this batch."
+    return (f"Batch processed. Updated embeddings for {stats['updated']} versions using model {get_embedding_model_version()}. "
+            f"Cache hit rate: {_format_hit_rate(stats)}.")
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30, priority=PRIORITY_INTERACTIVE)
+def flush_embedding_batch_task(self):
+    """
+    Celery 任务：取出微批缓冲区中待处理的版本 ID，合并为一次 model.encode(batch)。
+    由 batching.enqueue_version_embedding 在窗口到期或缓冲区达到批大小时派发，
+    celery beat 也定时派发，找回处理中超时的版本。
+    """
+    # 先清除"已安排 flush"标记，之后到达的版本会开启新的窗口
+    batching.clear_flush_scheduled()
+
+    if not get_embedding_model():
+        logger.error("Embedding model not loaded. Retrying micro-batch flush later.")
+        raise self.retry(exc=RuntimeError("Embedding model not loaded"))
+
+    # 找回崩溃的 worker 遗留在处理中集合的版本
+    recovered = batching.requeue_stale_versions()
+    if recovered:
+        logger.warning(f"Requeued {recovered} embedding micro-batch versions left in processing by a previous flush.")
+
+    # 取出的版本移入处理中集合，写回成功后才移除
+    version_ids = batching.pop_pending_versions(batching.get_batch_size())
+    if not version_ids:
+        return "No pending versions to embed."
+
+    logger.info(f"Flushing embedding micro-batch with {len(version_ids)} versions...")
+    try:
+        stats = embed_versions_in_batch(version_ids)
+    except Exception as e:
+        # 放回缓冲区，重试时与新到达的版本一起处理
+        logger.error(f"Error during micro-batch embedding: {e}")
+        batching.requeue_processing_versions(version_ids)
+        raise self.retry(exc=e)
+    batching.ack_processing_versions(version_ids)
+
+    # 窗口期间积压的版本超过一个批次时，立即继续处理
+    if batching.pending_count() > 0 and batching.mark_flush_scheduled():
+        flush_embedding_batch_task.delay()
+
+    return (f"Micro-batch processed. Requested: {len(version_ids)}, updated: {stats['updated']} using model {get_embedding_model_version()}. "
+            f"Cache hit rate: {_format_hit_rate(stats)}.")
 # +++ 结束强制重新添加批量任务 +++
 
-# @shared_task
-# def find_duplicate_versions_task(project_id):
-#     ... 
+@shared_task(bind=True, ignore_result=True, priority=PRIORITY_INTERACTIVE)
+def encode_query_task(self, text: str, reply_key: Optional[str] = None):
+    """
+    Celery 任务：在 embedding worker 中编码一条语义搜索的检索语句，结果写入共享缓存，
+    再向 reply_key 推送通知 (utils.encode_query 在该列表上 BLPOP 等待)。不重试 (请求早已超时返回)。
+    """
+    if not get_embedding_model():
+        logger.error("Embedding model not loaded. Cannot encode semantic search query.")
+        return "Embedding model not loaded."
+    encode_texts([text])
+    if reply_key:
+        pipe = batching.get_redis().pipeline(transaction=False)
+        pipe.rpush(reply_key, 1)
+        pipe.expire(reply_key, QUERY_REPLY_TTL)
+        pipe.execute()
+    return "Query encoded."
+
+@shared_task(bind=True, max_retries=1, default_retry_delay=300, priority=PRIORITY_BULK)
+def find_duplicates_bulk_task(self, project_id: Optional[int] = None, similarity_threshold: float = 0.90,
+                              limit_per_source: int = 50, active_only: bool = False, incremental: bool = False):
+    """
+    Celery 任务：对一个项目执行批量重复检测 (矩阵分块 top-k + 批量 upsert)，
+    替代逐版本派发 find_and_store_duplicate_pairs_task。
+    project_id 为 None 时依次处理所有存在 embedding 的项目。
+    incremental=True 时只比较上次完成扫描之后 embedding 有变化的版本。
+    """
+    project_ids = [project_id] if project_id is not None else get_projects_with_embeddings()
+    total_versions = 0
+    total_pairs = 0
+    total_retired = 0
+    try:
+        for current_project_id in project_ids:
+            stats = run_duplicate_scan(
+                project_id=current_project_id,
+                incremental=incremental,
+                similarity_threshold=similarity_threshold,
+                limit_per_source=limit_per_source,
+                active_only=active_only,
+            )
+            total_versions += stats['versions']
+            total_pairs += stats['pairs']
+            total_retired += stats['retired']
+    except Exception as e:
+        logger.exception(f"Error in find_duplicates_bulk_task for project {project_id}")
+        raise self.retry(exc=e)
+
+    summary = (f"{'Incremental' if incremental else 'Bulk'} duplicate detection finished for {len(project_ids)} project(s). "
+               f"Versions scanned: {total_versions}, pairs stored: {total_pairs}, stale pairs retired: {total_retired}.")
+    logger.info(summary)
+    return summary
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=300, priority=PRIORITY_BULK)
+def run_embedding_model_migration_task(self, migration_id: int, batch_size: int = 256, batches_per_task: int = 20):
+    """
+    Celery 任务：为模型迁移的影子列生成一段向量 (batches_per_task 批)，未完成时重新派发自身，
+    让大批量迁移与其他 embedding_bulk 任务交替执行，而不是长时间独占一个 worker。
+    """
+    from .model_migration import ModelMigrationError, run_migration
+
+    try:
+        migration = EmbeddingModelMigration.objects.get(pk=migration_id)
+    except EmbeddingModelMigration.DoesNotExist:
+        logger.error(f"EmbeddingModelMigration {migration_id} not found.")
+        return f"Migration {migration_id} not found."
+    if migration.status != 'embedding':
+        return f"Migration {migration_id} is {migration.status}, nothing to do."
+
+    try:
+        migration = run_migration(migration, batch_size=batch_size, max_batches=batches_per_task)
+    except ModelMigrationError as e:
+        logger.warning(f"Embedding model migration {migration_id} stopped: {e}")
+        return str(e)
+    except Exception as e:
+        logger.exception(f"Error in run_embedding_model_migration_task for migration {migration_id}")
+        raise self.retry(exc=e)
+
+    if migration.status == 'embedding':
+        run_embedding_model_migration_task.apply_async(
+            args=[migration_id], kwargs={'batch_size': batch_size, 'batches_per_task': batches_per_task}
+        )
+    summary = (f"Embedding model migration {migration_id}: {migration.versions_embedded} versions embedded, "
+               f"status {migration.status}.")
+    logger.info(summary)
+    return summary
 
-# ... (find_and_store_duplicate_pairs_task definition) ... 
\ No newline at end of file
@@ -1,4 +1,281 @@
 # back/apps/analysis/tests.py
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from apps.projects.models import Project
+from apps.testcases.models import TestCase as Case, TestCaseVersion
+from .clusters import rebuild_clusters, update_clusters_for_versions
+from .duplicates import collect_unique_pairs, iter_topk_pairs, run_duplicate_scan
+from .model_migration import build_shadow_indexes, cutover, drop_shadow_indexes, rollback
+from .models import DuplicateCluster, DuplicateScanRun, EmbeddingModelMigration, PotentialDuplicatePair
+from .policy import ensure_version_embedding
+from .utils import get_model_dimension, invalidate_active_model_spec
 
-# Create your tests here. 
\ No newline at end of file
+# 文本都很短且相近，关闭 shingle 预过滤，配对只由向量决定
+PREFILTER_OFF = override_settings(SHINGLE_PREFILTER_ENABLED=False, DUPLICATE_CLUSTER_THRESHOLD=0.90)
+
+
+def vector(*components):
+    """由 (维度, 权重) 构造 embedding：同一主维度上的两个向量相似度约 0.995，不同主维度正交。"""
+    values = np.zeros(get_model_dimension(), dtype=np.float32)
+    for index, weight in components:
+        values[index] = weight
+    return values.tolist()
+
+
+def create_versions(project, embeddings, embedded_at=None, **fields):
+    """批量创建 (不触发 embedding 信号) 已有 embedding 的活动版本，返回 {名称: 版本}。"""
+    cases = Case.objects.bulk_create([Case(title=name, project=project) for name in embeddings])
+    versions = TestCaseVersion.objects.bulk_create([
+        TestCaseVersion(test_case=case, project=project, version_number=1, title=case.title, is_active=True,
+                        embedding=embedding, embedding_updated_at=embedded_at, **fields)
+        for case, embedding in zip(cases, embeddings.values())
+    ])
+    return {version.title: version for version in versions}
+
+
+def create_project(code):
+    user = get_user_model().objects.create_user(username=f'analyst-{code}', password='x')
+    return Project.objects.create(name=code, code=code, creator=user, start_date=date.today())
+
+
+class TopKPairsTests(SimpleTestCase):
+
+    def test_blocked_topk_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        matrix = rng.normal(size=(23, 8)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        ids = np.arange(100, 123, dtype=np.int64)
+        threshold, k = 0.2, 3
+
+        similarities = matrix @ matrix.T
+        np.fill_diagonal(similarities, -np.inf)
+        expected = {
+            (int(ids[row]), int(ids[col]))
+            for row in range(len(ids)) for col in np.argsort(-similarities[row])[:k]
+            if similarities[row, col] > threshold
+        }
+        for block_size in (1, 5, 64):
+            pairs = list(iter_topk_pairs(ids, matrix, threshold, k, block_size=block_size))
+            self.assertEqual({(source, neighbour) for source, neighbour, _ in pairs}, expected)
+            self.assertTrue(all(threshold < similarity <= 1.0 for _, _, similarity in pairs))
+
+    def test_unique_pairs_are_normalized(self):
+        pairs = collect_unique_pairs([(2, 1, 0.91), (1, 2, 0.95), (3, 1, 0.92)])
+        self.assertEqual(pairs, {(1, 2): 0.95, (1, 3): 0.92})
+
+
+@PREFILTER_OFF
+class DuplicateScanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = create_project('DUPSCAN')
+        cls.versions = create_versions(cls.project, {
+            'a': vector((0, 1.0)), 'b': vector((0, 1.0), (1, 0.1)),
+            'c': vector((2, 1.0)), 'd': vector((2, 1.0), (3, 0.1)),
+            'e': vector((4, 1.0)),
+        }, embedded_at=timezone.now() - timedelta(days=1))
+
+    def ids(self, *names):
+        return {self.versions[name].id for name in names}
+
+    def pair_ids(self):
+        return set(PotentialDuplicatePair.objects.values_list('version_a_id', 'version_b_id'))
+
+    def cluster_members(self):
+        return sorted(
+            sorted(cluster.members.values_list('id', flat=True))
+            for cluster in DuplicateCluster.objects.filter(project=self.project)
+        )
+
+    def pair(self, *names):
+        return tuple(sorted(self.ids(*names)))
+
+    def scan(self, incremental=True):
+        return run_duplicate_scan(self.project.id, incremental=incremental, similarity_threshold=0.9)
+
+    def change(self, name, embedding):
+        TestCaseVersion.objects.filter(pk=self.versions[name].id).update(
+            embedding=embedding, embedding_updated_at=timezone.now()
+        )
+
+    def test_first_scan_is_full(self):
+        stats = self.scan()
+        self.assertEqual((stats['mode'], stats['versions']), ('full', 5))
+        self.assertEqual(self.pair_ids(), {self.pair('a', 'b'), self.pair('c', 'd')})
+        self.assertEqual(self.cluster_members(), sorted([sorted(self.ids('a', 'b')), sorted(self.ids('c', 'd'))]))
+
+    def test_incremental_scan_picks_up_changed_versions(self):
+        self.scan()
+        self.change('e', vector((0, 1.0), (5, 0.1)))
+        stats = self.scan()
+        self.assertEqual((stats['mode'], stats['versions']), ('incremental', 1))
+        # 水位线为上一次扫描的开始时间减去安全余量
+        full, incremental = DuplicateScanRun.objects.order_by('started_at')
+        self.assertEqual(incremental.watermark, full.started_at - timedelta(seconds=300))
+        self.assertIn(self.pair('a', 'e'), self.pair_ids())
+        # 新配对把 e 并入 a、b 所在的簇
+        self.assertEqual(self.cluster_members(), sorted([sorted(self.ids('a', 'b', 'e')), sorted(self.ids('c', 'd'))]))
+
+    def test_incremental_scan_retires_pairs_of_changed_versions(self):
+        self.scan()
+        self.change('b', vector((6, 1.0)))
+        stats = self.scan()
+        self.assertEqual(stats['retired'], 1)
+        self.assertEqual(self.pair_ids(), {self.pair('c', 'd')})
+        self.assertEqual(self.cluster_members(), [sorted(self.ids('c', 'd'))])
+
+    def test_full_scan_retires_unseen_pairs(self):
+        self.scan()
+        # 不更新 embedding_updated_at：只有全量扫描能发现 a、b 不再相似
+        TestCaseVersion.objects.filter(pk=self.versions['b'].id).update(embedding=vector((6, 1.0)))
+        stats = self.scan(incremental=False)
+        self.assertEqual(stats['retired'], 1)
+        self.assertEqual(self.pair_ids(), {self.pair('c', 'd')})
+
+    def test_reviewed_pairs_are_not_retired(self):
+        self.scan()
+        PotentialDuplicatePair.objects.filter(version_a_id=min(self.ids('a', 'b'))).update(status='confirmed')
+        TestCaseVersion.objects.filter(pk=self.versions['b'].id).update(embedding=vector((6, 1.0)))
+        self.scan(incremental=False)
+        self.assertIn(self.pair('a', 'b'), self.pair_ids())
+
+    def test_model_switch_forces_full_scan(self):
+        self.scan()
+        EmbeddingModelMigration.objects.create(
+            model_name='other', backend='onnx', model_version='other', status='rolled_back',
+            cutover_at=timezone.now(), finished_at=timezone.now(),
+        )
+        self.assertEqual(self.scan()['mode'], 'full')
+        # 切换时间早于新水位线 (余量为 0 时即上一次全量扫描的开始时间) 后恢复增量扫描
+        with self.settings(DUPLICATE_SCAN_WATERMARK_MARGIN_SECONDS=0):
+            self.assertEqual(self.scan()['mode'], 'incremental')
+
+
+class ClusterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = create_project('CLUSTER')
+        cls.versions = create_versions(project, {name: None for name in 'abcdef'})
+
+    def link(self, *names, score=0.95):
+        a, b = sorted(self.versions[name].id for name in names)
+        return PotentialDuplicatePair.objects.create(version_a_id=a, version_b_id=b, similarity_score=score)
+
+    def clusters(self):
+        return {
+            cluster.pk: {version.title for version in cluster.members.all()}
+            for cluster in DuplicateCluster.objects.prefetch_related('members')
+        }
+
+    def touched(self, *names):
+        return [self.versions[name].id for name in names]
+
+    def test_cluster_splits_when_pair_is_ignored(self):
+        self.link('a', 'b')
+        bridge = self.link('b', 'c')
+        self.link('c', 'd')
+        rebuild_clusters()
+        (cluster_id, members), = self.clusters().items()
+        self.assertEqual(members, set('abcd'))
+
+        bridge.status = 'ignored'
+        bridge.save(update_fields=['status'])
+        stats = update_clusters_for_versions(self.touched('b', 'c'))
+        self.assertEqual(stats, {'created': 1, 'updated': 1, 'deleted': 0})
+        clusters = self.clusters()
+        self.assertEqual(sorted(map(sorted, clusters.values())), [['a', 'b'], ['c', 'd']])
+        # 原簇行被其中一个分量复用 (保留 id 与评审状态)
+        self.assertIn(cluster_id, clusters)
+
+    def test_clusters_merge_through_new_pair(self):
+        self.link('a', 'b')
+        self.link('c', 'd')
+        self.link('e', 'f', score=0.5)
+        rebuild_clusters()
+        self.assertEqual(sorted(map(sorted, self.clusters().values())), [['a', 'b'], ['c', 'd']])
+
+        self.link('b', 'c')
+        stats = update_clusters_for_versions(self.touched('b', 'c'))
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'deleted': 1})
+        self.assertEqual(list(self.clusters().values()), [set('abcd')])
+
+    def test_rebuild_removes_dissolved_clusters(self):
+        pair = self.link('a', 'b')
+        rebuild_clusters()
+        pair.delete()
+        self.assertEqual(rebuild_clusters()['deleted'], 1)
+        self.assertEqual(self.clusters(), {})
+
+
+class ModelMigrationTests(TransactionTestCase):
+    """切换与回滚改写表结构 (列与索引改名) 并以 CREATE INDEX CONCURRENTLY 建立孪生索引，不能在测试事务中运行。"""
+
+    def setUp(self):
+        self.addCleanup(invalidate_active_model_spec)
+        self.addCleanup(drop_shadow_indexes)
+        project = create_project('MIGRATE')
+        shadow_at = timezone.now()
+        self.old = {'a': vector((0, 1.0)), 'b': vector((1, 1.0)), 'c': vector((2, 1.0))}
+        self.new = {'a': vector((3, 1.0)), 'b': vector((4, 1.0)), 'c': vector((5, 1.0))}
+        self.versions = create_versions(project, self.old, embedded_at=shadow_at - timedelta(hours=1),
+                                        embedding_model_version='old')
+        for name, version in self.versions.items():
+            TestCaseVersion.objects.filter(pk=version.pk).update(
+                embedding_shadow=self.new[name], embedding_shadow_model_version='new',
+                embedding_shadow_updated_at=shadow_at,
+            )
+        self.migration = EmbeddingModelMigration.objects.create(
+            model_name='new', backend='onnx', model_version='new', source_model_version='old', status='ready',
+        )
+        build_shadow_indexes()
+
+    def embeddings(self):
+        return {
+            version.title: (None if version.embedding is None else list(version.embedding), version.embedding_model_version)
+            for version in TestCaseVersion.objects.filter(pk__in=[v.pk for v in self.versions.values()])
+        }
+
+    def test_cutover_then_rollback_restores_original_vectors(self):
+        cutover(self.migration)
+        self.assertEqual(self.embeddings(), {name: (self.new[name], 'new') for name in self.new})
+
+        self.assertEqual(rollback(self.migration), 0)
+        self.assertEqual(self.embeddings(), {name: (self.old[name], 'old') for name in self.old})
+        self.migration.refresh_from_db()
+        self.assertEqual(self.migration.status, 'rolled_back')
+
+    def test_rollback_clears_vectors_edited_after_cutover(self):
+        cutover(self.migration)
+        TestCaseVersion.objects.filter(pk=self.versions['a'].pk).update(
+            embedding=vector((6, 1.0)), embedding_updated_at=timezone.now()
+        )
+        self.assertEqual(rollback(self.migration), 1)
+        embeddings = self.embeddings()
+        self.assertEqual(embeddings['a'][0], None)
+        self.assertEqual(embeddings['b'], (self.old['b'], 'old'))
+
+
+class OnDemandEmbeddingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.version = create_versions(create_project('ONDEMAND'), {'a': None})['a']
+
+    @mock.patch('apps.analysis.policy.is_embedding_model_enabled', return_value=False)
+    @mock.patch('apps.analysis.tasks.generate_version_embedding_task.apply_async')
+    @mock.patch('apps.analysis.batching.get_redis')
+    def test_polling_dispatches_once(self, get_redis, apply_async, _enabled):
+        # SET NX 只有第一次成功
+        get_redis.return_value.set.side_effect = [True, None, None]
+        for _ in range(3):
+            self.assertIsNone(ensure_version_embedding(self.version))
+        apply_async.assert_called_once()
+        get_redis.return_value.set.side_effect = ConnectionError
+        self.assertIsNone(ensure_version_embedding(self.version))
+        self.assertEqual(apply_async.call_count, 2)
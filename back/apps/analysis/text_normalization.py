@@ -0,0 +1,111 @@
+# back/apps/analysis/text_normalization.py
+"""
+富文本字段 (前置条件、步骤动作/预期结果) 的文本规范化。
+
+前端使用 WangEditor 编辑这些字段，保存的是 HTML；导入的用例中也常见 Markdown。
+把标记直接交给模型既浪费 token (max_seq_length 有限，标签会挤掉正文)，又会让仅排版相同的
+用例看起来相似。这里只用标准库把 HTML/Markdown 还原为纯文本，保留段落与列表的换行。
+"""
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+# 这些标签前后插入换行，其余 (strong、span、a 等行内标签) 只保留文字
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'table', 'thead', 'tbody', 'blockquote', 'pre',
+    'section', 'article', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+}
+CELL_TAGS = {'td', 'th'}
+# 内容不属于正文的标签
+SKIP_TAGS = {'script', 'style', 'head', 'title', 'template'}
+
+HTML_TAG_RE = re.compile(r'<\s*/?\s*[a-zA-Z][a-zA-Z0-9]*(\s[^>]*)?/?\s*>')
+
+# 顺序有意义：先处理图片再处理链接，先处理粗体再处理斜体
+MARKDOWN_RULES = [
+    (re.compile(r'^\s{0,3}(```|~~~).*$', re.MULTILINE), ''),                      # 代码块围栏
+    (re.compile(r'!\[([^\]]*)\]\([^)]*\)'), r'\1'),                                 # 图片 -> 替代文字
+    (re.compile(r'\[([^\]]+)\]\([^)]*\)'), r'\1'),                                  # 链接 -> 链接文字
+    (re.compile(r'`([^`\n]*)`'), r'\1'),                                            # 行内代码
+    (re.compile(r'^\s{0,3}#{1,6}\s+', re.MULTILINE), ''),                           # 标题
+    (re.compile(r'^\s{0,3}>\s?', re.MULTILINE), ''),                                # 引用
+    (re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$', re.MULTILINE), ''),                  # 分隔线
+    (re.compile(r'^\s*\|?(\s*:?-{3,}:?\s*\|)+\s*(:?-{3,}:?)?\s*$', re.MULTILINE), ''),  # 表格对齐行
+    (re.compile(r'^\s*\|(.*?)\|?\s*$', re.MULTILINE), lambda m: m.group(1).replace('|', ' ')),  # 表格行
+    (re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+', re.MULTILINE), ''),                   # 列表标记
+    (re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1'), r'\2'),                           # 粗体
+    (re.compile(r'~~(?=\S)(.+?)(?<=\S)~~'), r'\1'),                                 # 删除线
+    # 斜体只处理 *text*：_text_ 容易误伤 user_name 这类标识符
+    (re.compile(r'(?<![\w*])\*(?=\S)([^*\n]+?)(?<=\S)\*(?![\w*])'), r'\1'),
+]
+
+
+class _HTMLTextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag in CELL_TAGS:
+            self.parts.append(' ')
+        elif tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.parts.append(f' {alt} ')
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>、<img/> 等自闭合标签没有结束标签
+        if tag not in SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def get_text(self) -> str:
+        return ''.join(self.parts)
+
+
+def looks_like_html(text: str) -> bool:
+    return '<' in text and HTML_TAG_RE.search(text) is not None
+
+
+def html_to_text(text: str) -> str:
+    parser = _HTMLTextExtractor()
+    parser.feed(text)
+    parser.close()
+    return parser.get_text()
+
+
+def strip_markdown(text: str) -> str:
+    for pattern, replacement in MARKDOWN_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def clean_rich_text(value) -> str:
+    """
+    把 HTML/Markdown 富文本转换为纯文本：去掉标签与标记，解码实体 (&nbsp; 等)，
+    合并行内空白并去掉空行。纯文本输入只会被整理空白。
+    """
+    if not value:
+        return ''
+    text = str(value)
+    if looks_like_html(text):
+        text = html_to_text(text)
+    elif '&' in text:
+        text = unescape(text)
+    text = strip_markdown(text)
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
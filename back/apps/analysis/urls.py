@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PotentialDuplicatePairViewSet
+from .views import PotentialDuplicatePairViewSet, DuplicateClusterViewSet
 
 # 创建一个路由器并注册我们的 ViewSet
 router = DefaultRouter()
 router.register(r'potential-duplicates', PotentialDuplicatePairViewSet, basename='potential-duplicate-pair')
+router.register(r'duplicate-clusters', DuplicateClusterViewSet, basename='duplicate-cluster')
 
 # API URL 由路由器自动确定。
 urlpatterns = [
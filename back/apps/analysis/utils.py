@@ -1,88 +1,456 @@
-from sentence_transformers import SentenceTransformer
 from apps.testcases.models import TestCaseVersion
 import numpy as np
+import gc
 import logging
-from typing import Optional, List
-from pgvector.django import CosineDistance
-from django.db import models
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, List, Tuple
+from pgvector import Bit, HalfVector
+from pgvector.django import BitField, CosineDistance, HalfVectorField, HammingDistance
+from django.conf import settings
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models.functions import Cast
+from .embedding_cache import get_embedding_cache, make_cache_key
+from .backends import EmbeddingBackend, create_backend, get_backend_name, get_onnx_quantized, model_version_for
+from .models import EmbeddingModelMigration
+from .text_normalization import clean_rich_text
 
 logger = logging.getLogger(__name__)
 
 # --- 模型加载 ---
+# 模型不再在模块导入时加载：signals -> tasks -> utils 的导入链会让每个 Web worker、
+# 每个 manage.py 命令都把整个 mpnet 模型读入内存。现在改为按需 (首次使用时) 加载，
+# 并且只有显式开启 (opt-in) 的进程才允许加载，见 enable_embedding_model()。
 MODEL_NAME = 'paraphrase-multilingual-mpnet-base-v2'
-embedding_model = None
-model_dimension = 768 # 预定义维度以供检查
-
-try:
-    embedding_model = SentenceTransformer(MODEL_NAME)
-    loaded_dimension = embedding_model.get_sentence_embedding_dimension()
-    if loaded_dimension != model_dimension:
-        logger.warning(f"Model dimension mismatch! Expected {model_dimension}, but loaded model has {loaded_dimension}. Using loaded dimension.")
-        model_dimension = loaded_dimension # 使用实际加载的维度
-    logger.info(f"Sentence Transformer model '{MODEL_NAME}' loaded successfully. Dimension: {model_dimension}")
-except Exception as e:
-    logger.error(f"Failed to load Sentence Transformer model '{MODEL_NAME}': {e}")
-    embedding_model = None
-
-def get_embedding_model() -> Optional[SentenceTransformer]:
-    """获取已加载的 embedding 模型实例"""
-    return embedding_model
+model_dimension = TestCaseVersion._meta.get_field('embedding').dimensions # 与 TestCaseVersion.embedding 字段一致
+
+_embedding_model = None
+_model_lock = threading.Lock()
+# 当前生效的模型 (model_name, backend, quantized)，见 get_active_model_spec()
+_active_spec = {'spec': None, 'checked_at': 0.0}
+# 加载失败的模型版本号 (同一版本不再重复尝试加载)
+_model_load_failed = None
+# 是否允许当前进程加载模型。Celery worker 在 worker_init 中开启；其他进程可通过
+# settings.EMBEDDING_MODEL_AUTOLOAD 开启 (例如需要在进程内编码的管理命令)。
+_model_enabled = getattr(settings, 'EMBEDDING_MODEL_AUTOLOAD', False)
+# 记录加载耗时与内存，便于对比改造前后的启动时间和每进程内存占用
+_model_stats = {
+    'pid': None,
+    'loaded': False,
+    'backend': None,
+    'model_version': None,
+    'load_seconds': None,
+    'rss_before_kb': None,
+    'rss_after_kb': None,
+}
+
+
+def _current_max_rss_kb() -> int:
+    """返回当前进程的峰值常驻内存 (KB，Linux 下 ru_maxrss 的单位即为 KB)。"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def enable_embedding_model(preload: bool = False) -> None:
+    """
+    允许当前进程加载 embedding 模型。
+
+    Args:
+        preload: 是否立即加载。Celery prefork 模式下在主进程 (fork 之前) 预加载，
+                 子进程通过写时复制 (copy-on-write) 共享同一份模型权重。
+    """
+    global _model_enabled
+    _model_enabled = True
+    if preload:
+        model = get_embedding_model()
+        if model is not None:
+            # 将加载期间创建的对象移出 GC 追踪范围，避免子进程中的 GC 扫描触碰这些页面，
+            # 导致写时复制失效、每个子进程各自复制一份内存。
+            gc.freeze()
+
+
+def is_embedding_model_enabled() -> bool:
+    """当前进程是否允许加载 embedding 模型。"""
+    return _model_enabled
+
+
+def get_active_model_spec() -> Tuple[str, str, bool]:
+    """
+    返回当前生效的 (模型名, 后端, 是否 int8 量化)。
+
+    默认取 MODEL_NAME 与 settings.EMBEDDING_BACKEND / EMBEDDING_ONNX_QUANTIZED；
+    存在已切换 (cutover/finalized) 的模型迁移时以最近一次迁移为准，这样切换在数据库中原子生效，
+    各进程最多在 settings.EMBEDDING_MODEL_SPEC_TTL 秒后跟进，无需重新部署。
+    """
+    now = time.monotonic()
+    if _active_spec['spec'] is not None and now - _active_spec['checked_at'] < getattr(settings, 'EMBEDDING_MODEL_SPEC_TTL', 10):
+        return _active_spec['spec']
+    spec = (MODEL_NAME, get_backend_name(), get_onnx_quantized())
+    try:
+        migration = EmbeddingModelMigration.objects.filter(
+            status__in=('cutover', 'finalized')
+        ).order_by('-cutover_at').first()
+        if migration:
+            spec = (migration.model_name, migration.backend, migration.quantized)
+    except DatabaseError as e:
+        # 例如迁移表尚未创建 (执行 migrate 之前)
+        logger.debug(f"Could not read embedding model migrations: {e}")
+    _active_spec.update(spec=spec, checked_at=now)
+    return spec
+
+
+def invalidate_active_model_spec() -> None:
+    """使当前进程立即重新读取生效的模型 (模型切换/回滚后调用)。"""
+    _active_spec.update(spec=None, checked_at=0.0)
+
+
+def load_backend(model_name: str, backend_name: str, quantized: bool = False) -> EmbeddingBackend:
+    """创建并加载指定的后端，输出维度与 embedding 字段不一致时抛出 ValueError。"""
+    model = create_backend(model_name, backend_name, **({'quantized': quantized} if backend_name == 'onnx' else {}))
+    model.load()
+    if model.dimension != model_dimension:
+        # 维度与 TestCaseVersion.embedding (VectorField) 不一致时无法写入
+        raise ValueError(f"Model dimension mismatch! Expected {model_dimension}, but backend '{model.name}' produces {model.dimension}.")
+    return model
+
+
+def get_embedding_model() -> Optional[EmbeddingBackend]:
+    """
+    获取当前生效模型 (get_active_model_spec) 的推理后端，首次调用时加载 (线程安全)。
+    生效模型被切换后，下次调用时自动加载新模型。
+    返回对象的 encode(texts, batch_size) 与 SentenceTransformer.encode 兼容。
+    如果当前进程未开启模型加载，或者加载失败 (包括输出维度与 embedding 字段不一致)，返回 None。
+    """
+    global _embedding_model, _model_load_failed
+    model_name, backend_name, quantized = get_active_model_spec()
+    active_version = model_version_for(backend_name, model_name, quantized)
+    if _embedding_model is not None and _embedding_model.model_version == active_version:
+        return _embedding_model
+    if not _model_enabled:
+        logger.warning("Embedding model is not enabled in this process (pid %s). Call enable_embedding_model() to opt in.", os.getpid())
+        return None
+    if _model_load_failed == active_version:
+        return None
+
+    with _model_lock:
+        if _embedding_model is not None:
+            if _embedding_model.model_version == active_version:
+                return _embedding_model
+            logger.info(f"Active embedding model changed from {_embedding_model.model_version} to {active_version}, reloading.")
+            _embedding_model = None
+        rss_before = _current_max_rss_kb()
+        start_time = time.perf_counter()
+        try:
+            model = load_backend(model_name, backend_name, quantized)
+        except Exception as e:
+            logger.error(f"Failed to load embedding backend '{backend_name}' for model '{model_name}': {e}")
+            _model_load_failed = active_version
+            return None
+
+        load_seconds = time.perf_counter() - start_time
+        rss_after = _current_max_rss_kb()
+        _model_stats.update({
+            'pid': os.getpid(),
+            'loaded': True,
+            'backend': model.name,
+            'model_version': model.model_version,
+            'load_seconds': round(load_seconds, 3),
+            'rss_before_kb': rss_before,
+            'rss_after_kb': rss_after,
+        })
+        _embedding_model = model
+        logger.info(
+            f"Embedding backend '{model.name}' ({model.model_version}) loaded in pid {os.getpid()} in {load_seconds:.2f}s. "
+            f"Dimension: {model_dimension}, max RSS: {rss_before} KB -> {rss_after} KB."
+        )
+        return _embedding_model
+
+
+def get_embedding_model_version() -> str:
+    """写入 embedding_model_version 的版本号 (由生效的模型和后端决定，无需加载模型)。"""
+    model_name, backend_name, quantized = get_active_model_spec()
+    return model_version_for(backend_name, model_name, quantized)
+
+
+def get_model_dimension() -> int:
+    """返回模型维度 (与 TestCaseVersion.embedding 字段维度一致，后端加载时会校验)。"""
+    return model_dimension
+
+
+def get_embedding_model_stats() -> dict:
+    """返回当前进程中模型加载的统计信息 (加载耗时、加载前后峰值 RSS)。"""
+    stats = dict(_model_stats)
+    stats['enabled'] = _model_enabled
+    stats['current_pid'] = os.getpid()
+    stats['current_max_rss_kb'] = _current_max_rss_kb()
+    return stats
 
 def extract_version_text(version: TestCaseVersion) -> str:
     """
     从 TestCaseVersion 实例中提取用于生成 embedding 的文本内容。
+    前置条件与步骤是富文本 (WangEditor HTML 或 Markdown)，先还原为纯文本。
     """
     parts = []
     if version.title:
         parts.append(version.title.strip())
     if version.precondition:
-        # TODO: Consider cleaning HTML/Markdown if content is rich text
-        parts.append(version.precondition.strip())
+        parts.append(clean_rich_text(version.precondition))
     if version.steps_data and isinstance(version.steps_data, list):
         step_texts = []
         for step in version.steps_data:
-            action = step.get('action', '')
-            expected = step.get('expected_result', '')
+            action = clean_rich_text(step.get('action', ''))
+            expected = clean_rich_text(step.get('expected_result', ''))
             if action:
-                # TODO: Consider cleaning HTML/Markdown
-                step_texts.append(action.strip())
+                step_texts.append(action)
             if expected:
-                # TODO: Consider cleaning HTML/Markdown
-                step_texts.append(expected.strip())
+                step_texts.append(expected)
         if step_texts:
             parts.append("\n".join(step_texts))
     full_text = "\n\n".join(filter(None, parts))
     return full_text
 
+def encode_texts(texts: List[str], batch_size: int = 32,
+                 backend: Optional[EmbeddingBackend] = None) -> Tuple[List[List[float]], int]:
+    """
+    编码一组文本，优先复用内容哈希缓存中的向量，只对未命中的文本调用模型。
+    同一批次中重复的文本只编码一次。backend 为空时使用当前生效的模型
+    (模型迁移为影子列编码时传入目标模型的后端)。
+
+    Returns:
+        (与 texts 一一对应的向量列表, 缓存命中的文本数量)。
+        模型不可用时抛出 RuntimeError，编码出错时异常向上抛出。
+    """
+    cache = get_embedding_cache()
+    # 缓存键包含模型版本号，不同后端/量化方式生成的向量不会互相复用
+    model_version = backend.model_version if backend else get_embedding_model_version()
+    keys = [make_cache_key(text, model_version) for text in texts]
+    cached = cache.get_many(keys) if cache else {}
+    cache_hits = sum(1 for key in keys if key in cached)
+
+    # 未命中的文本按缓存键去重后再编码
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+
+    if missing:
+        model = backend or get_embedding_model()
+        if not model:
+            raise RuntimeError("Embedding model is not available.")
+        encoded = model.encode(list(missing.values()), batch_size=batch_size).tolist()
+        new_vectors = dict(zip(missing.keys(), encoded))
+        if cache:
+            cache.set_many(new_vectors)
+        cached.update(new_vectors)
+
+    return [cached[key] for key in keys], cache_hits
+
 def generate_embedding(version: TestCaseVersion) -> Optional[List[float]]:
     """
     为给定的 TestCaseVersion 生成 embedding 向量。
     返回 float 列表或 None (如果失败)。
     pgvector Django 库通常期望接收列表而不是 numpy 数组。
+    文本与已编码过的内容相同时直接复用缓存向量，不调用模型。
     """
-    model = get_embedding_model()
-    if not model:
-        logger.error("Embedding model is not available.")
-        return None
     text_to_encode = extract_version_text(version)
     if not text_to_encode:
         logger.warning(f"No text content for TestCaseVersion {version.id}. Cannot generate embedding.")
         return None
     try:
-        # encode() 返回 numpy 数组
-        embedding_vector_np = model.encode(text_to_encode)
-        # 转换为 Python 列表以存储到 VectorField
-        embedding_vector_list = embedding_vector_np.tolist()
+        vectors, _ = encode_texts([text_to_encode])
         # logger.info(f"Generated embedding for Version {version.id}")
-        return embedding_vector_list
+        return vectors[0]
     except Exception as e:
         logger.error(f"Error generating embedding for TestCaseVersion {version.id}: {e}")
         return None
 
+class QueryEncodingUnavailable(RuntimeError):
+    """检索语句没有可用的向量：缓存未命中，且 embedding worker 未在等待时间内完成编码。"""
+
+
+# encode_query_task 完成后向该前缀加请求 ID 的列表推送通知，Web 进程 BLPOP 等待
+QUERY_REPLY_KEY_PREFIX = 'tcms:analysis:query-reply:'
+# 通知列表的过期时间 (秒)：请求已超时返回时，未被取走的通知自动清除
+QUERY_REPLY_TTL = 60
+
+
+def encode_query(text: str, timeout: Optional[float] = None) -> List[float]:
+    """
+    编码一条检索语句 (语义搜索使用)。
+
+    与版本文本共用内容哈希缓存，重复的检索语句 (规范化后相同) 直接命中缓存，不调用模型。
+    Web 进程默认不加载模型 (settings.SEMANTIC_SEARCH_LOAD_MODEL 显式开启除外)：缓存未命中时
+    派发 encode_query_task 到 embedding 队列，由 worker 编码并写入 Redis 共享缓存，再向本次请求的
+    通知列表推送一条消息；这里以一次 BLPOP 阻塞等待该通知最多 timeout 秒 (默认 SEMANTIC_SEARCH_ENCODE_TIMEOUT_MS)，
+    不轮询缓存。仍未得到向量时抛出 QueryEncodingUnavailable。
+    """
+    if not is_embedding_model_enabled() and getattr(settings, 'SEMANTIC_SEARCH_LOAD_MODEL', False):
+        enable_embedding_model()
+    if is_embedding_model_enabled():
+        vectors, _ = encode_texts([text])
+        return vectors[0]
+
+    cache = get_embedding_cache()
+    if cache is None or not cache.use_redis:
+        raise QueryEncodingUnavailable("Embedding model is not loaded in this process and no shared embedding cache is configured.")
+    key = make_cache_key(text, get_embedding_model_version())
+    vector = cache.get(key)
+    if vector is not None:
+        return vector
+
+    from .queues import EMBEDDING_QUEUE, PRIORITY_INTERACTIVE
+    from .tasks import encode_query_task
+
+    if timeout is None:
+        timeout = getattr(settings, 'SEMANTIC_SEARCH_ENCODE_TIMEOUT_MS', 3000) / 1000.0
+    reply_key = f"{QUERY_REPLY_KEY_PREFIX}{uuid.uuid4().hex}"
+    # 请求放弃等待之后 worker 不必再处理
+    encode_query_task.apply_async(args=[text], kwargs={'reply_key': reply_key}, queue=EMBEDDING_QUEUE,
+                                  priority=PRIORITY_INTERACTIVE, expires=max(timeout, 1.0))
+    from .batching import get_redis
+
+    if get_redis().blpop([reply_key], timeout=timeout) is not None:
+        vector = cache.get(key)
+        if vector is not None:
+            return vector
+    raise QueryEncodingUnavailable(f"Query embedding was not produced by an embedding worker within {timeout:.1f}s.")
+
+@contextmanager
+def hnsw_search_params(ef_search: Optional[int] = None, iterative_scan: Optional[str] = None):
+    """
+    在一个事务内为向量检索设置 HNSW 参数 (SET LOCAL 只在当前事务内生效)，
+    需要在 with 块内执行 (求值) 查询集。
+
+    Args:
+        ef_search: hnsw.ef_search，检索时的候选列表大小。它同时是单次 HNSW 扫描能返回的
+                   最大结果数 (默认 40)，limit 更大时必须相应调大。
+        iterative_scan: hnsw.iterative_scan (pgvector >= 0.8)，'strict_order' 或 'relaxed_order'。
+                        带过滤条件的查询在结果不足时会继续扫描，而不是只返回后过滤剩下的部分。
+    """
+    if ef_search is None:
+        ef_search = getattr(settings, 'VECTOR_SEARCH_EF_SEARCH', None)
+    if iterative_scan is None:
+        iterative_scan = getattr(settings, 'VECTOR_SEARCH_ITERATIVE_SCAN', None)
+    if iterative_scan and iterative_scan not in ('strict_order', 'relaxed_order', 'off'):
+        raise ValueError(f"Invalid hnsw.iterative_scan value: {iterative_scan}")
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if ef_search:
+                cursor.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+            if iterative_scan:
+                cursor.execute(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}")
+        yield
+
+
+def ef_search_for_limit(limit: int) -> int:
+    """
+    ef_search 至少要等于 limit，否则单次 HNSW 扫描返回的结果数会被截断。
+    binary 模式下 HNSW 扫描返回的是待重排的候选集，ef_search 至少要等于候选数量。
+    """
+    if get_vector_storage_mode() == 'binary':
+        limit = max(limit, get_rerank_candidates())
+    return max(limit, getattr(settings, 'VECTOR_SEARCH_EF_SEARCH', None) or 40)
+
+
+# --- 向量检索的存储/索引布局 ---
+# float32: 直接在 embedding (vector) 上检索，使用 Meta 中声明的 HNSW 索引。
+# halfvec: 在表达式 embedding::halfvec 上检索，索引体积约为 float32 的一半。
+# binary:  先在 binary_quantize(embedding)::bit 上按汉明距离取候选 (索引约为 float32 的 1/32)，
+#          再用原始 float32 向量计算余弦距离重排。
+# halfvec / binary 索引由 vector_indexes --create-quantized 创建，切换前需先建好索引。
+VECTOR_STORAGE_MODES = ('float32', 'halfvec', 'binary')
+
+
+class BinaryQuantize(models.Func):
+    """pgvector 的 binary_quantize(vector)：分量 > 0 记为 1，否则为 0。"""
+    function = 'binary_quantize'
+    output_field = BitField()
+
+
+class ClockTimestamp(models.Func):
+    """PostgreSQL 的 clock_timestamp()：语句执行时的数据库时间 (now() 是事务开始时间)。"""
+    template = 'clock_timestamp()'
+    output_field = models.DateTimeField()
+
+
+def get_vector_storage_mode() -> str:
+    mode = getattr(settings, 'VECTOR_STORAGE_MODE', 'float32')
+    if mode not in VECTOR_STORAGE_MODES:
+        raise ValueError(f"Invalid VECTOR_STORAGE_MODE: {mode}")
+    return mode
+
+
+def get_rerank_candidates() -> int:
+    return getattr(settings, 'VECTOR_SEARCH_RERANK_CANDIDATES', 200)
+
+
+def halfvec_expression():
+    return Cast('embedding', HalfVectorField(dimensions=model_dimension))
+
+
+def binary_expression():
+    return Cast(BinaryQuantize('embedding'), BitField(length=model_dimension))
+
+
+def quantize_binary(embedding) -> Bit:
+    """在 Python 端做与 binary_quantize 相同的量化，用作汉明距离检索的查询向量。"""
+    return Bit(np.asarray(embedding, dtype=np.float32) > 0)
+
+
+def similar_versions_queryset(
+    embedding,
+    similarity_threshold: Optional[float] = None,
+    project_id: Optional[int] = None,
+    active_only: bool = False,
+    exclude_id: Optional[int] = None,
+    storage_mode: Optional[str] = None,
+) -> models.QuerySet:
+    """
+    构建按余弦距离排序的向量检索查询集 (未切片，调用方负责 [:limit])。
+
+    - project_id: 只在该项目内检索 (使用冗余的 TestCaseVersion.project，无需 JOIN；
+      大项目可以用 vector_indexes 命令建立按项目的部分 HNSW 索引)。
+    - active_only: 只检索活动版本，命中部分索引 tcversion_emb_active_hnsw_idx。
+    - storage_mode: 检索使用的索引布局 (float32 / halfvec / binary)，默认取 settings.VECTOR_STORAGE_MODE。
+    """
+    storage_mode = storage_mode or get_vector_storage_mode()
+    queryset = TestCaseVersion.objects.filter(embedding__isnull=False)
+    if exclude_id is not None:
+        queryset = queryset.exclude(pk=exclude_id)
+    if project_id is not None:
+        queryset = queryset.filter(project_id=project_id)
+    if active_only:
+        queryset = queryset.filter(is_active=True)
+
+    if storage_mode == 'halfvec':
+        queryset = queryset.annotate(distance=CosineDistance(halfvec_expression(), HalfVector(embedding)))
+    elif storage_mode == 'binary':
+        # 第一阶段：汉明距离取候选 (走 bit HNSW 索引)；第二阶段：在候选内按 float32 余弦距离重排
+        candidates = queryset.annotate(
+            hamming=HammingDistance(binary_expression(), quantize_binary(embedding).to_text())
+        ).order_by('hamming').values('pk')[:get_rerank_candidates()]
+        queryset = TestCaseVersion.objects.filter(pk__in=candidates).annotate(
+            distance=CosineDistance('embedding', embedding)
+        )
+    else:
+        queryset = queryset.annotate(distance=CosineDistance('embedding', embedding))
+    if similarity_threshold is not None:
+        # pgvector 使用距离 (0 表示完全相同)，对应距离阈值为 1 - similarity_threshold
+        queryset = queryset.filter(distance__lt=1.0 - similarity_threshold)
+    return queryset.order_by('distance')
+
+
 def find_similar_testcases(
     source_version_id: int,
     limit: int = 10,
-    similarity_threshold: float = 0.90
+    similarity_threshold: float = 0.90,
+    project_id: Optional[int] = None,
+    active_only: bool = False,
+    same_project: bool = False,
 ) -> models.QuerySet[TestCaseVersion]:
     """
     查找与给定的 TestCaseVersion 语义相似的其他用例版本。
@@ -92,13 +460,17 @@ def find_similar_testcases(
         limit: 最多返回多少个相似用例版本。
         similarity_threshold: 余弦相似度阈值 (值越高越相似, 1 为完全相同)。
                               对应数据库查询的距离阈值为 1 - similarity_threshold。
+        project_id: 只在指定项目内检索。
+        active_only: 只检索活动版本。
+        same_project: 只在源版本所属项目内检索 (优先于 project_id)。
 
     Returns:
         一个包含相似 TestCaseVersion 对象的 QuerySet，按相似度（距离）排序。
         如果源版本不存在或没有 embedding，则返回空的 QuerySet。
+        limit 大于 hnsw.ef_search 时，应在 hnsw_search_params(ef_search=limit) 内求值。
     """
     try:
-        source_version = TestCaseVersion.objects.get(pk=source_version_id)
+        source_version = TestCaseVersion.objects.only('id', 'embedding', 'project_id').get(pk=source_version_id)
     except TestCaseVersion.DoesNotExist:
         logger.error(f"Source TestCaseVersion {source_version_id} not found for similarity search.")
         return TestCaseVersion.objects.none() # 返回空 QuerySet
@@ -107,33 +479,24 @@ def find_similar_testcases(
         logger.warning(f"Source TestCaseVersion {source_version_id} does not have an embedding. Cannot perform similarity search.")
         return TestCaseVersion.objects.none()
 
-    # 计算距离阈值 (pgvector 使用距离，0表示完全相同，值越小越相似)
-    distance_threshold = 1.0 - similarity_threshold
-
-    # 执行向量相似度查询
-    # 使用 l2_distance, max_inner_product, or cosine_distance
-    # cosine_distance 范围 0 到 2 (0 最相似)
-    # 确保查询的字段是 'embedding'，并且与 source_version.embedding 比较
-    similar_versions = TestCaseVersion.objects \
-        .exclude(pk=source_version_id) \
-        .filter(embedding__isnull=False) \
-        .annotate(distance=CosineDistance('embedding', source_version.embedding)) \
-        .filter(distance__lt=distance_threshold) \
-        .order_by('distance')[:limit]
-
-    count = similar_versions.count() # 获取实际找到的数量
-    if count > 0:
-         logger.info(f"Found {count} similar versions for Version {source_version_id} (threshold={similarity_threshold}, distance < {distance_threshold:.4f}).")
-    # else:
-    #      logger.info(f"No similar versions found for Version {source_version_id} above threshold {similarity_threshold}.")
-
+    if same_project:
+        project_id = source_version.project_id
 
-    return similar_versions
+    # 不再额外执行 count()：那会把同一个向量检索再跑一遍
+    return similar_versions_queryset(
+        source_version.embedding,
+        similarity_threshold=similarity_threshold,
+        project_id=project_id,
+        active_only=active_only,
+        exclude_id=source_version_id,
+    )[:limit]
 
 # --- 使用示例 ---
 # 在 Django shell 或视图/任务中:
 # from apps.analysis.utils import find_similar_testcases
-# potential_duplicates = find_similar_testcases(source_version_id=123, similarity_threshold=0.92, limit=5)
+# potential_duplicates = find_similar_testcases(source_version_id=123, similarity_threshold=0.92, limit=5, same_project=True)
+# with hnsw_search_params(ef_search=100):
+#     potential_duplicates = list(potential_duplicates)
 # for version in potential_duplicates:
 #     # 注意这里的 version.distance 是 pgvector 计算出的距离，不是相似度
 #     similarity = 1.0 - version.distance
@@ -1,9 +1,17 @@
 # back/apps/analysis/views.py
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, filters
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import viewsets, permissions, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import PotentialDuplicatePair
-from .serializers import PotentialDuplicatePairSerializer
+from .models import PotentialDuplicatePair, DuplicateCluster, DuplicateClusterMember
+from .serializers import (
+    PotentialDuplicatePairSerializer, DuplicateClusterSerializer, DuplicateClusterDetailSerializer,
+    DuplicateClusterReviewSerializer
+)
+from .clusters import update_clusters_for_versions
 
 class PotentialDuplicatePairViewSet(viewsets.ModelViewSet):
     """
@@ -40,4 +48,71 @@ class PotentialDuplicatePairViewSet(viewsets.ModelViewSet):
     # 如果允许更新 status，可以在 serializer 中去掉 status 的 read_only=True
     # 并在这里可能需要重写 perform_update 来记录操作者等。
 
+    def perform_update(self, serializer):
+        # 配对被标记为 ignored (或从 ignored 恢复) 会改变连通性，重算两端版本所在的簇
+        old_status = serializer.instance.status
+        pair = serializer.save()
+        if pair.status != old_status:
+            update_clusters_for_versions([pair.version_a_id, pair.version_b_id])
+
+    def perform_destroy(self, instance):
+        version_ids = [instance.version_a_id, instance.version_b_id]
+        instance.delete()
+        update_clusters_for_versions(version_ids)
+
+
+class DuplicateClusterViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    重复簇 API：列表一簇一行 (代表版本 + 成员数)，详情附带全部成员。
+    通过 POST review 对整簇做评审，而不是逐个处理簇内的配对。
+    """
+    queryset = DuplicateCluster.objects.select_related('representative').all()
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['status', 'project']
+    ordering_fields = ['size', 'max_similarity', 'updated_at', 'status']
+    ordering = ['-size', '-max_similarity']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch('memberships', queryset=DuplicateClusterMember.objects.select_related('version'))
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return DuplicateClusterDetailSerializer
+        if self.action == 'review':
+            return DuplicateClusterReviewSerializer
+        return DuplicateClusterSerializer
+
+    @action(detail=True, methods=['post'])
+    def review(self, request, pk=None):
+        """整簇评审：把簇内成员之间的配对批量设为给定状态。"""
+        cluster = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data['status']
+
+        member_ids = list(cluster.memberships.values_list('version_id', flat=True))
+        with transaction.atomic():
+            pairs = PotentialDuplicatePair.objects.filter(version_a_id__in=member_ids, version_b_id__in=member_ids)
+            if new_status == 'confirmed':
+                pairs = pairs.filter(status='pending')
+            pairs_updated = pairs.update(status=new_status)
+            if new_status == 'confirmed':
+                DuplicateCluster.objects.filter(pk=cluster.pk).update(status='confirmed')
+            else:
+                # 簇内的边全部被忽略，重算后簇会被删除
+                update_clusters_for_versions(member_ids)
+
+        cluster = DuplicateCluster.objects.filter(pk=cluster.pk).select_related('representative').first()
+        return Response({
+            'status': new_status,
+            'pairs_updated': pairs_updated,
+            'cluster': DuplicateClusterSerializer(cluster).data if cluster else None,
+        }, status=status.HTTP_200_OK)
+
 # Create your views here. 
\ No newline at end of file
@@ -6,3 +6,7 @@ class ExecutionsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.executions"
     verbose_name = _('执行管理')
+
+    # 在 ready 方法中导入信号 (维护 TestRun 结果计数器)
+    def ready(self):
+        import apps.executions.signals # noqa F401
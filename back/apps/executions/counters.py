@@ -0,0 +1,134 @@
+# back/apps/executions/counters.py
+"""
+TestRun 上的结果状态计数器 (passed_count / failed_count / blocked_count / skipped_count / untested_count)。
+
+列表、进度和 summary 直接读取这些冗余计数，不再加载或聚合 TestResult。计数器与结果写入在同一事务中维护：
+    - 单条保存/删除: TestResult.save() / delete() (在行锁下读取数据库中的旧 test_run 与 status 计算差值)
+    - 用例版本删除级联删除结果: signals.py 中 TestCaseVersion 的 pre_delete
+    - 批量写入 (bulk_create、INSERT ... SELECT、UPDATE): 调用方使用本模块的函数显式维护
+计数变化在事务提交后推送给订阅了该轮次进度的看板 (progress.py)。
+其余绕过上述路径的写入 (原生 SQL、queryset.delete() 等) 产生的偏差由定时对账任务
+reconcile_run_counters_task (或 reconcile_run_counters 命令) 修正。
+"""
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from .models import TestRun, TestResult
+from .progress import record_counter_deltas
+
+logger = logging.getLogger(__name__)
+
+# 结果状态 -> TestRun 上的计数字段
+COUNTER_FIELDS = {status: f'{status}_count' for status, _label in TestResult.STATUS_CHOICES}
+
+# {run_id: Counter({status: delta})}
+CounterDeltas = Dict[int, Counter]
+
+
+def new_deltas() -> CounterDeltas:
+    return defaultdict(Counter)
+
+
+def add_transition(deltas: CounterDeltas, old: Optional[Tuple[int, str]], new: Optional[Tuple[int, str]]) -> None:
+    """记录一条结果从 old=(run_id, status) 变为 new 的计数变化。None 表示不存在 (新建/删除)。"""
+    if old == new:
+        return
+    if old is not None and old[0] is not None:
+        deltas[old[0]][old[1]] -= 1
+    if new is not None and new[0] is not None:
+        deltas[new[0]][new[1]] += 1
+
+
+def apply_counter_deltas(deltas: CounterDeltas, using: Optional[str] = None) -> int:
+    """
+    以 F() 表达式原子地累加计数，返回更新的执行轮次数。
+    按 run_id 升序更新，多个事务同时修改同一组执行轮次时加锁顺序一致，不会死锁。
+    扣减在 0 处截断：计数已有偏差时不违反非负约束 (请求不会因此失败)，偏差由对账任务修正。
+    """
+    updated = 0
+    manager = TestRun.objects.db_manager(using) if using else TestRun.objects
+    for run_id in sorted(deltas):
+        changes = {
+            COUNTER_FIELDS[result_status]: (
+                F(COUNTER_FIELDS[result_status]) + delta if delta > 0
+                else Greatest(F(COUNTER_FIELDS[result_status]) + delta, 0)
+            )
+            for result_status, delta in deltas[run_id].items()
+            if delta and result_status in COUNTER_FIELDS
+        }
+        if changes:
+            updated += manager.filter(pk=run_id).update(**changes)
+    # 提交后推送给实时看板 (apps/executions/progress.py)
+    record_counter_deltas(deltas, using=using)
+    return updated
+
+
+def record_transition(old: Optional[Tuple[int, str]], new: Optional[Tuple[int, str]],
+                      using: Optional[str] = None) -> None:
+    deltas = new_deltas()
+    add_transition(deltas, old, new)
+    apply_counter_deltas(deltas, using=using)
+
+
+def count_results(run_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, int]]:
+    """按执行轮次聚合实际的结果状态计数: {run_id: {status: count}} (没有结果的轮次不出现)。"""
+    queryset = TestResult.objects.all()
+    if run_ids is not None:
+        queryset = queryset.filter(test_run_id__in=list(run_ids))
+    counts: Dict[int, Dict[str, int]] = defaultdict(dict)
+    for row in queryset.order_by().values('test_run_id', 'status').annotate(n=Count('id')):
+        counts[row['test_run_id']][row['status']] = row['n']
+    return counts
+
+
+def counter_values(counts: Dict[str, int]) -> Dict[str, int]:
+    return {field: counts.get(result_status, 0) for result_status, field in COUNTER_FIELDS.items()}
+
+
+def refresh_run_counters(run_ids: Iterable[int]) -> None:
+    """按实际结果重写指定执行轮次的计数 (用于批量写入后，调用方需在事务内且已锁定这些轮次)。"""
+    run_ids = sorted(set(run_ids))
+    counts = count_results(run_ids)
+    for run_id in run_ids:
+        TestRun.objects.filter(pk=run_id).update(**counter_values(counts.get(run_id, {})))
+
+
+def reconcile_run_counters(run_ids: Optional[Iterable[int]] = None, fix: bool = True,
+                           batch_size: int = 500) -> List[dict]:
+    """
+    对账：逐批比较存储的计数与实际聚合结果，返回不一致的执行轮次
+    [{'run_id', 'stored', 'actual'}]。fix 为 True 时在同一事务中锁定并修正。
+    """
+    queryset = TestRun.objects.order_by('id')
+    if run_ids is not None:
+        queryset = queryset.filter(pk__in=list(run_ids))
+    fields = list(COUNTER_FIELDS.values())
+
+    mismatches = []
+    after_id = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=after_id).values('id', *fields)[:batch_size])
+        if not batch:
+            break
+        after_id = batch[-1]['id']
+        actual_counts = count_results(row['id'] for row in batch)
+        drifted = []
+        for row in batch:
+            actual = counter_values(actual_counts.get(row['id'], {}))
+            stored = {field: row[field] for field in fields}
+            if stored != actual:
+                drifted.append(row['id'])
+                mismatches.append({'run_id': row['id'], 'stored': stored, 'actual': actual})
+        if fix and drifted:
+            with transaction.atomic():
+                # 锁定后重新聚合，避免覆盖对账期间并发写入的计数
+                list(TestRun.objects.select_for_update().filter(pk__in=drifted).order_by('id').values_list('id'))
+                refresh_run_counters(drifted)
+
+    if mismatches:
+        logger.warning(f"Run counter reconciliation found {len(mismatches)} drifted runs"
+                       f"{' (fixed)' if fix else ''}: {[m['run_id'] for m in mismatches[:20]]}")
+    return mismatches
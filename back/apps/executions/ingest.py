@@ -0,0 +1,337 @@
+# back/apps/executions/ingest.py
+"""
+自动化测试结果的批量上报 (POST /testruns/{id}/ingest/)。
+
+每个条目单独指定状态、耗时、备注和缺陷 ID，条目通过以下任一字段定位执行轮次中的结果：
+    id (TestResult ID) > testcase_version (用例版本 ID) > title (用例版本标题，须在轮次内唯一)
+条目未提供的字段保持不变。executor / executed_at 与 TestResultSerializer.update 的规则一致：
+    - 从 untested 变为其他状态时，executor 设为上报用户
+    - 变为最终状态 (passed/failed/skipped/blocked) 且原状态不是最终状态时，executed_at 设为当前时间 (条目可显式提供)
+
+写入按 INGEST_CHUNK_SIZE 分块，每块只有两条语句：SELECT ... FOR UPDATE 读取当前值，
+UPDATE ... FROM (VALUES ...) 一次写回；结果计数器在同一事务中按状态变化累加。
+
+所有条目设为同一状态的批量修改 (/testresults/bulk-update/) 见 bulk_transition_status：单条 UPDATE 语句完成。
+"""
+import logging
+import math
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_duration
+from .counters import apply_counter_deltas, new_deltas, add_transition
+from .models import TestResult, TestRun
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('passed', 'failed', 'skipped', 'blocked')
+VALID_STATUSES = {choice[0] for choice in TestResult.STATUS_CHOICES}
+# 可由条目更新的字段 (executor 由上报用户决定)
+UPDATE_COLUMNS = ('status', 'executor_id', 'executed_at', 'duration', 'comments', 'bug_id')
+BUG_ID_MAX_LENGTH = TestResult._meta.get_field('bug_id').max_length
+# 返回的未匹配/错误条目最多列出的数量
+MAX_REPORTED_ITEMS = 100
+
+
+class IngestError(ValueError):
+    """请求整体无效 (例如条目过多)，单个条目的问题记入响应的 errors。"""
+
+
+def get_max_items() -> int:
+    return getattr(settings, 'RESULT_INGEST_MAX_ITEMS', 50000)
+
+
+def get_chunk_size() -> int:
+    return getattr(settings, 'RESULT_INGEST_CHUNK_SIZE', 2000)
+
+
+def _parse_int(value) -> Optional[int]:
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    return int(value)
+
+
+def _parse_duration(value) -> Optional[timedelta]:
+    """秒数 (数字或数字字符串) 或 Django/ISO 8601 时长字符串。超出 timedelta 范围或非有限数时抛出 ValueError。"""
+    if value is None or value == '':
+        return None
+    try:
+        seconds = value if isinstance(value, (int, float)) else float(value)
+    except (TypeError, ValueError):
+        duration = parse_duration(str(value))
+        if duration is None:
+            raise ValueError(f"无效的 duration: {value}")
+        return duration
+    # JSON 中的 1e400 解析为 inf；过大的秒数使 timedelta 抛出 OverflowError
+    if not math.isfinite(seconds):
+        raise ValueError(f"无效的 duration: {value}")
+    try:
+        return timedelta(seconds=seconds)
+    except OverflowError:
+        raise ValueError(f"duration 超出范围: {value}")
+
+
+def normalize_item(item) -> dict:
+    """校验并转换单个条目，返回只包含提供了的字段的字典；无效时抛出 ValueError。"""
+    if not isinstance(item, dict):
+        raise ValueError("条目必须是对象。")
+    normalized = {}
+    result_id = _parse_int(item.get('id'))
+    version_id = _parse_int(item.get('testcase_version'))
+    title = (item.get('title') or '').strip()
+    if result_id is None and version_id is None and not title:
+        raise ValueError("必须提供 id、testcase_version 或 title 之一。")
+    normalized['key'] = ('id', result_id) if result_id is not None else \
+        ('version', version_id) if version_id is not None else ('title', title)
+
+    result_status = item.get('status')
+    if result_status not in VALID_STATUSES:
+        raise ValueError(f"无效的状态 '{result_status}'。有效选项为: {', '.join(sorted(VALID_STATUSES))}")
+    normalized['status'] = result_status
+
+    if 'duration' in item:
+        normalized['duration'] = _parse_duration(item['duration'])
+    if 'comments' in item:
+        normalized['comments'] = item['comments'] if item['comments'] is None else str(item['comments'])
+    if 'bug_id' in item:
+        bug_id = item['bug_id']
+        if bug_id is not None and len(str(bug_id)) > BUG_ID_MAX_LENGTH:
+            raise ValueError(f"bug_id 长度不能超过 {BUG_ID_MAX_LENGTH}。")
+        normalized['bug_id'] = bug_id if bug_id is None else str(bug_id)
+    if item.get('executed_at'):
+        executed_at = parse_datetime(str(item['executed_at']))
+        if executed_at is None:
+            raise ValueError(f"无效的 executed_at: {item['executed_at']}")
+        if timezone.is_naive(executed_at):
+            executed_at = timezone.make_aware(executed_at)
+        normalized['executed_at'] = executed_at
+    return normalized
+
+
+def _resolve_keys(test_run: TestRun, entries: List[dict], create_missing: bool, stats: dict) -> Dict[int, dict]:
+    """把条目定位到结果 ID，返回 {result_id: 条目} (同一结果出现多次时以最后一次为准)。"""
+    by_id = [entry for entry in entries if entry['key'][0] == 'id']
+    by_version = [entry for entry in entries if entry['key'][0] == 'version']
+    by_title = [entry for entry in entries if entry['key'][0] == 'title']
+    results = TestResult.objects.filter(test_run=test_run)
+    resolved: Dict[int, dict] = {}
+
+    if by_id:
+        existing = set(results.filter(id__in=[e['key'][1] for e in by_id]).values_list('id', flat=True))
+        for entry in by_id:
+            if entry['key'][1] in existing:
+                resolved[entry['key'][1]] = entry
+            else:
+                stats['unmatched'].append(entry['key'])
+
+    if by_version:
+        version_ids = {e['key'][1] for e in by_version}
+        version_map = dict(results.filter(testcase_version_id__in=version_ids)
+                           .values_list('testcase_version_id', 'id'))
+        missing = version_ids - set(version_map)
+        if missing and create_missing:
+            version_map.update(_create_missing_results(test_run, missing, stats))
+        for entry in by_version:
+            result_id = version_map.get(entry['key'][1])
+            if result_id is None:
+                stats['unmatched'].append(entry['key'])
+            else:
+                resolved[result_id] = entry
+
+    if by_title:
+        title_map: Dict[str, List[int]] = {}
+        rows = results.filter(testcase_version__title__in={e['key'][1] for e in by_title}) \
+            .values_list('testcase_version__title', 'id')
+        for title, result_id in rows:
+            title_map.setdefault(title, []).append(result_id)
+        for entry in by_title:
+            matches = title_map.get(entry['key'][1], [])
+            if len(matches) == 1:
+                resolved[matches[0]] = entry
+            else:
+                stats['unmatched'].append(entry['key'] + (('ambiguous',) if matches else ()))
+    return resolved
+
+
+def _create_missing_results(test_run: TestRun, version_ids, stats: dict) -> Dict[int, int]:
+    """
+    为轮次中还没有的用例版本 (须属于同一项目) 补建 untested 结果，返回 {version_id: result_id}。
+    INSERT ... ON CONFLICT DO NOTHING RETURNING 只返回实际插入的行：并发上报已补建的结果不重复计数。
+    """
+    from apps.testcases.models import TestCaseVersion
+
+    valid_ids = list(TestCaseVersion.objects.filter(id__in=version_ids, project_id=test_run.project_id)
+                     .values_list('id', flat=True))
+    if not valid_ids:
+        return {}
+    quote = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {quote(TestResult._meta.db_table)} (test_run_id, testcase_version_id, status) "
+        f"SELECT %s, v.id, %s FROM unnest(%s::bigint[]) AS v (id) "
+        f"ON CONFLICT DO NOTHING RETURNING testcase_version_id, id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [test_run.id, 'untested', valid_ids])
+        version_map = dict(cursor.fetchall())
+    created = len(version_map)
+    if created < len(valid_ids):
+        # 其余版本的结果已由并发的上报补建
+        version_map.update(TestResult.objects.filter(test_run=test_run, testcase_version_id__in=valid_ids)
+                           .exclude(testcase_version_id__in=list(version_map))
+                           .values_list('testcase_version_id', 'id'))
+    if created:
+        deltas = new_deltas()
+        deltas[test_run.id]['untested'] += created
+        apply_counter_deltas(deltas)
+    stats['created'] += created
+    return version_map
+
+
+def _apply_chunk(test_run: TestRun, chunk: Dict[int, dict], executor_id: Optional[int], now) -> dict:
+    """读取并锁定当前值，按条目计算新值，一条 UPDATE ... FROM (VALUES ...) 写回。返回计数变化。"""
+    current = {
+        row[0]: row[1:]
+        for row in TestResult.objects.select_for_update().filter(id__in=list(chunk)).order_by('id')
+        .values_list('id', *UPDATE_COLUMNS)
+    }
+    deltas = new_deltas()
+    rows = []
+    for result_id, (old_status, old_executor, old_executed_at, old_duration, old_comments, old_bug_id) \
+            in current.items():
+        entry = chunk[result_id]
+        new_status = entry['status']
+        executor = old_executor
+        if old_status == 'untested' and new_status != 'untested' and executor_id is not None:
+            executor = executor_id
+        executed_at = entry.get('executed_at', old_executed_at)
+        if 'executed_at' not in entry and new_status in FINAL_STATUSES and old_status not in FINAL_STATUSES:
+            executed_at = now
+        rows.append((
+            result_id, new_status, executor, executed_at,
+            entry.get('duration', old_duration), entry.get('comments', old_comments), entry.get('bug_id', old_bug_id),
+        ))
+        add_transition(deltas, (test_run.id, old_status), (test_run.id, new_status))
+
+    if rows:
+        fields = [TestResult._meta.get_field('id')] + [TestResult._meta.get_field(
+            'executor' if column == 'executor_id' else column) for column in UPDATE_COLUMNS]
+        casts = [f"%s::{field.db_type(connection)}" for field in fields]
+        quote = connection.ops.quote_name
+        columns = ['id'] + [field.column for field in fields[1:]]
+        values_sql = ', '.join([f"({', '.join(casts)})"] * len(rows))
+        set_sql = ', '.join(f"{quote(column)} = v.{quote(column)}" for column in columns[1:])
+        sql = (
+            f"UPDATE {quote(TestResult._meta.db_table)} AS t SET {set_sql} "
+            f"FROM (VALUES {values_sql}) AS v ({', '.join(quote(column) for column in columns)}) "
+            f"WHERE t.id = v.id"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for row in rows for value in row])
+    return deltas
+
+
+def ingest_results(test_run: TestRun, items: list, executor=None, create_missing: bool = False) -> dict:
+    """
+    批量应用上报的结果，整个请求在一个事务中完成。
+
+    Returns:
+        {'received', 'updated', 'created', 'unmatched', 'errors', 'took_ms', 'rows_per_sec'}
+    """
+    if not isinstance(items, list):
+        raise IngestError("请求体必须是结果条目列表 (或 {\"results\": [...]})。")
+    if len(items) > get_max_items():
+        raise IngestError(f"单次最多上报 {get_max_items()} 条结果，收到 {len(items)} 条。")
+
+    start_time = time.perf_counter()
+    stats = {'received': len(items), 'updated': 0, 'created': 0, 'unmatched': [], 'errors': []}
+    entries = []
+    for index, item in enumerate(items):
+        try:
+            entries.append(normalize_item(item))
+        except (TypeError, ValueError) as e:
+            stats['errors'].append({'index': index, 'error': str(e)})
+
+    executor_id = executor.pk if executor is not None and executor.is_authenticated else None
+    now = timezone.now()
+    chunk_size = get_chunk_size()
+    with transaction.atomic():
+        resolved = _resolve_keys(test_run, entries, create_missing, stats)
+        result_ids = sorted(resolved)
+        deltas = new_deltas()
+        for offset in range(0, len(result_ids), chunk_size):
+            chunk = {result_id: resolved[result_id] for result_id in result_ids[offset:offset + chunk_size]}
+            for run_id, changes in _apply_chunk(test_run, chunk, executor_id, now).items():
+                deltas[run_id].update(changes)
+        apply_counter_deltas(deltas)
+        stats['updated'] = len(result_ids)
+
+    took = time.perf_counter() - start_time
+    stats['took_ms'] = round(took * 1000, 1)
+    stats['rows_per_sec'] = round(stats['updated'] / took, 1) if took > 0 else None
+    stats['unmatched_count'] = len(stats['unmatched'])
+    stats['unmatched'] = [list(key) for key in stats['unmatched'][:MAX_REPORTED_ITEMS]]
+    stats['error_count'] = len(stats['errors'])
+    stats['errors'] = stats['errors'][:MAX_REPORTED_ITEMS]
+    logger.info(f"Ingested {stats['updated']} results into TestRun {test_run.id} "
+                f"({stats['created']} created, {stats['unmatched_count']} unmatched, {stats['error_count']} invalid) "
+                f"in {stats['took_ms']} ms.")
+    return stats
+
+
+def bulk_transition_status(result_ids: List[int], new_status: str, executor=None,
+                           comments: Optional[str] = None, bug_id: Optional[str] = None) -> dict:
+    """
+    把一组结果设为同一状态，单条语句完成：CTE 按 ID 顺序锁定并读取原状态，UPDATE 中用 CASE / COALESCE
+    只为需要的行设置 executor (由 untested 变为其他状态且尚无执行人) 和 executed_at (由非最终状态变为最终状态)，
+    RETURNING 返回受影响的行及其原状态，用于在同一事务中维护计数器。comments / bug_id 为 None 时保持不变。
+
+    Returns:
+        {'updated_ids': [...], 'stamped_ids': [...] (设置了 executor 或 executed_at 的行)}
+    """
+    if new_status not in VALID_STATUSES:
+        raise ValueError(f"无效的状态 '{new_status}'")
+    executor_id = executor.pk if executor is not None and executor.is_authenticated else None
+    quote = connection.ops.quote_name
+    table = quote(TestResult._meta.db_table)
+    final_placeholders = ', '.join(['%s'] * len(FINAL_STATUSES))
+    # 目标状态是常量，"变为最终状态" / "离开 untested" 只取决于原状态
+    leaves_untested = new_status != 'untested'
+    becomes_final = new_status in FINAL_STATUSES
+    sql = (
+        f"WITH old AS ("
+        f"  SELECT id, status FROM {table} WHERE id = ANY(%s) ORDER BY id FOR UPDATE"
+        f") "
+        f"UPDATE {table} AS t SET "
+        f"  status = %s, "
+        f"  comments = COALESCE(%s, t.comments), "
+        f"  bug_id = COALESCE(%s, t.bug_id), "
+        f"  executor_id = CASE WHEN %s AND old.status = 'untested' THEN COALESCE(t.executor_id, %s) "
+        f"                ELSE t.executor_id END, "
+        f"  executed_at = CASE WHEN %s AND old.status NOT IN ({final_placeholders}) THEN %s "
+        f"                ELSE t.executed_at END "
+        f"FROM old WHERE t.id = old.id "
+        f"RETURNING t.id, t.test_run_id, old.status, "
+        f"  ((%s AND old.status = 'untested') OR (%s AND old.status NOT IN ({final_placeholders})))"
+    )
+    params = [
+        list(result_ids),
+        new_status, comments, bug_id,
+        leaves_untested and executor_id is not None, executor_id,
+        becomes_final, *FINAL_STATUSES, timezone.now(),
+        leaves_untested and executor_id is not None, becomes_final, *FINAL_STATUSES,
+    ]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        deltas = new_deltas()
+        for _result_id, run_id, old_status, _stamped in rows:
+            add_transition(deltas, (run_id, old_status), (run_id, new_status))
+        apply_counter_deltas(deltas)
+    return {
+        'updated_ids': sorted(row[0] for row in rows),
+        'stamped_ids': sorted(row[0] for row in rows if row[3]),
+    }
@@ -0,0 +1,100 @@
+# back/apps/executions/management/commands/benchmark_result_ingestion.py
+
+import random
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.test import RequestFactory
+from apps.executions.ingest import ingest_results
+from apps.executions.models import TestResult, TestRun
+from apps.executions.serializers import TestResultSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('测量结果批量上报 (ingest_results) 与逐条 TestResultSerializer.update 的吞吐量 (rows/sec)。'
+            '默认在事务中执行并回滚，不会修改数据。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, help='使用的执行轮次 (默认结果数最多的轮次)。')
+        parser.add_argument('--rows', type=int, default=5000, help='批量上报的条目数 (不超过轮次的结果数)。')
+        parser.add_argument('--per-row-sample', type=int, default=200,
+                            help='逐条更新路径的样本数 (0 表示跳过对比)。')
+        parser.add_argument('--keep', action='store_true', help='提交批量上报的修改 (默认回滚)。')
+
+    def handle(self, *args, **options):
+        test_run = self.get_run(options['run'])
+        user = get_user_model().objects.filter(is_superuser=True).order_by('pk').first()
+        result_ids = list(TestResult.objects.filter(test_run=test_run).order_by('id')
+                          .values_list('id', flat=True)[:options['rows']])
+        if not result_ids:
+            raise CommandError(f"执行轮次 {test_run.pk} 没有结果。")
+
+        rng = random.Random(1014)
+        statuses = ['passed', 'passed', 'passed', 'failed', 'skipped', 'blocked']
+        items = [
+            {'id': result_id, 'status': rng.choice(statuses), 'duration': round(rng.uniform(0.01, 30), 3),
+             'comments': f'benchmark #{index}', 'bug_id': f'BUG-{index}' if index % 17 == 0 else None}
+            for index, result_id in enumerate(result_ids)
+        ]
+        self.stdout.write(self.style.NOTICE(
+            f"执行轮次 {test_run.pk}: 批量上报 {len(items)} 条{' (提交)' if options['keep'] else ' (回滚)'}"
+        ))
+
+        stats = None
+        start_time = time.perf_counter()
+        try:
+            with transaction.atomic():
+                stats = ingest_results(test_run, items, executor=user)
+                elapsed = time.perf_counter() - start_time
+                if not options['keep']:
+                    raise _Rollback()
+        except _Rollback:
+            pass
+        self.stdout.write(
+            f"  批量上报: {stats['updated']} 行, {elapsed:.3f} 秒, {stats['updated'] / elapsed:.0f} rows/sec"
+        )
+
+        sample = options['per_row_sample']
+        if sample > 0:
+            self.benchmark_per_row(items[:sample], user)
+
+    def benchmark_per_row(self, items, user):
+        request = RequestFactory().patch('/')
+        request.user = user
+        start_time = time.perf_counter()
+        try:
+            with transaction.atomic():
+                for item in items:
+                    instance = TestResult.objects.select_related('test_run', 'testcase_version', 'executor') \
+                        .get(pk=item['id'])
+                    serializer = TestResultSerializer(instance, data={'status': item['status'], 'comments': item['comments']},
+                                                      partial=True, context={'request': request})
+                    serializer.is_valid(raise_exception=True)
+                    serializer.save()
+                    serializer.data  # 与接口一致：响应中返回完整的嵌套序列化结果
+                elapsed = time.perf_counter() - start_time
+                raise _Rollback()
+        except _Rollback:
+            pass
+        self.stdout.write(
+            f"  逐条更新: {len(items)} 行, {elapsed:.3f} 秒, {len(items) / elapsed:.0f} rows/sec"
+        )
+
+    def get_run(self, run_id):
+        if run_id:
+            try:
+                return TestRun.objects.get(pk=run_id)
+            except TestRun.DoesNotExist:
+                raise CommandError(f"执行轮次 {run_id} 不存在。")
+        test_run = TestRun.objects.order_by(
+            -(F('passed_count') + F('failed_count') + F('blocked_count') + F('skipped_count') + F('untested_count'))
+        ).first()
+        if test_run is None:
+            raise CommandError("没有执行轮次可供测试。")
+        return test_run
@@ -0,0 +1,39 @@
+# back/apps/executions/management/commands/reconcile_run_counters.py
+
+import time
+from django.core.management.base import BaseCommand
+from apps.executions.counters import COUNTER_FIELDS, reconcile_run_counters
+
+
+class Command(BaseCommand):
+    help = ('核对 TestRun 上的结果状态计数器与实际的 TestResult 是否一致，并修正偏差。'
+            '定时任务 reconcile_run_counters_task 会自动执行，此命令用于手动核对或上线后首次校验。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, action='append', dest='runs', help='只核对指定的执行轮次 (可重复)。')
+        parser.add_argument('--dry-run', action='store_true', help='只报告偏差，不修正。')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批核对的执行轮次数。')
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        scope = f"执行轮次 {options['runs']}" if options['runs'] else "全部执行轮次"
+        self.stdout.write(self.style.NOTICE(f"核对{scope}的结果计数器{'' if fix else ' (只报告)'}"))
+
+        start_time = time.time()
+        mismatches = reconcile_run_counters(options['runs'], fix=fix, batch_size=options['batch_size'])
+        for mismatch in mismatches:
+            diffs = ', '.join(
+                f"{field} {mismatch['stored'][field]} -> {mismatch['actual'][field]}"
+                for field in COUNTER_FIELDS.values() if mismatch['stored'][field] != mismatch['actual'][field]
+            )
+            self.stdout.write(f"  执行轮次 {mismatch['run_id']}: {diffs}")
+
+        duration = time.time() - start_time
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f"计数器全部一致，耗时: {duration:.2f} 秒"))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"已修正 {len(mismatches)} 个执行轮次，耗时: {duration:.2f} 秒"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{len(mismatches)} 个执行轮次的计数器存在偏差，去掉 --dry-run 以修正。耗时: {duration:.2f} 秒"
+            ))
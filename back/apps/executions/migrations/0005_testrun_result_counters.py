@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:46
+
+from django.db import migrations, models
+
+
+def backfill_result_counters(apps, schema_editor):
+    """用一条 UPDATE ... FROM 按已有结果回填各执行轮次的状态计数。"""
+    TestRun = apps.get_model("executions", "TestRun")
+    TestResult = apps.get_model("executions", "TestResult")
+    schema_editor.execute(
+        f"UPDATE {TestRun._meta.db_table} AS r SET "
+        f"passed_count = c.passed, failed_count = c.failed, blocked_count = c.blocked, "
+        f"skipped_count = c.skipped, untested_count = c.untested "
+        f"FROM (SELECT test_run_id, "
+        f"COUNT(*) FILTER (WHERE status = 'passed') AS passed, "
+        f"COUNT(*) FILTER (WHERE status = 'failed') AS failed, "
+        f"COUNT(*) FILTER (WHERE status = 'blocked') AS blocked, "
+        f"COUNT(*) FILTER (WHERE status = 'skipped') AS skipped, "
+        f"COUNT(*) FILTER (WHERE status = 'untested') AS untested "
+        f"FROM {TestResult._meta.db_table} GROUP BY test_run_id) AS c "
+        f"WHERE r.id = c.test_run_id"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("executions", "0004_alter_testresult_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testrun",
+            name="blocked_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="阻塞数"),
+        ),
+        migrations.AddField(
+            model_name="testrun",
+            name="failed_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="失败数"),
+        ),
+        migrations.AddField(
+            model_name="testrun",
+            name="passed_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="通过数"),
+        ),
+        migrations.AddField(
+            model_name="testrun",
+            name="skipped_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="跳过数"),
+        ),
+        migrations.AddField(
+            model_name="testrun",
+            name="untested_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="未测试数"),
+        ),
+        migrations.RunPython(backfill_result_counters, migrations.RunPython.noop),
+    ]
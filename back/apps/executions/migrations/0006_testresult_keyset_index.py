@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("executions", "0005_testrun_result_counters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["test_run", "-executed_at", "-id"],
+                name="testresult_run_exec_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("executions", "0006_testresult_keyset_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testrun",
+            name="fill_status",
+            field=models.CharField(
+                choices=[
+                    ("filling", "生成中"),
+                    ("done", "已生成"),
+                    ("failed", "生成失败"),
+                ],
+                default="done",
+                max_length=10,
+                verbose_name="结果生成状态",
+            ),
+        ),
+        migrations.AddField(
+            model_name="testrun",
+            name="fill_total",
+            field=models.PositiveIntegerField(default=0, verbose_name="待生成结果数"),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 # 导入相关应用的模型
@@ -143,6 +143,20 @@ class TestRun(models.Model):
     end_time = models.DateTimeField(null=True, blank=True, verbose_name="实际结束时间")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    # 结果状态计数 (冗余存储，随结果写入在同一事务中维护，见 apps/executions/counters.py)
+    passed_count = models.PositiveIntegerField(default=0, verbose_name="通过数")
+    failed_count = models.PositiveIntegerField(default=0, verbose_name="失败数")
+    blocked_count = models.PositiveIntegerField(default=0, verbose_name="阻塞数")
+    skipped_count = models.PositiveIntegerField(default=0, verbose_name="跳过数")
+    untested_count = models.PositiveIntegerField(default=0, verbose_name="未测试数")
+    # 按计划生成结果的状态与预期数量 (异步生成时用于展示进度，见 apps/executions/run_fill.py)
+    FILL_STATUS_CHOICES = [
+        ('filling', '生成中'),
+        ('done', '已生成'),
+        ('failed', '生成失败'),
+    ]
+    fill_status = models.CharField(max_length=10, choices=FILL_STATUS_CHOICES, default='done', verbose_name="结果生成状态")
+    fill_total = models.PositiveIntegerField(default=0, verbose_name="待生成结果数")
 
     class Meta:
         verbose_name = "测试执行轮次"
@@ -154,11 +168,40 @@ class TestRun(models.Model):
         plan_name = self.test_plan.name if hasattr(self.test_plan, 'name') else 'N/A'
         return f"[{project_code}] {self.name} ({plan_name})"
 
-    # 可以添加计算属性获取进度等
-    # @property
-    # def progress(self): ...
-    # @property
-    # def pass_rate(self): ...
+    @property
+    def total_count(self):
+        return self.passed_count + self.failed_count + self.blocked_count + self.skipped_count + self.untested_count
+
+    @property
+    def executed_count(self):
+        return self.total_count - self.untested_count
+
+    @property
+    def progress(self):
+        """执行进度百分比 (非 untested 的结果占比)"""
+        total = self.total_count
+        return round(self.executed_count / total * 100) if total else 0
+
+    @property
+    def fill_progress(self):
+        """结果生成进度百分比 (异步生成时为已生成的结果数占 fill_total 的比例)"""
+        if self.fill_status == 'done':
+            return 100
+        if not self.fill_total:
+            return 0
+        return min(100, self.total_count * 100 // self.fill_total)
+
+    def status_counts(self):
+        """与 summary 接口一致的计数字典"""
+        return {
+            'total': self.total_count,
+            'passed': self.passed_count,
+            'failed': self.failed_count,
+            'blocked': self.blocked_count,
+            'skipped': self.skipped_count,
+            'untested': self.untested_count,
+            'executed': self.executed_count,
+        }
 
 class TestResult(models.Model):
     """单个测试用例的执行结果 (作为 TestRun 和 TestCase 的 M2M 'through' 模型)"""
@@ -215,6 +258,41 @@ class TestResult(models.Model):
         # 一个用例在一个执行轮次中应该只有一个最终结果记录
         unique_together = ('test_run', 'testcase_version') # Restore the constraint
         ordering = ['-executed_at'] # 按执行时间倒序
+        indexes = [
+            # 结果键集分页与导出的排序 (见 apps/executions/pagination.py)
+            models.Index(fields=['test_run', '-executed_at', '-id'], name='testresult_run_exec_id_idx'),
+        ]
+
+    def _lock_counted_state(self, using):
+        """在事务内锁定该行并读取数据库中当前的 (test_run, status)；行不存在时返回 None。"""
+        if self.pk is None:
+            return None
+        return type(self)._default_manager.db_manager(using).select_for_update().filter(
+            pk=self.pk).values_list('test_run_id', 'status').first()
+
+    def save(self, *args, **kwargs):
+        # 旧的 (test_run, status) 在行锁下读取，而不是使用加载时的值：并发修改同一结果的请求
+        # 依次取得锁，各自按数据库中的实际旧值计算计数变化，不会重复累计
+        from .counters import record_transition
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'status', 'test_run', 'test_run_id'} & set(update_fields):
+            return super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            old = None if self._state.adding else self._lock_counted_state(using)
+            super().save(*args, **kwargs)
+            record_transition(old, (self.test_run_id, self.status), using=using)
+
+    def delete(self, *args, **kwargs):
+        from .counters import record_transition
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            old = self._lock_counted_state(using)
+            result = super().delete(*args, **kwargs)
+            # 只在确实删除了该行时扣减 (已被其他请求删除时 old 为 None)
+            if old is not None and result[1].get(self._meta.label, 0):
+                record_transition(old, None, using=using)
+        return result
 
     def __str__(self):
         case_title = self.testcase_version.title if hasattr(self.testcase_version, 'title') else f'ID:{self.testcase_version_id}'
@@ -0,0 +1,126 @@
+# back/apps/executions/pagination.py
+"""
+执行结果的键集 (keyset) 分页。
+
+大执行轮次用页码分页时，每页都要 OFFSET 扫描前面的所有行并额外执行 COUNT(*)。
+这里按 (test_run, executed_at DESC NULLS FIRST, id DESC) 排序，游标记录上一页最后一行的这三个值，
+下一页用 WHERE 条件从该位置继续，配合索引 testresult_run_exec_id_idx 每页的代价与页码无关，也不计算总数。
+
+请求带 cursor 参数 (第一页传空值 ?cursor=) 时启用键集分页，响应为 {"next": ..., "results": [...]}，
+只支持向后翻页；不带 cursor 时仍使用页码分页，与原有客户端兼容。总数可读取 TestRun 上的结果计数器。
+"""
+import base64
+import json
+from collections import OrderedDict
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# 与索引 testresult_run_exec_id_idx 的列顺序一致
+KEYSET_ORDERING = ('test_run_id', F('executed_at').desc(nulls_first=True), F('id').desc())
+
+
+def keyset_ordered(queryset):
+    return queryset.order_by(*KEYSET_ORDERING)
+
+
+def encode_cursor(result) -> str:
+    executed_at = result.executed_at.isoformat() if result.executed_at else None
+    raw = json.dumps([result.test_run_id, executed_at, result.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """返回 (test_run_id, executed_at, id)，格式不正确时抛出 ValueError。"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    run_id, executed_at, result_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    if executed_at is not None:
+        executed_at = parse_datetime(executed_at)
+        if executed_at is None:
+            raise ValueError('invalid executed_at')
+    return int(run_id), executed_at, int(result_id)
+
+
+def after_position(run_id, executed_at, result_id) -> Q:
+    """KEYSET_ORDERING 中排在 (run_id, executed_at, result_id) 之后的行。executed_at 为空的行排在非空行之前。"""
+    if executed_at is None:
+        same_run = (Q(executed_at__isnull=True) & Q(id__lt=result_id)) | Q(executed_at__isnull=False)
+    else:
+        same_run = Q(executed_at__lt=executed_at) | (Q(executed_at=executed_at) & Q(id__lt=result_id))
+    return Q(test_run_id__gt=run_id) | (Q(test_run_id=run_id) & same_run)
+
+
+class ResultKeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = '无效的游标。'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset = keyset_ordered(queryset)
+        if cursor:
+            try:
+                queryset = queryset.filter(after_position(*decode_cursor(cursor)))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # 多取一行判断是否还有下一页，不需要 COUNT(*)
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_cursor = encode_cursor(results[-1]) if self.has_next else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.get_next_link()), ('results', data)]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ResultPagination(BasePagination):
+    """带 cursor 参数时使用 ResultKeysetPagination，否则使用页码分页 (settings 中的默认分页)。"""
+
+    def __init__(self):
+        self.paginator = None
+
+    def use_keyset(self, request) -> bool:
+        return ResultKeysetPagination.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = ResultKeysetPagination() if self.use_keyset(request) else PageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return PageNumberPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return PageNumberPagination().get_schema_operation_parameters(view)
@@ -0,0 +1,84 @@
+# back/apps/executions/parsers.py
+"""
+结果批量上报 (TestRunViewSet.ingest) 使用的请求解析器。
+
+两者都把请求体解析为结果条目列表 [{...}]，字段含义见 apps/executions/ingest.py：
+    - NDJSONParser: application/x-ndjson，每行一个 JSON 对象，空行忽略
+    - JUnitXMLParser: application/xml / text/xml，JUnit XML 报告 (<testsuites>/<testsuite>/<testcase>)
+"""
+import json
+import xml.etree.ElementTree as ET
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+# JUnit <testcase> 中用于指定用例版本 ID 的 <property name="...">
+JUNIT_VERSION_PROPERTIES = ('testcase_version', 'tcms_version', 'tcms_testcase_version')
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        items = []
+        for line_number, line in enumerate(stream.read().decode(encoding).splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ParseError(f"第 {line_number} 行不是有效的 JSON: {e}")
+            if not isinstance(item, dict):
+                raise ParseError(f"第 {line_number} 行必须是 JSON 对象。")
+            items.append(item)
+        return items
+
+
+class JUnitXMLParser(BaseParser):
+    """
+    每个 <testcase> 转换为一个条目：
+        - 有 <failure>/<error> -> failed (message 与正文写入 comments)，有 <skipped> -> skipped，否则 passed
+        - time 属性 (秒) -> duration
+        - <properties> 中的 testcase_version 属性 -> 按用例版本匹配，否则按 name 匹配用例版本标题
+    使用标准库 expat 解析，不会加载外部实体。
+    """
+    media_type = 'application/xml'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            root = ET.fromstring(stream.read())
+        except ET.ParseError as e:
+            raise ParseError(f"JUnit XML 解析失败: {e}")
+        return [self.testcase_item(testcase) for testcase in root.iter('testcase')]
+
+    @staticmethod
+    def testcase_item(testcase) -> dict:
+        item = {'title': (testcase.get('name') or '').strip()}
+        for prop in testcase.iter('property'):
+            if prop.get('name') in JUNIT_VERSION_PROPERTIES and prop.get('value'):
+                item['testcase_version'] = prop.get('value')
+                break
+
+        problem = testcase.find('failure')
+        if problem is None:
+            problem = testcase.find('error')
+        if problem is not None:
+            item['status'] = 'failed'
+            comments = '\n'.join(part for part in (problem.get('message'), (problem.text or '').strip()) if part)
+            if comments:
+                item['comments'] = comments
+        elif testcase.find('skipped') is not None:
+            item['status'] = 'skipped'
+            if testcase.find('skipped').get('message'):
+                item['comments'] = testcase.find('skipped').get('message')
+        else:
+            item['status'] = 'passed'
+
+        if testcase.get('time'):
+            item['duration'] = testcase.get('time')
+        return item
+
+
+class JUnitTextXMLParser(JUnitXMLParser):
+    media_type = 'text/xml'
@@ -0,0 +1,240 @@
+# back/apps/executions/progress.py
+"""
+执行轮次进度的实时推送 (Server-Sent Events)。
+
+写入端：结果计数器的所有变化都经过 counters.apply_counter_deltas，这里把同一事务内的变化按轮次合并，
+事务提交后读取一次最新计数，向 Redis 频道 tcms:executions:run-progress:<run_id> 发布一条事件
+{"run": id, "delta": {状态: 变化量}, "counts": {...与 summary 相同的计数...}}。事务回滚则不发布。
+
+读取端：GET /api/v1/executions/testruns/<id>/events/ (text/event-stream)。连接建立时先订阅频道，
+再发送一次 snapshot 事件 (当前计数)，之后转发 delta 事件；空闲时发送注释行保活。
+浏览器的 EventSource 不能设置请求头：先用已认证的 POST /testruns/<id>/events-ticket/ 换取只对该轮次有效、
+RUN_PROGRESS_TICKET_TTL_SECONDS 秒内过期的票据，再以 ?ticket= 连接 (不在 URL 中传递长期有效的 JWT)。
+也可以直接使用会话 Cookie 或 Authorization 请求头认证。
+看板不再轮询 summary：无论打开多少个看板，数据库只在写入时多一次按主键的读取。
+
+流式响应需要 ASGI 部署 (uvicorn/daphne 加载 tcms.asgi:application)，WSGI 下接口返回 501。
+单个连接最长保持 RUN_PROGRESS_STREAM_MAX_SECONDS 秒，结束前发送 reconnect 事件；使用票据的客户端收到后
+关闭 EventSource，换取新票据再连接 (票据过期后自动重连会返回 401)。
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from tcms.transactions import get_commit_buffer
+from .models import TestRun
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'tcms:executions:run-progress:'
+# 事务内的计数变化缓冲区登记在数据库连接对象上 (与 apps.analysis.batching 的派发缓冲区共用 tcms.transactions)
+COMMIT_BUFFER_ATTR = '_tcms_run_progress_buffer'
+# 连接票据的签名盐，与其他用途的签名互不通用
+TICKET_SALT = 'tcms.executions.run-progress'
+
+_redis_client = None
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'RUN_PROGRESS_PUSH_ENABLED', True)
+
+
+def get_ticket_ttl() -> int:
+    return getattr(settings, 'RUN_PROGRESS_TICKET_TTL_SECONDS', 60)
+
+
+def get_redis_url() -> str:
+    return getattr(settings, 'RUN_PROGRESS_REDIS_URL', None) or settings.CELERY_BROKER_URL
+
+
+def get_redis():
+    """获取 (并缓存) 发布事件用的 Redis 连接，默认复用 Celery broker。"""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(get_redis_url())
+    return _redis_client
+
+
+def channel_name(run_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{run_id}"
+
+
+def publish_progress(deltas: Dict[int, Dict[str, int]]) -> None:
+    """读取这些轮次的最新计数并发布事件 (一个轮次一条)。"""
+    runs = TestRun.objects.filter(pk__in=list(deltas)).only(
+        'id', 'passed_count', 'failed_count', 'blocked_count', 'skipped_count', 'untested_count',
+        'fill_status', 'fill_total',
+    )
+    pipe = get_redis().pipeline(transaction=False)
+    for run in runs:
+        counts = run.status_counts()
+        counts['progress'] = run.progress
+        counts['fill_status'] = run.fill_status
+        counts['fill_progress'] = run.fill_progress
+        event = {'run': run.id, 'delta': {k: v for k, v in deltas[run.id].items() if v}, 'counts': counts,
+                 'ts': time.time()}
+        pipe.publish(channel_name(run.id), json.dumps(event, ensure_ascii=False))
+    pipe.execute()
+
+
+class _CommitBuffer:
+    """一个事务内各轮次的计数变化，提交时合并发布。"""
+
+    def __init__(self):
+        self.deltas: Dict[int, Dict[str, int]] = {}
+
+    def add(self, deltas) -> None:
+        for run_id, changes in deltas.items():
+            merged = self.deltas.setdefault(run_id, {})
+            for result_status, delta in changes.items():
+                merged[result_status] = merged.get(result_status, 0) + delta
+
+    def flush(self) -> None:
+        deltas, self.deltas = self.deltas, {}
+        deltas = {run_id: changes for run_id, changes in deltas.items() if any(changes.values())}
+        if not deltas:
+            return
+        try:
+            publish_progress(deltas)
+        except Exception as e:
+            # 例如 Redis 不可达；事务已提交，推送失败只影响实时看板 (重连后的 snapshot 会纠正)
+            logger.error(f"Failed to publish progress for TestRuns {sorted(deltas)}: {e}")
+
+
+def record_counter_deltas(deltas, using: Optional[str] = None) -> None:
+    """在当前事务提交后发布计数变化。不在事务中 (autocommit) 时立即发布。"""
+    if not deltas or not is_enabled():
+        return
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        buffer = _CommitBuffer()
+        buffer.add(deltas)
+        buffer.flush()
+        return
+
+    get_commit_buffer(COMMIT_BUFFER_ATTR, _CommitBuffer, using=using).add(deltas)
+
+
+# --- 读取端 (SSE) ---
+
+def _error(detail: str, status: int) -> JsonResponse:
+    return JsonResponse({'detail': detail}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def issue_stream_ticket(run_id: int, user) -> str:
+    """签发连接票据：签名中包含轮次、用户和时间戳，get_ticket_ttl() 秒后失效。"""
+    return signing.dumps({'run': run_id, 'user': user.pk}, salt=TICKET_SALT, compress=True)
+
+
+def _ticket_user(ticket: str, run_id: int):
+    """校验票据 (签名、有效期、轮次)，返回签发时的用户，无效时返回 None。"""
+    try:
+        payload = signing.loads(ticket, salt=TICKET_SALT, max_age=get_ticket_ttl())
+    except signing.BadSignature:  # 包括 SignatureExpired
+        return None
+    if not isinstance(payload, dict) or payload.get('run') != run_id:
+        return None
+    return get_user_model().objects.filter(pk=payload.get('user'), is_active=True).first()
+
+
+def _authenticate(request, run_id: int):
+    """
+    返回请求的用户 (未认证时为 None)。带 ?ticket= 时只按票据认证 (见 issue_stream_ticket)，
+    否则使用 DRF 的认证类 (会话 Cookie、Authorization 请求头)。
+    """
+    ticket = request.GET.get('ticket')
+    if ticket:
+        return _ticket_user(ticket, run_id)
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user and user.is_authenticated else None
+
+
+def _load_snapshot(run_id: int) -> Optional[dict]:
+    run = TestRun.objects.filter(pk=run_id).first()
+    if run is None:
+        return None
+    counts = run.status_counts()
+    counts['progress'] = run.progress
+    counts['fill_status'] = run.fill_status
+    counts['fill_progress'] = run.fill_progress
+    return {'run': run.id, 'counts': counts, 'ts': time.time()}
+
+
+async def _event_stream(run_id: int):
+    import redis.asyncio as aioredis
+
+    heartbeat = getattr(settings, 'RUN_PROGRESS_HEARTBEAT_SECONDS', 15)
+    deadline = time.monotonic() + getattr(settings, 'RUN_PROGRESS_STREAM_MAX_SECONDS', 300)
+    client = aioredis.Redis.from_url(get_redis_url())
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # 先订阅再读取快照：快照之后的变化一定会收到 (事件中的 counts 是绝对值，重复收到也不会累计出错)
+        await pubsub.subscribe(channel_name(run_id))
+        yield f"retry: {heartbeat * 1000}\n\n"
+        snapshot = await sync_to_async(_load_snapshot)(run_id)
+        yield _sse('snapshot', snapshot)
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(timeout=1.0)
+            if message and message.get('type') == 'message':
+                yield f"event: delta\ndata: {message['data'].decode('utf-8')}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+        yield _sse('reconnect', {'run': run_id})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Progress stream for TestRun {run_id} failed: {e}")
+        yield _sse('error', {'run': run_id, 'error': 'stream unavailable'})
+    finally:
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+        except Exception:
+            pass
+
+
+async def run_progress_stream(request, pk):
+    """GET /api/v1/executions/testruns/<pk>/events/：执行轮次进度的 SSE 推送 (需要连接票据或已登录的会话/请求头)。"""
+    if request.method != 'GET':
+        return _error('只支持 GET。', 405)
+    if not isinstance(request, ASGIRequest):
+        return _error('进度推送需要通过 ASGI (tcms.asgi:application) 部署。', 501)
+    if not is_enabled():
+        return _error('进度推送未启用 (RUN_PROGRESS_PUSH_ENABLED)。', 404)
+
+    user = await sync_to_async(_authenticate)(request, int(pk))
+    if user is None:
+        return _error('身份认证信息未提供或无效。', 401)
+    exists = await sync_to_async(TestRun.objects.filter(pk=pk).exists)()
+    if not exists:
+        return _error('未找到。', 404)
+
+    response = StreamingHttpResponse(_event_stream(int(pk)), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # 关闭 Nginx 等反向代理的响应缓冲，事件才能即时到达浏览器
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,169 @@
+# back/apps/executions/run_fill.py
+"""
+按测试计划为执行轮次生成 TestResult。
+
+不把计划中的用例版本加载到 Python：直接从计划的 M2M 关联表 INSERT ... SELECT 生成 untested 结果，
+ON CONFLICT DO NOTHING 依赖 (test_run, testcase_version) 唯一约束去重，同一事务内累加 untested_count。
+
+- 同步模式 (fill_run_results)：一条语句完成，在创建轮次的事务中执行。
+- 异步模式 (start_async_fill + fill_run_results_task)：轮次先以 fill_status='filling' 提交并立即返回，
+  后台按关联表 ID 范围分批插入，每批一个短事务；进度 = 已生成结果数 (计数器之和) / fill_total。
+  计划包含的用例数 >= settings.RUN_FILL_ASYNC_THRESHOLD 时创建接口自动使用异步模式。
+
+复制 (clone_run) 同理：新轮次的结果直接从源轮次的 TestResult INSERT ... SELECT，可只取失败/阻塞的结果，
+用于回归时重新执行，不经过计划也不在 Python 中逐行处理。
+"""
+import logging
+from typing import Iterable, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from .counters import apply_counter_deltas, new_deltas
+from .models import TestPlan, TestResult, TestRun
+
+logger = logging.getLogger(__name__)
+
+
+def get_async_threshold() -> int:
+    return getattr(settings, 'RUN_FILL_ASYNC_THRESHOLD', 5000)
+
+
+def get_fill_batch_size() -> int:
+    return getattr(settings, 'RUN_FILL_BATCH_SIZE', 10000)
+
+
+def _plan_versions_table() -> Tuple[str, str, str]:
+    """计划-用例版本 M2M 关联表的 (表名, 计划列, 版本列)"""
+    through = TestPlan.plan_case_versions.through
+    return (through._meta.db_table, through._meta.get_field('testplan').column,
+            through._meta.get_field('testcaseversion').column)
+
+
+def plan_version_count(plan_id: int) -> int:
+    return TestPlan.plan_case_versions.through.objects.filter(testplan_id=plan_id).count()
+
+
+def _insert_results(run_id: int, plan_id: int, id_range: Optional[Tuple[int, Optional[int]]] = None) -> int:
+    """从关联表插入 untested 结果 (可限定关联表 ID 范围 (low, high]，high 为 None 表示不设上界)，返回插入的行数并累加计数器。"""
+    table, plan_column, version_column = _plan_versions_table()
+    quote = connection.ops.quote_name
+    sql = (
+        f"INSERT INTO {quote(TestResult._meta.db_table)} (test_run_id, testcase_version_id, status) "
+        f"SELECT %s, m.{quote(version_column)}, %s FROM {quote(table)} AS m "
+        f"WHERE m.{quote(plan_column)} = %s"
+    )
+    params = [run_id, 'untested', plan_id]
+    if id_range is not None:
+        low, high = id_range
+        sql += " AND m.id > %s"
+        params.append(low)
+        if high is not None:
+            sql += " AND m.id <= %s"
+            params.append(high)
+    sql += " ON CONFLICT DO NOTHING"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        inserted = cursor.rowcount
+    if inserted:
+        deltas = new_deltas()
+        deltas[run_id]['untested'] += inserted
+        apply_counter_deltas(deltas)
+    return inserted
+
+
+def fill_run_results(test_run: TestRun) -> int:
+    """同步生成：一条 INSERT ... SELECT。调用方负责事务 (TestRunViewSet.create 已是原子操作)。"""
+    inserted = _insert_results(test_run.id, test_run.test_plan_id)
+    TestRun.objects.filter(pk=test_run.pk).update(fill_status='done', fill_total=inserted)
+    test_run.fill_status, test_run.fill_total = 'done', inserted
+    test_run.untested_count += inserted
+    return inserted
+
+
+def start_async_fill(test_run: TestRun, total: int) -> None:
+    """标记轮次为生成中，并在事务提交后派发后台任务。"""
+    from .tasks import fill_run_results_task
+
+    TestRun.objects.filter(pk=test_run.pk).update(fill_status='filling', fill_total=total)
+    test_run.fill_status, test_run.fill_total = 'filling', total
+    transaction.on_commit(lambda: fill_run_results_task.delay(test_run.pk))
+
+
+def fill_run_results_in_batches(run_id: int, batch_size: Optional[int] = None) -> int:
+    """
+    后台分批生成：按关联表 ID 范围每批插入 batch_size 行，每批一个事务，计数器随之更新，进度即时可见。
+    可重复执行 (已存在的结果被 ON CONFLICT 跳过)，中断后重新派发即可继续。
+    """
+    batch_size = batch_size or get_fill_batch_size()
+    test_run = TestRun.objects.only('id', 'test_plan_id').get(pk=run_id)
+    through = TestPlan.plan_case_versions.through
+    links = through.objects.filter(testplan_id=test_run.test_plan_id).order_by('id')
+
+    inserted = 0
+    low = 0
+    while True:
+        # 本批的 ID 上界：范围内恰好 batch_size 条关联 (最后一批不足)
+        bounds = list(links.filter(id__gt=low).values_list('id', flat=True)[batch_size - 1:batch_size])
+        high = bounds[0] if bounds else None
+        with transaction.atomic():
+            inserted += _insert_results(run_id, test_run.test_plan_id, (low, high))
+        if high is None:
+            break
+        low = high
+
+    TestRun.objects.filter(pk=run_id).update(fill_status='done')
+    logger.info(f"Filled {inserted} results for TestRun {run_id} from plan {test_run.test_plan_id}.")
+    return inserted
+
+
+# 重新执行 (rerun) 默认复制的结果状态
+RERUN_STATUSES = ('failed', 'blocked')
+
+
+def _copy_results(source_run_id: int, target_run_id: int, statuses: Optional[Iterable[str]] = None) -> int:
+    """把源轮次 (可按状态筛选) 的用例版本以 untested 状态复制到目标轮次，返回复制的行数并累加计数器。"""
+    quote = connection.ops.quote_name
+    table = quote(TestResult._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} (test_run_id, testcase_version_id, status) "
+        f"SELECT %s, r.testcase_version_id, %s FROM {table} AS r "
+        f"WHERE r.test_run_id = %s AND r.testcase_version_id IS NOT NULL"
+    )
+    params = [target_run_id, 'untested', source_run_id]
+    if statuses is not None:
+        statuses = list(statuses)
+        sql += f" AND r.status IN ({', '.join(['%s'] * len(statuses))})"
+        params += statuses
+    sql += " ON CONFLICT DO NOTHING"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        copied = cursor.rowcount
+    if copied:
+        deltas = new_deltas()
+        deltas[target_run_id]['untested'] += copied
+        apply_counter_deltas(deltas)
+    return copied
+
+
+def clone_run(source: TestRun, statuses: Optional[Iterable[str]] = None, **overrides) -> TestRun:
+    """
+    复制执行轮次：新轮次沿用源轮次的计划、项目、环境、负责人和描述 (可由 overrides 覆盖)，
+    结果为源轮次中 (状态属于 statuses 的) 用例版本，全部重置为 untested。
+    statuses 为 None 时复制全部结果；为空列表时不复制任何结果。
+    """
+    with transaction.atomic():
+        statuses = None if statuses is None else list(statuses)
+        test_run = TestRun.objects.create(
+            name=overrides.get('name') or f"{source.name} (副本)",
+            test_plan_id=source.test_plan_id,
+            project_id=source.project_id,
+            description=overrides.get('description', source.description),
+            environment=overrides['environment'] if 'environment' in overrides else source.environment,
+            assignee=overrides['assignee'] if 'assignee' in overrides else source.assignee,
+        )
+        copied = _copy_results(source.id, test_run.id, statuses) if statuses != [] else 0
+        TestRun.objects.filter(pk=test_run.pk).update(fill_total=copied)
+        test_run.fill_total = copied
+        test_run.untested_count += copied
+    logger.info(f"Cloned TestRun {source.id} -> {test_run.id} with {copied} results "
+                f"(statuses: {statuses if statuses is not None else 'all'}).")
+    return test_run
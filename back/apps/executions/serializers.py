@@ -3,8 +3,6 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 from .models import TestPlan, TestRun, TestResult, Environment
-# Import aggregation functions
-from django.db.models import Count, Q 
 import logging
 from apps.projects.models import Project
 
@@ -174,6 +172,12 @@ class TestPlanSerializer(serializers.ModelSerializer):
              
         return instance
 
+class TestPlanSimpleSerializer(serializers.ModelSerializer):
+    """测试计划简略信息 (执行轮次列表使用，不包含计划中的用例版本)"""
+    class Meta:
+        model = TestPlan
+        fields = ['id', 'name', 'status']
+
 class TestRunSerializer(serializers.ModelSerializer):
     """测试执行轮次序列化器 (用于列表和基础操作)"""
     # Read-only fields for display
@@ -184,6 +188,8 @@ class TestRunSerializer(serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     # Add progress field
     progress = serializers.SerializerMethodField(read_only=True)
+    total_count = serializers.IntegerField(read_only=True)
+    fill_progress = serializers.IntegerField(read_only=True)
 
     # Writable fields for relationships
     test_plan = serializers.PrimaryKeyRelatedField(
@@ -205,41 +211,21 @@ class TestRunSerializer(serializers.ModelSerializer):
             'assignee', 'assignee_info',
             'start_time', 'end_time',
             'progress',
+            'total_count', 'passed_count', 'failed_count', 'blocked_count', 'skipped_count', 'untested_count',
+            'fill_status', 'fill_total', 'fill_progress',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'project_info', 'test_plan_info', 'environment_info', 'assignee_info',
             'created_at', 'updated_at', 'status_display',
-            'progress'
+            'progress',
+            'passed_count', 'failed_count', 'blocked_count', 'skipped_count', 'untested_count',
+            'fill_status', 'fill_total'
         ]
 
     def get_progress(self, obj):
-        """计算单个 TestRun 的执行进度百分比"""
-        total = 0
-        executed = 0
-        try:
-            # 优先使用预取的结果 (如果可用)
-            if hasattr(obj, '_prefetched_objects_cache') and 'results' in obj._prefetched_objects_cache:
-                results_qs = obj._prefetched_objects_cache['results']
-                total = len(results_qs)
-                executed = sum(1 for r in results_qs if r.status != 'untested')
-                # logger.debug(f"使用预取数据计算进度 TestRun {obj.id}: total={total}, executed={executed}")
-            else:
-                # 如果没有预取，则回退查询 (效率较低)
-                # logger.warning(f"通过单独查询计算进度 TestRun {obj.id}。考虑 prefetch_related('results').")
-                summary = TestResult.objects.filter(test_run=obj).aggregate(
-                    total=Count('id'),
-                    executed=Count('id', filter=~Q(status='untested'))
-                )
-                total = summary.get('total', 0)
-                executed = summary.get('executed', 0)
-        except Exception as e:
-            logger.error(f"计算 TestRun {obj.id} 进度时出错: {e}", exc_info=True)
-            return 0 # 计算出错时返回 0
-
-        if total > 0:
-            return round((executed / total) * 100)
-        return 0
+        """执行进度百分比，读取 TestRun 上的结果计数器 (不查询 TestResult)"""
+        return obj.progress
 
     def create(self, validated_data):
         test_plan = validated_data.get('test_plan')
@@ -315,6 +301,49 @@ class TestResultSerializer(serializers.ModelSerializer):
 
         return super().update(instance, validated_data)
 
+class TestRunListSerializer(TestRunSerializer):
+    """
+    测试执行轮次列表序列化器：计划只输出简略信息，进度读取结果计数器。
+    配合 TestRunViewSet 的列表查询集，每页的查询数固定，与轮次中的结果数和计划中的用例数无关。
+    """
+    test_plan_info = TestPlanSimpleSerializer(source='test_plan', read_only=True)
+
+    class Meta(TestRunSerializer.Meta):
+        pass
+
+class TestResultCompactSerializer(serializers.ModelSerializer):
+    """
+    测试结果精简序列化器 (只读，扁平字段)，用于大执行轮次的结果浏览。
+    字段与 /testruns/{id}/results/ 和 /testresults/export/ 的流式输出一致 (见 streaming.RESULT_STREAM_COLUMNS)，
+    只需要 JOIN 用例版本和执行人，不加载步骤和创建人。
+    """
+    test_case = serializers.IntegerField(source='testcase_version.test_case_id', read_only=True, allow_null=True)
+    title = serializers.CharField(source='testcase_version.title', read_only=True, allow_null=True)
+    version_number = serializers.IntegerField(source='testcase_version.version_number', read_only=True, allow_null=True)
+    priority = serializers.CharField(source='testcase_version.priority', read_only=True, allow_null=True)
+    executor_username = serializers.CharField(source='executor.username', read_only=True, allow_null=True)
+
+    class Meta:
+        model = TestResult
+        fields = [
+            'id', 'test_run', 'testcase_version', 'test_case', 'title', 'version_number', 'priority',
+            'status', 'executor', 'executor_username',
+            'executed_at', 'duration', 'comments', 'bug_id'
+        ]
+        read_only_fields = fields
+
+class TestRunCopySerializer(serializers.Serializer):
+    """复制/重新执行执行轮次的请求参数 (未提供的字段沿用源轮次)"""
+    name = serializers.CharField(max_length=200, required=False, allow_blank=True)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    environment = serializers.PrimaryKeyRelatedField(queryset=Environment.objects.all(), allow_null=True, required=False)
+    assignee = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), allow_null=True, required=False)
+    statuses = serializers.ListField(
+        child=serializers.ChoiceField(choices=TestResult.STATUS_CHOICES),
+        required=False,
+        help_text=_('只复制这些状态的结果 (clone 默认全部，rerun 默认 failed 和 blocked)')
+    )
+
 # Define TestRunDetailSerializer inheriting from TestRunSerializer
 class TestRunDetailSerializer(TestRunSerializer):
     """测试执行轮次详细序列化器，不再包含结果列表 (结果将单独获取)"""
@@ -0,0 +1,26 @@
+from django.db.models import Count
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from apps.testcases.models import TestCaseVersion
+from .counters import apply_counter_deltas, new_deltas
+from .models import TestResult
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_delete, sender=TestCaseVersion)
+def release_result_counters(sender, instance: TestCaseVersion, using=None, **kwargs):
+    """
+    删除用例版本会级联删除其执行结果 (批量删除，不经过 TestResult.delete)。
+    在删除前按执行轮次扣减这些结果的计数，与级联删除处于同一事务。
+    """
+    deltas = new_deltas()
+    rows = TestResult.objects.using(using).filter(testcase_version_id=instance.pk).order_by() \
+        .values('test_run_id', 'status').annotate(n=Count('id'))
+    for row in rows:
+        deltas[row['test_run_id']][row['status']] -= row['n']
+    if deltas:
+        apply_counter_deltas(deltas, using=using)
+        logger.info(f"Released run counters for {sum(-sum(d.values()) for d in deltas.values())} results "
+                    f"of deleted TestCaseVersion {instance.pk}.")
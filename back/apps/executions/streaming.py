@@ -0,0 +1,79 @@
+# back/apps/executions/streaming.py
+"""
+执行结果的流式输出。
+
+大执行轮次 (上万条结果) 的结果列表不经过 ModelSerializer：用 values() 取扁平的列，
+通过服务端游标 (iterator) 分块读取，边读边写入 StreamingHttpResponse。
+内存占用与结果总数无关，也不会为每条结果实例化 TestResult / TestCaseVersion。
+输出格式为 JSON 数组 (json_array_stream) 或 NDJSON (ndjson_stream)，字段与 TestResultCompactSerializer 一致。
+"""
+import json
+from typing import Iterable, Iterator
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+# 输出字段 -> 查询列
+RESULT_STREAM_COLUMNS = {
+    'id': 'id',
+    'test_run': 'test_run_id',
+    'testcase_version': 'testcase_version_id',
+    'test_case': 'testcase_version__test_case_id',
+    'title': 'testcase_version__title',
+    'version_number': 'testcase_version__version_number',
+    'priority': 'testcase_version__priority',
+    'status': 'status',
+    'executor': 'executor_id',
+    'executor_username': 'executor__username',
+    'executed_at': 'executed_at',
+    'duration': 'duration',
+    'comments': 'comments',
+    'bug_id': 'bug_id',
+}
+STREAM_CHUNK_SIZE = 2000
+# 每次写出的行数，减少生成器切换和小块写入的开销
+ROWS_PER_WRITE = 200
+
+# 与 TestResultSerializer 相同的日期时间/时长格式
+_datetime_field = serializers.DateTimeField()
+_duration_field = serializers.DurationField()
+
+
+def result_rows(queryset: QuerySet, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[dict]:
+    """按 RESULT_STREAM_COLUMNS 投影结果，逐行产出可直接 JSON 序列化的字典。"""
+    columns = list(RESULT_STREAM_COLUMNS.values())
+    names = list(RESULT_STREAM_COLUMNS.keys())
+    for values in queryset.values_list(*columns).iterator(chunk_size=chunk_size):
+        row = dict(zip(names, values))
+        if row['executed_at'] is not None:
+            row['executed_at'] = _datetime_field.to_representation(row['executed_at'])
+        if row['duration'] is not None:
+            row['duration'] = _duration_field.to_representation(row['duration'])
+        yield row
+
+
+def json_array_stream(rows: Iterable[dict]) -> Iterator[str]:
+    """把行写成一个 JSON 数组，按 ROWS_PER_WRITE 行合并为一块输出。"""
+    yield '['
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(buffer) >= ROWS_PER_WRITE:
+            yield ('' if first else ',') + ','.join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield ('' if first else ',') + ','.join(buffer)
+    yield ']'
+
+
+def ndjson_stream(rows: Iterable[dict]) -> Iterator[str]:
+    """每行一个 JSON 对象 (application/x-ndjson)，按 ROWS_PER_WRITE 行合并为一块输出。"""
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(buffer) >= ROWS_PER_WRITE:
+            yield '\n'.join(buffer) + '\n'
+            buffer = []
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
@@ -0,0 +1,43 @@
+from celery import shared_task
+from django.db import DatabaseError
+from .counters import reconcile_run_counters
+from .models import TestRun
+from .run_fill import fill_run_results_in_batches
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=300)
+def reconcile_run_counters_task(self, fix: bool = True):
+    """
+    Celery 定时任务：核对并修正 TestRun 上的结果状态计数器 (由 CELERY_BEAT_SCHEDULE 触发)。
+    正常情况下计数器与结果写入在同一事务中维护，这里只兜底原生 SQL、queryset.delete() 等绕过维护逻辑的写入。
+    """
+    try:
+        mismatches = reconcile_run_counters(fix=fix)
+    except DatabaseError as e:
+        logger.error(f"Run counter reconciliation failed: {e}", exc_info=True)
+        raise self.retry(exc=e)
+    logger.info(f"Run counter reconciliation finished, {len(mismatches)} drifted runs.")
+    return {'drifted': len(mismatches), 'fixed': fix}
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def fill_run_results_task(self, run_id: int, batch_size: int = None):
+    """
+    Celery 任务：按测试计划分批为执行轮次生成结果 (TestRunViewSet.create 的异步模式)。
+    每批独立提交，重试或重新派发时已生成的结果会被跳过。
+    """
+    try:
+        return fill_run_results_in_batches(run_id, batch_size=batch_size)
+    except TestRun.DoesNotExist:
+        logger.warning(f"TestRun {run_id} was deleted before its results were filled.")
+        return 0
+    except DatabaseError as e:
+        if self.request.retries >= self.max_retries:
+            TestRun.objects.filter(pk=run_id).update(fill_status='failed')
+            logger.error(f"Filling results for TestRun {run_id} failed: {e}", exc_info=True)
+            raise
+        logger.warning(f"Filling results for TestRun {run_id} failed, retrying: {e}")
+        raise self.retry(exc=e)
@@ -1,3 +1,313 @@
-from django.test import TestCase
+import json
+from datetime import date
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from apps.projects.models import Project
+from apps.testcases.models import TestCase as Case, TestCaseVersion
+from .ingest import _create_missing_results
+from .models import TestPlan, TestResult, TestRun
+from .progress import _authenticate, record_counter_deltas
+from .run_fill import fill_run_results, fill_run_results_in_batches
 
-# Create your tests here.
+# 查询数回归测试：每个接口分别在小轮次和大轮次上执行，查询数必须相同且等于下面的预算。
+# 查询数随结果数增长说明查询计划退化 (例如逐行查询或又预取了结果)。
+# 测试在事务中运行，事务块 (transaction.atomic) 的 SAVEPOINT / RELEASE 也计入查询数。
+SMALL, LARGE = 3, 30
+
+
+@override_settings(RUN_PROGRESS_PUSH_ENABLED=False, RUN_FILL_ASYNC_THRESHOLD=1000)
+class QueryBudgetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='tester', password='x')
+        cls.project = Project.objects.create(name='Budget', code='BUDGET', creator=cls.user, start_date=date.today())
+        cls.plans = {size: cls.create_plan(size) for size in (SMALL, LARGE)}
+
+    @classmethod
+    def create_plan(cls, size):
+        cases = Case.objects.bulk_create(
+            [Case(title=f'case {size}-{index}', project=cls.project) for index in range(size)]
+        )
+        versions = TestCaseVersion.objects.bulk_create([
+            TestCaseVersion(test_case=case, project=cls.project, version_number=1, title=case.title, is_active=True)
+            for case in cases
+        ])
+        plan = TestPlan.objects.create(name=f'plan {size}', project=cls.project)
+        plan.plan_case_versions.set(versions)
+        return plan
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_run(self, size):
+        test_run = TestRun.objects.create(name=f'run {size}', test_plan=self.plans[size], project=self.project)
+        fill_run_results(test_run)
+        return test_run
+
+    def result_ids(self, test_run):
+        return list(TestResult.objects.filter(test_run=test_run).order_by('id').values_list('id', flat=True))
+
+    def consume(self, response):
+        if getattr(response, 'streaming', False):
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def assert_budget(self, queries, request):
+        """request(size) 在小轮次和大轮次上都只执行 queries 次查询，返回 {size: response}。"""
+        responses = {}
+        for size in (SMALL, LARGE):
+            with self.subTest(size=size), self.assertNumQueries(queries):
+                response = request(size)
+                self.consume(response)
+            self.assertLess(response.status_code, 300)
+            responses[size] = response
+        return responses
+
+
+class RunQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_create_fills_results_in_one_statement(self):
+        # 校验计划 + 计划与项目 + 插入轮次 + COUNT 关联表 + INSERT ... SELECT 结果 + 计数器 + fill_status
+        # + 响应中计划的用例版本，外加 SAVEPOINT / RELEASE
+        responses = self.assert_budget(11, lambda size: self.client.post(
+            '/api/v1/executions/testruns/', {'name': 'new run', 'test_plan': self.plans[size].id}, format='json'))
+        for size, response in responses.items():
+            self.assertEqual(response.status_code, 201)
+            test_run = TestRun.objects.get(pk=response.data['id'])
+            self.assertEqual((test_run.untested_count, test_run.fill_status), (size, 'done'))
+
+    def test_create_async_defers_fill(self):
+        # 与同步创建相同，但不插入结果，只标记 fill_status='filling' (任务在提交后派发)
+        responses = self.assert_budget(9, lambda size: self.client.post(
+            '/api/v1/executions/testruns/', {'name': 'new run', 'test_plan': self.plans[size].id, 'async': True},
+            format='json'))
+        for size, response in responses.items():
+            self.assertEqual(response.status_code, 202)
+            test_run = TestRun.objects.get(pk=response.data['id'])
+            self.assertEqual((test_run.total_count, test_run.fill_status, test_run.fill_total), (0, 'filling', size))
+
+    def test_fill_in_batches(self):
+        for size in (SMALL, LARGE):
+            test_run = TestRun.objects.create(name='async run', test_plan=self.plans[size], project=self.project,
+                                              fill_status='filling', fill_total=size)
+            # 读取轮次 + 本批 ID 上界，每批 INSERT ... SELECT + 计数器 (及 SAVEPOINT / RELEASE)，最后标记完成
+            with self.subTest(size=size), self.assertNumQueries(7):
+                self.assertEqual(fill_run_results_in_batches(test_run.id, batch_size=100), size)
+
+    def test_list(self):
+        for size in (SMALL, LARGE):
+            self.create_run(size)
+        # 校验 test_plan 筛选参数 + COUNT + 一页轮次 (JOIN 外键)，不查询结果
+        responses = self.assert_budget(3, lambda size: self.client.get('/api/v1/executions/testruns/',
+                                                                      {'test_plan': self.plans[size].id}))
+        self.assertEqual(responses[LARGE].data['count'], 1)
+
+    def test_summary(self):
+        runs = {size: self.create_run(size) for size in (SMALL, LARGE)}
+        # 只取轮次，计数读取计数器
+        self.assert_budget(1, lambda size: self.client.get(f'/api/v1/executions/testruns/{runs[size].id}/summary/'))
+        self.assertEqual(self.client.get(f'/api/v1/executions/testruns/{runs[LARGE].id}/summary/').data['total'], LARGE)
+
+    def test_results_stream(self):
+        runs = {size: self.create_run(size) for size in (SMALL, LARGE)}
+        # 轮次 + 一次服务端游标查询
+        self.assert_budget(2, lambda size: self.client.get(f'/api/v1/executions/testruns/{runs[size].id}/results/'))
+
+    def test_results_stream_total_count_follows_status_filter(self):
+        test_run = self.create_run(SMALL)
+        test_run.results.filter(id=test_run.results.order_by('id').values('id')[:1]).update(status='failed')
+        test_run.failed_count, test_run.untested_count = 1, SMALL - 1
+        test_run.save(update_fields=['failed_count', 'untested_count'])
+        url = f'/api/v1/executions/testruns/{test_run.id}/results/'
+        for query, expected in (('', SMALL), ('?status=failed', 1), ('?status=failed,untested,failed', SMALL),
+                                ('?status=passed', 0)):
+            response = self.client.get(url + query)
+            self.assertEqual(response['X-Total-Count'], str(expected))
+            self.assertEqual(len(json.loads(b''.join(response.streaming_content))), expected)
+
+    def test_ingest(self):
+        runs = {size: self.create_run(size) for size in (SMALL, LARGE)}
+        items = {
+            size: [{'id': result_id, 'status': 'passed', 'duration': 1.5} for result_id in self.result_ids(runs[size])]
+            for size in (SMALL, LARGE)
+        }
+        # 轮次 + 定位结果 + 锁定读取 + UPDATE ... FROM (VALUES ...) + 计数器，外加 SAVEPOINT / RELEASE
+        responses = self.assert_budget(7, lambda size: self.client.post(
+            f'/api/v1/executions/testruns/{runs[size].id}/ingest/', items[size], format='json'))
+        self.assertEqual({size: response.data['updated'] for size, response in responses.items()},
+                         {SMALL: SMALL, LARGE: LARGE})
+        runs[LARGE].refresh_from_db()
+        self.assertEqual((runs[LARGE].passed_count, runs[LARGE].untested_count), (LARGE, 0))
+
+
+class ResultQueryBudgetTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.runs = {size: self.create_run(size) for size in (SMALL, LARGE)}
+
+    def test_list_compact(self):
+        # 校验 test_run 筛选参数 + COUNT + 一页结果 (JOIN 用例版本和执行人)
+        self.assert_budget(3, lambda size: self.client.get(
+            '/api/v1/executions/testresults/', {'test_run': self.runs[size].id, 'compact': 1}))
+
+    def test_list_keyset(self):
+        # 校验 test_run 筛选参数 + 一页结果，不计算总数
+        responses = self.assert_budget(2, lambda size: self.client.get(
+            '/api/v1/executions/testresults/', {'test_run': self.runs[size].id, 'cursor': '', 'page_size': 2}))
+        next_page = responses[LARGE].data['next']
+        self.assertIsNotNone(next_page)
+        with self.assertNumQueries(2):
+            response = self.client.get(next_page)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_export(self):
+        # 校验 test_run 筛选参数 + 一次服务端游标查询
+        self.assert_budget(2, lambda size: self.client.get(
+            '/api/v1/executions/testresults/export/', {'test_run': self.runs[size].id}))
+
+    def test_bulk_update(self):
+        ids = {size: self.result_ids(self.runs[size]) for size in (SMALL, LARGE)}
+        # 一条 UPDATE (CTE 锁定并读取原状态) + 计数器，外加两层 SAVEPOINT / RELEASE
+        responses = self.assert_budget(6, lambda size: self.client.post(
+            '/api/v1/executions/testresults/bulk-update/', {'ids': ids[size], 'status': 'failed'}, format='json'))
+        self.assertEqual({size: len(response.data['updated_ids']) for size, response in responses.items()},
+                         {SMALL: SMALL, LARGE: LARGE})
+        self.runs[LARGE].refresh_from_db()
+        self.assertEqual((self.runs[LARGE].failed_count, self.runs[LARGE].untested_count), (LARGE, 0))
+
+
+class IngestTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_run = self.create_run(SMALL)
+
+    def ingest(self, body, **params):
+        url = f'/api/v1/executions/testruns/{self.test_run.id}/ingest/'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, body, content_type='application/json')
+
+    def test_out_of_range_duration_is_an_item_error(self):
+        ids = self.result_ids(self.test_run)
+        # 1e400 在 JSON 中解析为 inf，1e20 秒超出 timedelta 范围
+        body = (f'[{{"id": {ids[0]}, "status": "passed", "duration": 1e400}},'
+                f' {{"id": {ids[1]}, "status": "passed", "duration": 1e20}},'
+                f' {{"id": {ids[2]}, "status": "passed", "duration": "1e20"}}]')
+        response = self.ingest(body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['updated'], response.data['error_count']), (0, 3))
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1, 2])
+
+    def test_create_missing_counts_inserted_rows_only(self):
+        version = TestCaseVersion.objects.create(
+            test_case=Case.objects.create(title='extra', project=self.project), project=self.project,
+            version_number=1, title='extra', is_active=True)
+        response = self.ingest(f'[{{"testcase_version": {version.id}, "status": "failed"}}]', create_missing=1)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+
+        # 并发上报已补建同一结果时不再计数
+        stats = {'created': 0}
+        version_map = _create_missing_results(self.test_run, {version.id}, stats)
+        self.assertEqual(stats['created'], 0)
+        self.assertEqual(version_map, {version.id: TestResult.objects.get(
+            test_run=self.test_run, testcase_version=version).id})
+        self.test_run.refresh_from_db()
+        self.assertEqual((self.test_run.total_count, self.test_run.failed_count), (SMALL + 1, 1))
+
+
+class StreamTicketTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_run = self.create_run(SMALL)
+        self.other_run = self.create_run(LARGE)
+
+    def issue(self, test_run):
+        response = self.client.post(f'/api/v1/executions/testruns/{test_run.id}/events-ticket/')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def connect(self, test_run, **params):
+        request = RequestFactory().get(f'/api/v1/executions/testruns/{test_run.id}/events/', params)
+        return request, _authenticate(request, test_run.id)
+
+    def test_ticket_authenticates_its_run_only(self):
+        data = self.issue(self.test_run)
+        self.assertIn(f'/testruns/{self.test_run.id}/events/?ticket=', data['url'])
+        request, user = self.connect(self.test_run, ticket=data['ticket'])
+        self.assertEqual(user, self.user)
+        self.assertNotIn('HTTP_AUTHORIZATION', request.META)
+        self.assertIsNone(self.connect(self.other_run, ticket=data['ticket'])[1])
+
+    def test_ticket_expires(self):
+        ticket = self.issue(self.test_run)['ticket']
+        with mock.patch('django.core.signing.time.time', return_value=10 ** 10):
+            self.assertIsNone(self.connect(self.test_run, ticket=ticket)[1])
+
+    def test_rejects_tampered_ticket_and_query_token(self):
+        ticket = self.issue(self.test_run)['ticket']
+        self.assertIsNone(self.connect(self.test_run, ticket=ticket[:-2] + 'xx')[1])
+        self.assertIsNone(self.connect(self.test_run, token=ticket)[1])
+
+    def test_ticket_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post(f'/api/v1/executions/testruns/{self.test_run.id}/events-ticket/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(RUN_PROGRESS_PUSH_ENABLED=True)
+class CommitBufferTests(TestCase):
+    """同一事务内的计数变化合并为一次发布，回滚的保存点中的变化不发布。"""
+
+    def setUp(self):
+        patcher = mock.patch('apps.executions.progress.publish_progress')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_merges_within_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            record_counter_deltas({1: {'passed': 1}})
+            record_counter_deltas({1: {'passed': 2, 'failed': 1}})
+        self.assertEqual(len(callbacks), 1)
+        self.publish.assert_called_once_with({1: {'passed': 3, 'failed': 1}})
+
+    def test_rolled_back_savepoint_is_not_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_counter_deltas({1: {'passed': 1}})
+            try:
+                with transaction.atomic():
+                    record_counter_deltas({1: {'failed': 1}})
+                    raise ValueError
+            except ValueError:
+                pass
+            record_counter_deltas({1: {'blocked': 1}})
+        self.publish.assert_called_once_with({1: {'passed': 1, 'blocked': 1}})
+
+    def test_new_buffer_after_flush(self):
+        for deltas in ({1: {'passed': 1}}, {1: {'failed': 1}}):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_counter_deltas(deltas)
+        self.assertEqual([c.args[0] for c in self.publish.call_args_list], [{1: {'passed': 1}}, {1: {'failed': 1}}])
+
+
+@override_settings(RUN_PROGRESS_PUSH_ENABLED=True)
+class CommitBufferRollbackTests(TransactionTestCase):
+
+    def test_rolled_back_transaction_does_not_leak_buffer(self):
+        with mock.patch('apps.executions.progress.publish_progress') as publish:
+            try:
+                with transaction.atomic():
+                    record_counter_deltas({1: {'failed': 1}})
+                    raise ValueError
+            except ValueError:
+                pass
+            with transaction.atomic():
+                record_counter_deltas({1: {'passed': 1}})
+        publish.assert_called_once_with({1: {'passed': 1}})
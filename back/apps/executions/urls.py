@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import TestPlanViewSet, TestRunViewSet, TestResultViewSet
+from .progress import run_progress_stream
 
 router = DefaultRouter()
 router.register(r'testplans', TestPlanViewSet, basename='testplan')
@@ -9,6 +10,8 @@ router.register(r'testresults', TestResultViewSet, basename='testresult')
 # 以后可以添加 TestRunViewSet 等
 
 urlpatterns = [
+    # 执行进度的 SSE 推送 (异步视图，需 ASGI 部署)
+    path('testruns/<int:pk>/events/', run_progress_stream, name='testrun-events'),
     path('', include(router.urls)),
     # 未来可以添加其他非 ViewSet 的 URL
 ] 
\ No newline at end of file
@@ -2,21 +2,34 @@ from django.shortcuts import render
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import TestPlan, TestRun, TestResult
-from .serializers import TestPlanSerializer, TestRunSerializer, TestResultSerializer, TestRunDetailSerializer
+from .serializers import TestPlanSerializer, TestRunSerializer, TestResultSerializer, TestRunDetailSerializer, TestRunListSerializer, TestResultCompactSerializer, TestRunCopySerializer
+from .streaming import json_array_stream, ndjson_stream, result_rows
+from .pagination import ResultKeysetPagination, ResultPagination, keyset_ordered
+from .counters import COUNTER_FIELDS
+from .ingest import IngestError, bulk_transition_status, ingest_results
+from .parsers import JUnitTextXMLParser, JUnitXMLParser, NDJSONParser
+from .progress import get_ticket_ttl, issue_stream_ticket
+from .run_fill import RERUN_STATUSES, clone_run, fill_run_results, get_async_threshold, plan_version_count, start_async_fill
 # 导入权限类 (如果需要自定义)
 # from .permissions import IsProjectMemberOrAdmin # 示例
 # Import TestCase model
-from apps.testcases.models import TestCase 
+from apps.testcases.models import TestCase, TestCaseVersion
 # Import Response and status from rest_framework
 from rest_framework import status
 # Import transaction for atomicity
 from django.db import transaction
 # Import aggregation functions
-from django.db.models import Count, Q
-# Import timezone
-from django.utils import timezone
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from urllib.parse import urlencode
+import logging
+
+logger = logging.getLogger(__name__)
 
 class TestPlanViewSet(viewsets.ModelViewSet):
     """
@@ -69,15 +82,10 @@ class TestPlanViewSet(viewsets.ModelViewSet):
 class TestRunViewSet(viewsets.ModelViewSet):
     """测试执行轮次视图集"""
     # Use select_related for FKs on TestRun itself
-    # Use prefetch_related for reverse FKs (results) and nested relations
+    # 进度与 summary 读取 TestRun 上的结果计数器 (apps/executions/counters.py)，不再预取结果
+    # 各 action 的查询计划见 get_queryset，查询数由 tests.py 中的回归测试固定
     queryset = TestRun.objects.select_related(
         'test_plan', 'project', 'environment', 'assignee' # Removed 'created_by'
-    ).prefetch_related(
-        'results',                         
-        'results__testcase_version',       # <<< Use the correct model field name
-        'results__testcase_version__test_case', # <<< Use the correct model field name
-        'results__testcase_version__steps', # <<< Use the correct model field name
-        'results__executor'                
     ).all()
     # serializer_class = TestRunSerializer # Set dynamically by get_serializer_class
     permission_classes = [permissions.IsAuthenticated] 
@@ -87,11 +95,32 @@ class TestRunViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'status', 'created_at', 'start_time', 'end_time']
     ordering = ['-created_at']
 
+    def get_queryset(self):
+        """
+        按 action 选择查询计划：
+        - list: 只 JOIN 轮次自身的外键，计划输出简略信息，不加载结果和计划中的用例版本
+        - retrieve / 写操作: 额外 JOIN 计划的项目与创建人，并一次预取计划中的用例版本 (只取输出的列)
+        - summary / results / clone / rerun / ingest / events_ticket: 只取轮次本身，计数读取计数器，结果由 results 流式输出
+        """
+        if self.action in ('summary', 'results', 'clone', 'rerun', 'ingest', 'events_ticket'):
+            return TestRun.objects.all()
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset
+        return queryset.select_related('test_plan__project', 'test_plan__creator').prefetch_related(
+            Prefetch(
+                'test_plan__plan_case_versions',
+                queryset=TestCaseVersion.objects.only('id', 'version_number', 'is_active', 'priority', 'case_type')
+            )
+        )
+
     def get_serializer_class(self):
         """根据 action 返回不同的序列化器"""
         if self.action == 'retrieve':
             return TestRunDetailSerializer # Use detail serializer for retrieve action
-        # For list, create, update, partial_update, use the base serializer
+        if self.action == 'list':
+            return TestRunListSerializer
+        # For create, update, partial_update, use the base serializer
         return TestRunSerializer
     
     # Add get_serializer_context if not already present
@@ -107,40 +136,45 @@ class TestRunViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Manually fetch the TestPlan to get project and cases
+        # Manually fetch the TestPlan to get project (cases are not loaded, see run_fill.py)
+        plan = serializer.validated_data.get('test_plan')
         try:
-            test_plan = TestPlan.objects.select_related('project').prefetch_related('plan_case_versions').get(id=serializer.validated_data.get('test_plan').id)
+            test_plan = TestPlan.objects.select_related('project').get(id=plan.id if plan else None)
         except TestPlan.DoesNotExist:
             return Response({"test_plan": ["无效的测试计划 ID"]}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create the TestRun instance, ensuring the project is set correctly
         test_run = serializer.save(project=test_plan.project)
 
-        # Now, create TestResult objects based on the test plan case *versions*
-        testcase_versions_in_plan = test_plan.plan_case_versions.all()
-        results_to_create = []
-        # Use a set to track added *TestCaseVersion* IDs for de-duplication
-        added_case_version_ids = set()
-        for case_version in testcase_versions_in_plan:
-            if case_version.id not in added_case_version_ids:
-                results_to_create.append(
-                    TestResult(
-                        test_run=test_run,
-                        testcase_version=case_version, # Use the correct foreign key field
-                        status='untested' # Default status from the model
-                    )
-                )
-                added_case_version_ids.add(case_version.id)
-
-        # --- 恢复使用 bulk_create --- 
-        if results_to_create:
-            # Consider adding ignore_conflicts=True for extra safety, though de-duplication should handle it
-            TestResult.objects.bulk_create(results_to_create, ignore_conflicts=True)
-        # --- 结束恢复 ---
+        # 按计划中的用例版本生成 untested 结果：INSERT ... SELECT 关联表，不把用例版本加载到 Python。
+        # 大计划 (或请求指定 async) 时先返回轮次，后台分批生成，fill_status / fill_progress 展示进度
+        run_async = self.parse_async_flag(request)
+        if run_async is None:
+            total = plan_version_count(test_plan.id)
+            run_async = total >= get_async_threshold()
+        elif run_async:
+            total = plan_version_count(test_plan.id)
+
+        if run_async:
+            start_async_fill(test_run, total)
+            response_status = status.HTTP_202_ACCEPTED
+        else:
+            fill_run_results(test_run)
+            response_status = status.HTTP_201_CREATED
 
         # Return the serialized TestRun data
         headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        return Response(serializer.data, status=response_status, headers=headers)
+
+    @staticmethod
+    def parse_async_flag(request):
+        """请求体或查询参数中的 async：真/假，未提供时返回 None (按 RUN_FILL_ASYNC_THRESHOLD 自动选择)"""
+        value = request.data.get('async', request.query_params.get('async'))
+        if value is None or value == '':
+            return None
+        if isinstance(value, bool):
+            return value
+        return str(value).lower() in ('1', 'true', 'yes')
 
     # --- Add summary action here --- 
     @action(detail=True, methods=['get'], url_path='summary')
@@ -150,32 +184,109 @@ class TestRunViewSet(viewsets.ModelViewSet):
         """
         test_run = self.get_object() # 获取 TestRun 实例
 
-        # 使用聚合查询计算各种状态的数量
-        summary_data = TestResult.objects.filter(test_run=test_run).aggregate(
-            total=Count('id'),
-            passed=Count('id', filter=Q(status='passed')),
-            failed=Count('id', filter=Q(status='failed')),
-            blocked=Count('id', filter=Q(status='blocked')),
-            skipped=Count('id', filter=Q(status='skipped')),
-            untested=Count('id', filter=Q(status='untested')),
-            # 计算已执行的数量 (非 untested)
-            executed=Count('id', filter=~Q(status='untested'))
-        )
-
-        # 计算进度百分比
-        total = summary_data.get('total', 0)
-        executed = summary_data.get('executed', 0)
-        progress = 0
-        if total > 0:
-            progress = round((executed / total) * 100)
-
-        # 添加进度到摘要数据
-        summary_data['progress'] = progress
+        # 直接读取结果计数器，不再聚合 TestResult
+        summary_data = test_run.status_counts()
+        summary_data['progress'] = test_run.progress
+        # 异步生成结果期间，计数随生成进度增长
+        summary_data['fill_status'] = test_run.fill_status
+        summary_data['fill_progress'] = test_run.fill_progress
 
         return Response(summary_data)
 
     # --- End summary action --- 
 
+    @action(detail=True, methods=['post'], url_path='clone')
+    def clone(self, request, pk=None):
+        """
+        复制执行轮次：新轮次包含源轮次的全部结果 (或请求中 statuses 指定状态的结果)，均重置为未测试。
+        结果在数据库内以一条 INSERT ... SELECT 复制，不经过 Python。
+        """
+        return self.copy_run(request, default_statuses=None)
+
+    @action(detail=True, methods=['post'], url_path='rerun')
+    def rerun(self, request, pk=None):
+        """重新执行失败项：新轮次只包含源轮次中失败和阻塞 (或 statuses 指定状态) 的结果。"""
+        return self.copy_run(request, default_statuses=list(RERUN_STATUSES))
+
+    def copy_run(self, request, default_statuses):
+        source = self.get_object()
+        serializer = TestRunCopySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = dict(serializer.validated_data)
+        statuses = options.pop('statuses', default_statuses)
+        test_run = clone_run(source, statuses=statuses, **options)
+        # 响应使用列表序列化器：计划只输出简略信息，不加载计划中的用例版本
+        data = TestRunListSerializer(test_run, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], url_path='ingest',
+            parser_classes=[JSONParser, NDJSONParser, JUnitXMLParser, JUnitTextXMLParser])
+    def ingest(self, request, pk=None):
+        """
+        自动化测试批量上报结果。请求体可以是:
+        - JSON: 条目列表，或 {"results": [...], "create_missing": false}
+        - NDJSON (application/x-ndjson): 每行一个条目
+        - JUnit XML (application/xml 或 text/xml)
+        条目字段: id / testcase_version / title (定位结果，三选一)、status、duration (秒)、comments、bug_id、executed_at。
+        查询参数 create_missing=1 时，为轮次中没有的用例版本 (同一项目内) 补建结果。字段语义见 apps/executions/ingest.py。
+        """
+        test_run = self.get_object()
+        data = request.data
+        create_missing = str(request.query_params.get('create_missing', '')).lower() in ('1', 'true')
+        if isinstance(data, dict):
+            create_missing = create_missing or data.get('create_missing') in (True, '1', 'true')
+            data = data.get('results')
+        try:
+            stats = ingest_results(test_run, data, executor=request.user, create_missing=create_missing)
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='results')
+    def results(self, request, pk=None):
+        """
+        流式输出执行轮次的全部结果 (JSON 数组，扁平字段，按 ID 排序)。
+        可选查询参数 status 按结果状态筛选 (可用逗号分隔多个状态)。
+        响应头 X-Total-Count 为本次输出的结果数，取自轮次上的计数器 (筛选时为所选状态的计数之和)。
+        结果通过服务端游标分块读取，内存占用与结果数量无关；分页浏览请使用 /testresults/?test_run=。
+        """
+        # 不经过 filter_queryset：查询参数 status 指结果状态而不是轮次状态
+        test_run = get_object_or_404(self.get_queryset(), pk=pk)
+        self.check_object_permissions(request, test_run)
+
+        results = TestResult.objects.filter(test_run=test_run).order_by('id')
+        total = test_run.total_count
+        status_param = request.query_params.get('status')
+        if status_param:
+            statuses = [value for value in status_param.split(',') if value]
+            valid_statuses = {choice[0] for choice in TestResult.STATUS_CHOICES}
+            invalid = [value for value in statuses if value not in valid_statuses]
+            if invalid:
+                return Response({"error": f"无效的状态: {', '.join(invalid)}。有效选项为: {', '.join(valid_statuses)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            results = results.filter(status__in=statuses)
+            total = sum(getattr(test_run, COUNTER_FIELDS[value]) for value in set(statuses))
+
+        response = StreamingHttpResponse(json_array_stream(result_rows(results)),
+                                         content_type='application/json; charset=utf-8')
+        response['X-Total-Count'] = str(total)
+        return response
+
+    @action(detail=True, methods=['post'], url_path='events-ticket')
+    def events_ticket(self, request, pk=None):
+        """
+        为进度推送 (/testruns/{id}/events/) 签发连接票据。浏览器的 EventSource 不能设置请求头，
+        以 ?ticket= 连接即可；票据只对该轮次有效，expires_in 秒后失效，每次 (重新) 连接前重新获取。
+        """
+        test_run = self.get_object()
+        ticket = issue_stream_ticket(test_run.pk, request.user)
+        url = request.build_absolute_uri(reverse('testrun-events', kwargs={'pk': test_run.pk}))
+        return Response({
+            "ticket": ticket,
+            "expires_in": get_ticket_ttl(),
+            "url": f"{url}?{urlencode({'ticket': ticket})}",
+        }, status=status.HTTP_201_CREATED)
+
     # --- TODO: Add actions for managing testcases in a run --- 
     # Example: @action(detail=True, methods=['post'])
     # def add_cases(self, request, pk=None): ...
@@ -203,6 +314,46 @@ class TestResultViewSet(viewsets.ModelViewSet):
     search_fields = ['testcase_version__title', 'comments', 'bug_id']
     ordering_fields = ['executed_at', 'status']
     ordering = ['-executed_at']
+    # 带 cursor 参数时按 (test_run, executed_at, id) 键集分页，否则为页码分页 (见 pagination.py)
+    pagination_class = ResultPagination
+
+    def use_compact(self):
+        """列表在键集分页模式或 ?compact=1 时使用精简序列化器；导出始终是精简字段"""
+        if self.action == 'export':
+            return True
+        if self.action != 'list':
+            return False
+        params = self.request.query_params
+        return params.get('compact') in ('1', 'true') or ResultKeysetPagination.cursor_query_param in params
+
+    def get_queryset(self):
+        if self.use_compact():
+            return TestResult.objects.select_related('testcase_version', 'executor').only(
+                'id', 'test_run_id', 'status', 'executed_at', 'duration', 'comments', 'bug_id',
+                'testcase_version__id', 'testcase_version__test_case_id', 'testcase_version__title',
+                'testcase_version__version_number', 'testcase_version__priority',
+                'executor__id', 'executor__username',
+            )
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.use_compact():
+            return TestResultCompactSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        """
+        以 NDJSON 流式导出筛选后的结果 (支持与列表相同的筛选参数，例如 ?test_run=1&status=failed)。
+        按 (test_run, executed_at, id) 排序，通过服务端游标分块读取，内存占用与结果数量无关。
+        """
+        queryset = keyset_ordered(self.filter_queryset(TestResult.objects.all()))
+        response = StreamingHttpResponse(ndjson_stream(result_rows(queryset)),
+                                         content_type='application/x-ndjson; charset=utf-8')
+        run_id = request.query_params.get('test_run')
+        filename = f"testrun-{run_id}-results.ndjson" if run_id and run_id.isdigit() else "testresults.ndjson"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
     @action(detail=False, methods=['post'], url_path='bulk-update')
     @transaction.atomic # 确保操作的原子性
@@ -214,6 +365,7 @@ class TestResultViewSet(viewsets.ModelViewSet):
         - status: 目标状态字符串。
         - (可选) comments: 要批量设置的备注。
         - (可选) bug_id: 要批量设置的 Bug ID。
+        响应中 updated_ids 为实际更新的结果 ID，missing_ids 为不存在的 ID。
         """
         ids = request.data.get('ids')
         new_status = request.data.get('status')
@@ -237,56 +389,26 @@ class TestResultViewSet(viewsets.ModelViewSet):
         except (ValueError, TypeError):
              return Response({"error": "参数 'ids' 列表必须只包含有效的整数 ID。"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # --- 获取需要更新的对象 --- 
-        # 注意：这里不过滤 test_run，允许跨 run 更新？或者应该加过滤？
-        # 考虑到 API 路径是 /testresults/bulk-update/，不过滤似乎更通用。
+        # --- 执行更新 ---
+        # 注意：这里不过滤 test_run，允许跨 run 更新。
         # 如果需要限制在某个 run 内，前端调用时需要确保 ids 都来自同一个 run。
-        queryset = self.get_queryset().filter(id__in=valid_ids)
-        
-        # 检查是否有无效的 ID (请求的 ID 数量和实际找到的是否一致)
-        if queryset.count() != len(valid_ids):
-             found_ids = set(queryset.values_list('id', flat=True))
-             missing_ids = set(valid_ids) - found_ids
-             # 记录警告，但继续执行
-             print(f"Warning: Bulk update requested for IDs {valid_ids}, but missing IDs: {list(missing_ids)}")
-
-        # --- 准备更新数据 --- 
-        update_data = {'status': new_status}
-        current_time = timezone.now()
-        executor = request.user if request.user.is_authenticated else None
-        
-        if new_comments is not None:
-            update_data['comments'] = new_comments
-        if new_bug_id is not None:
-            update_data['bug_id'] = new_bug_id
-            
-        # --- 处理自动字段 (executor 和 executed_at) ---
-        final_statuses = ['passed', 'failed', 'skipped', 'blocked']
-        results_to_update_auto_fields = []
-        if executor:
-             # 获取那些状态从未测试变为其他，或者从非最终变为最终，并且当前 executor 为空的 ID
-             results_needing_auto_update = queryset.filter(
-                 (Q(status='untested') & ~Q(status=new_status)) | 
-                 (~Q(status__in=final_statuses) & Q(status=new_status) & Q(status__in=final_statuses))
-             ).filter(executor__isnull=True).values_list('id', flat=True)
-             
-             results_to_update_auto_fields = list(results_needing_auto_update)
-
-        # --- 执行更新 --- 
-        # 1. 先批量更新主要字段 (status, comments, bug_id)
-        updated_count = queryset.update(**update_data)
-        
-        # 2. 再单独更新需要自动设置 executor 和 executed_at 的记录
-        auto_update_count = 0
-        if results_to_update_auto_fields: 
-             auto_update_count = TestResult.objects.filter(id__in=results_to_update_auto_fields).update(
-                 executor=executor, 
-                 executed_at=current_time
-             )
-        
+        # 单条 UPDATE 完成状态修改、executor/executed_at 的条件设置和计数器维护 (见 ingest.bulk_transition_status)
+        outcome = bulk_transition_status(
+            valid_ids, new_status,
+            executor=request.user,
+            comments=new_comments,
+            bug_id=new_bug_id,
+        )
+        updated_ids = outcome['updated_ids']
+        missing_ids = sorted(set(valid_ids) - set(updated_ids))
+        if missing_ids:
+            logger.warning(f"Bulk update requested for {len(valid_ids)} results, missing IDs: {missing_ids[:50]}")
+
         return Response({
-            "message": f"成功更新了 {updated_count} 条记录。",
-            "auto_fields_updated": auto_update_count
+            "message": f"成功更新了 {len(updated_ids)} 条记录。",
+            "updated_ids": updated_ids,
+            "missing_ids": missing_ids,
+            "auto_fields_updated": len(outcome['stamped_ids'])
         }, status=status.HTTP_200_OK)
 
     # --- TODO: Override create/update or remove write methods --- 
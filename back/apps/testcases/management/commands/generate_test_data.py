@@ -214,6 +214,7 @@ class Command(BaseCommand):
 
                 version = TestCaseVersion(
                     test_case=test_case,
+                    project_id=test_case.project_id, # bulk_create 不调用 save()，需要显式设置冗余项目
                     version_number=version_number,
                     title=title_variation,
                     precondition=precondition_variation,
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("testcases", "0005_create_vector_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="embedding_updated_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, null=True, verbose_name="向量更新时间"
+            ),
+        ),
+    ]
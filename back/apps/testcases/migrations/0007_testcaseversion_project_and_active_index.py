@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import pgvector.django.indexes
+
+
+def backfill_version_project(apps, schema_editor):
+    """用一条 UPDATE ... FROM 把 test_case.project_id 回填到已有版本。"""
+    TestCaseVersion = apps.get_model("testcases", "TestCaseVersion")
+    TestCase = apps.get_model("testcases", "TestCase")
+    schema_editor.execute(
+        f"UPDATE {TestCaseVersion._meta.db_table} AS v "
+        f"SET project_id = c.project_id "
+        f"FROM {TestCase._meta.db_table} AS c "
+        f"WHERE v.test_case_id = c.id AND v.project_id IS NULL"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("projects", "0001_initial"),
+        ("testcases", "0006_testcaseversion_embedding_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="project",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="testcase_versions",
+                to="projects.project",
+                verbose_name="所属项目",
+            ),
+        ),
+        migrations.RunPython(backfill_version_project, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="testcaseversion",
+            index=pgvector.django.indexes.HnswIndex(
+                condition=models.Q(("is_active", True)),
+                ef_construction=64,
+                fields=["embedding"],
+                m=16,
+                name="tcversion_emb_active_hnsw_idx",
+                opclasses=["vector_cosine_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testcaseversion",
+            index=models.Index(
+                fields=["project", "is_active"], name="tcversion_proj_active_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("testcases", "0007_testcaseversion_project_and_active_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="text_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=64,
+                null=True,
+                verbose_name="文本哈希",
+            ),
+        ),
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="text_minhash",
+            field=models.BinaryField(
+                blank=True, null=True, verbose_name="文本 MinHash 签名"
+            ),
+        ),
+    ]
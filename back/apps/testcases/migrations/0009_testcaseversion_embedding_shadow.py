@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 12:41
+
+from django.db import migrations, models
+import pgvector.django.vector
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("testcases", "0008_testcaseversion_text_signature"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="embedding_shadow",
+            field=pgvector.django.vector.VectorField(
+                blank=True, dimensions=768, null=True, verbose_name="影子语义向量"
+            ),
+        ),
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="embedding_shadow_model_version",
+            field=models.CharField(
+                blank=True, max_length=100, null=True, verbose_name="影子向量模型版本"
+            ),
+        ),
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="embedding_shadow_updated_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="影子向量对应的内容时间"
+            ),
+        ),
+    ]
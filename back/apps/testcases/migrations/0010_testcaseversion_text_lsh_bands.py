@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-17 13:08
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+def backfill_lsh_bands(apps, schema_editor):
+    """由已保存的 MinHash 签名计算 LSH 分段键 (签名长度不符的版本留给 compute_text_signatures 重算)。"""
+    from apps.analysis.shingles import lsh_band_keys, signature_from_bytes
+
+    TestCaseVersion = apps.get_model("testcases", "TestCaseVersion")
+    queryset = TestCaseVersion.objects.filter(text_minhash__isnull=False).only("id", "text_minhash").order_by("id")
+    batch = []
+    for version in queryset.iterator(chunk_size=2000):
+        signature = signature_from_bytes(version.text_minhash)
+        if signature is None:
+            continue
+        version.text_lsh_bands = lsh_band_keys(signature)
+        batch.append(version)
+        if len(batch) >= 2000:
+            TestCaseVersion.objects.bulk_update(batch, ["text_lsh_bands"])
+            batch = []
+    if batch:
+        TestCaseVersion.objects.bulk_update(batch, ["text_lsh_bands"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("testcases", "0009_testcaseversion_embedding_shadow"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseversion",
+            name="text_lsh_bands",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(),
+                blank=True,
+                null=True,
+                size=None,
+                verbose_name="文本 LSH 分段键",
+            ),
+        ),
+        migrations.RunPython(backfill_lsh_bands, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="testcaseversion",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["text_lsh_bands"], name="tcversion_lsh_bands_gin_idx"
+            ),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from pgvector.django import VectorField, HnswIndex # 导入 VectorField 和 HnswIndex
 
 # Ensure the Project model path is correct based on your app structure
@@ -116,6 +118,23 @@ class TestCase(models.Model):
         verbose_name_plural = verbose_name
         ordering = ['-updated_at']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的项目，用例移动到其他项目时据此同步各版本冗余的 project
+        instance._loaded_project_id = instance.__dict__.get('project_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded_project_id = getattr(self, '_loaded_project_id', None)
+        if loaded_project_id is None or loaded_project_id == self.project_id:
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                self.versions.exclude(project_id=self.project_id).update(project_id=self.project_id)
+        self._loaded_project_id = self.project_id
+
     def __str__(self):
         project_name = self.project.name if self.project else "未分配项目"
         return f"[{project_name}] {self.title}"
@@ -151,6 +170,15 @@ class TestCaseVersion(models.Model):
         related_name='versions',
         verbose_name=_('原始测试用例')
     )
+    # 冗余存储所属项目 (= test_case.project)，使项目内向量检索无需 JOIN，并可建立按项目的部分 HNSW 索引
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        related_name='testcase_versions',
+        null=True,
+        blank=True,
+        verbose_name=_('所属项目')
+    )
     version_number = models.PositiveIntegerField(verbose_name=_('版本号')) # Simple incrementing number per TestCase
     # Or: version_name = models.CharField(max_length=100, verbose_name=_('版本名称/标签')) # More descriptive
 
@@ -190,6 +218,51 @@ class TestCaseVersion(models.Model):
         blank=True,
         verbose_name="嵌入模型版本" # 记录生成此向量的模型信息
     )
+    embedding_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name="向量更新时间" # 增量重复检测据此找出上次扫描之后新生成/变化的向量
+    )
+    # 影子向量：模型迁移期间写入新模型的向量，切换时与上面三列整体互换 (apps.analysis.model_migration)
+    embedding_shadow = VectorField(
+        dimensions=768,
+        null=True,
+        blank=True,
+        verbose_name="影子语义向量"
+    )
+    embedding_shadow_model_version = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        verbose_name="影子向量模型版本"
+    )
+    embedding_shadow_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="影子向量对应的内容时间" # 读取文本的时间，早于 embedding_updated_at 说明内容已变化
+    )
+    # 规范化文本的哈希与 MinHash 签名 (apps.analysis.shingles)，用于在向量检索之前
+    # 以线性时间找出完全相同/几乎相同的复制粘贴用例
+    text_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name="文本哈希"
+    )
+    text_minhash = models.BinaryField(
+        null=True,
+        blank=True,
+        verbose_name="文本 MinHash 签名"
+    )
+    # 签名各 LSH band 的 64 位键 (GIN 索引)：增量重复扫描只按变化版本的键查找候选，无需对整个项目分组
+    text_lsh_bands = ArrayField(
+        models.BigIntegerField(),
+        null=True,
+        blank=True,
+        verbose_name="文本 LSH 分段键"
+    )
     # --- 结束新增字段 ---
 
     # --- Version Metadata ---
@@ -219,10 +292,46 @@ class TestCaseVersion(models.Model):
                 m=16,
                 ef_construction=64,
                 opclasses=['vector_cosine_ops'],
-            )
+            ),
+            # 只包含活动版本的部分索引，供 active_only 检索使用 (图更小，无需后过滤)
+            HnswIndex(
+                name='tcversion_emb_active_hnsw_idx',
+                fields=['embedding'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops'],
+                condition=models.Q(is_active=True),
+            ),
+            models.Index(fields=['project', 'is_active'], name='tcversion_proj_active_idx'),
+            GinIndex(fields=['text_lsh_bands'], name='tcversion_lsh_bands_gin_idx'),
         ]
         # +++ 结束添加索引定义 +++
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_test_case_id = instance.__dict__.get('test_case_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # 保持冗余的 project 与 test_case.project 一致：已加载 test_case 时直接使用其 project_id，
+        # 否则只在新建、更换用例或 project 为空时查询一次。用例移动到其他项目时由 TestCase.save 同步已有版本。
+        update_fields = kwargs.get('update_fields')
+        if self.test_case_id is not None and (
+                update_fields is None or {'test_case', 'test_case_id', 'project', 'project_id'} & set(update_fields)):
+            if TestCaseVersion.test_case.is_cached(self):
+                project_id = self.test_case.project_id
+            elif self.project_id is None or self.test_case_id != getattr(self, '_loaded_test_case_id', None):
+                project_id = TestCase.objects.filter(pk=self.test_case_id).values_list('project_id', flat=True).first()
+            else:
+                project_id = self.project_id
+            if project_id != self.project_id:
+                self.project_id = project_id
+                if update_fields is not None:
+                    kwargs['update_fields'] = set(update_fields) | {'project'}
+        super().save(*args, **kwargs)
+        self._loaded_test_case_id = self.test_case_id
+
     def __str__(self):
         return f"{self.test_case.title} - v{self.version_number}"
 
@@ -86,6 +86,28 @@ class SimpleTestCaseVersionSerializer(serializers.ModelSerializer):
         fields = ['id', 'version_number', 'is_active', 'priority', 'case_type'] # Add priority and case_type
 # --- End simple version serializer ---
 
+class SemanticSearchResultSerializer(serializers.ModelSerializer):
+    """语义搜索结果 (活动版本 + 所属用例的基本信息)，需要查询集带有 distance 注解"""
+    test_case_title = serializers.ReadOnlyField(source='test_case.title')
+    test_case_status = serializers.ReadOnlyField(source='test_case.status')
+    module = serializers.ReadOnlyField(source='test_case.module_id')
+    module_name = serializers.StringRelatedField(source='test_case.module', read_only=True, allow_null=True)
+    similarity = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TestCaseVersion
+        fields = [
+            'id', 'test_case', 'test_case_title', 'test_case_status',
+            'project', 'module', 'module_name',
+            'version_number', 'title', 'priority', 'case_type',
+            'similarity',
+        ]
+        read_only_fields = fields
+
+    def get_similarity(self, obj):
+        # pgvector 返回的是余弦距离，转换为相似度
+        return round(1.0 - obj.distance, 4)
+
 class TestCaseSerializer(serializers.ModelSerializer):
     """测试用例序列化器 (基本信息，用于列表)"""
     module_name = serializers.StringRelatedField(source='module', read_only=True, allow_null=True)
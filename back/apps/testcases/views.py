@@ -13,9 +13,14 @@ from apps.projects.permissions import IsProjectMember, IsProjectManager
 from .serializers import (
     ModuleSerializer, TagSerializer, TestCaseSerializer, 
     TestCaseDetailSerializer, RecursiveModuleSerializer, TestCaseStepSerializer,
-    TestCaseVersionSerializer # Add TestCaseVersionSerializer import
+    TestCaseVersionSerializer, # Add TestCaseVersionSerializer import
+    SemanticSearchResultSerializer
 )
+from apps.analysis.utils import encode_query, QueryEncodingUnavailable, similar_versions_queryset, hnsw_search_params, ef_search_for_limit
+from apps.analysis.policy import ensure_version_embedding
+from django.conf import settings
 import logging
+import time
 
 logger = logging.getLogger(__name__) # 新增：获取 logger 实例
 
@@ -101,7 +106,7 @@ class TestCaseViewSet(viewsets.ModelViewSet):
 
     def get_permissions(self):
         """根据操作动态设置权限"""
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'semantic_search']:
             # 查看用例列表、详情，只需要是项目成员
             return [IsProjectMember()]
         # 创建、更新、删除用例，需要项目经理权限 (或根据需要调整为 Tester 等角色)
@@ -341,6 +346,80 @@ class TestCaseViewSet(viewsets.ModelViewSet):
         serializer = TestCaseVersionSerializer(version_queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='semantic-search')
+    def semantic_search(self, request):
+        """
+        语义搜索：把检索语句编码一次，通过 HNSW 索引返回最相似的 top-k 个活动版本。
+
+        查询参数:
+            q: 检索语句 (必填)。
+            project / module / status: 按项目、模块、用例状态过滤 (可选)。
+            limit: 返回数量，默认 SEMANTIC_SEARCH_DEFAULT_LIMIT，最大 SEMANTIC_SEARCH_MAX_LIMIT。
+            threshold: 最低相似度 (0~1，可选)。
+
+        延迟目标 (p95，见 settings 中的 SEMANTIC SEARCH 配置说明)：检索语句命中缓存时 < 50 ms，
+        需要编码时 < 150 ms。响应中的 took_ms 拆分了编码与检索耗时，便于监控。
+        Web 进程不加载模型，未命中缓存的检索语句由 embedding worker 编码；超时返回 503 (带 Retry-After)。
+        """
+        query = (request.query_params.get('q') or '').strip()
+        if not query:
+            return Response({'detail': '请提供检索语句 (参数 q)。'}, status=status.HTTP_400_BAD_REQUEST)
+        max_query_length = getattr(settings, 'SEMANTIC_SEARCH_MAX_QUERY_LENGTH', 512)
+        if len(query) > max_query_length:
+            return Response({'detail': f'检索语句过长，最多 {max_query_length} 个字符。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            project_id = int(request.query_params['project']) if request.query_params.get('project') else None
+            module_id = int(request.query_params['module']) if request.query_params.get('module') else None
+            limit = int(request.query_params.get('limit') or getattr(settings, 'SEMANTIC_SEARCH_DEFAULT_LIMIT', 10))
+            threshold = float(request.query_params['threshold']) if request.query_params.get('threshold') else None
+        except (ValueError, TypeError):
+            return Response({'detail': 'project、module、limit 或 threshold 参数无效。'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, getattr(settings, 'SEMANTIC_SEARCH_MAX_LIMIT', 50)))
+        if threshold is not None and not 0.0 <= threshold <= 1.0:
+            return Response({'detail': 'threshold 必须在 0 到 1 之间。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        case_status = request.query_params.get('status')
+        if case_status and case_status not in [choice[0] for choice in TestCase.STATUS_CHOICES]:
+            return Response({'detail': f'无效的状态值: {case_status}。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        start_time = time.perf_counter()
+        try:
+            query_embedding = encode_query(query)
+        except QueryEncodingUnavailable as e:
+            logger.warning(f"Semantic search query not encoded: {e}")
+            return Response({'detail': '检索语句正在由 embedding 服务编码，请稍后重试。'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '2'})
+        except Exception as e:
+            logger.error(f"Semantic search query encoding failed: {e}")
+            return Response({'detail': '语义搜索暂不可用 (embedding 服务不可用)。'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        encode_ms = (time.perf_counter() - start_time) * 1000
+
+        # 只检索活动版本 (命中部分索引 tcversion_emb_active_hnsw_idx)，项目过滤使用冗余的 project 列
+        queryset = similar_versions_queryset(
+            query_embedding,
+            similarity_threshold=threshold,
+            project_id=project_id,
+            active_only=True,
+        ).select_related('test_case', 'test_case__module')
+        if module_id is not None:
+            queryset = queryset.filter(test_case__module_id=module_id)
+        if case_status:
+            queryset = queryset.filter(test_case__status=case_status)
+
+        start_time = time.perf_counter()
+        with hnsw_search_params(ef_search=ef_search_for_limit(limit)):
+            results = list(queryset[:limit])
+        search_ms = (time.perf_counter() - start_time) * 1000
+
+        serializer = SemanticSearchResultSerializer(results, many=True, context=self.get_serializer_context())
+        return Response({
+            'query': query,
+            'count': len(results),
+            'took_ms': {'encode': round(encode_ms, 1), 'search': round(search_ms, 1)},
+            'results': serializer.data,
+        })
+
     @action(detail=False, methods=['post'], url_path='bulk-delete', permission_classes=[IsProjectManager]) # 添加权限控制
     def bulk_delete(self, request):
         """批量删除测试用例"""
@@ -456,3 +535,33 @@ class TestCaseVersionViewSet(viewsets.ReadOnlyModelViewSet):
         #     queryset = queryset.filter(test_case__project_id=project_id)
         
         return queryset
+
+    @action(detail=True, methods=['get'], url_path='similar')
+    def similar(self, request, pk=None):
+        """
+        查找与该版本相似的活动版本 (同一项目内)，用于重复评审。
+        历史版本在 EMBEDDING_POLICY=active 下没有预先生成的 embedding，这里按需生成；
+        无法在当前进程内生成时放入队列并返回 202，客户端稍后重试；轮询期间同一版本不会重复派发任务。
+        """
+        version = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or 10), getattr(settings, 'SEMANTIC_SEARCH_MAX_LIMIT', 50)))
+            threshold = float(request.query_params['threshold']) if request.query_params.get('threshold') else None
+        except (ValueError, TypeError):
+            return Response({'detail': 'limit 或 threshold 参数无效。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        embedding = ensure_version_embedding(version)
+        if embedding is None:
+            return Response({'detail': '该版本的 embedding 正在生成，请稍后重试。'}, status=status.HTTP_202_ACCEPTED)
+
+        queryset = similar_versions_queryset(
+            embedding,
+            similarity_threshold=threshold,
+            project_id=version.project_id,
+            active_only=True,
+            exclude_id=version.id,
+        ).select_related('test_case', 'test_case__module')
+        with hnsw_search_params(ef_search=ef_search_for_limit(limit)):
+            results = list(queryset[:limit])
+        serializer = SemanticSearchResultSerializer(results, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
@@ -5,6 +5,12 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+执行进度的 SSE 推送 (/api/v1/executions/testruns/<id>/events/，见 apps/executions/progress.py)
+是长连接的异步流式响应，需要用 ASGI 服务器加载本模块，例如:
+    uvicorn tcms.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+一个连接只占用事件循环中的一个协程，不占用工作进程/线程。其余接口在 ASGI 下照常工作。
+浏览器先 POST /api/v1/executions/testruns/<id>/events-ticket/ 获取短期票据，再以 ?ticket= 建立连接。
 """
 
 import os
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_init
 from django.conf import settings
 
 # 设置 Django settings 模块的环境变量
@@ -20,4 +21,17 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}') 
\ No newline at end of file
+    print(f'Request: {self.request!r}') 
+
+
+@worker_init.connect
+def enable_embedding_model_in_worker(**kwargs):
+    """
+    Celery worker 启动时 (prefork 模式下在 fork 子进程之前) 开启 embedding 模型。
+    预加载后，池中的子进程通过写时复制共享同一份模型权重，一台主机只保留一份。
+    通过 TCMS_EMBEDDING_WORKER=0 可以让不处理 embedding 的 worker 不加载模型。
+    """
+    if not getattr(settings, 'EMBEDDING_MODEL_IN_WORKER', True):
+        return
+    from apps.analysis.utils import enable_embedding_model
+    enable_embedding_model(preload=getattr(settings, 'EMBEDDING_MODEL_PRELOAD', True))
@@ -305,9 +305,38 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE # 使用 Django 的时区设置
 CELERY_ENABLE_UTC = True
 
-# （可选）任务路由、队列等高级配置可以后续添加
-# CELERY_TASK_ROUTES = {'apps.analysis.tasks.generate_single_embedding': {'queue': 'embeddings'}}
-# CELERY_TASK_DEFAULT_QUEUE = 'default'
+# 任务路由：分析任务使用专用队列 (队列划分与 worker 启动方式见 apps/analysis/queues.py)
+CELERY_TASK_ROUTES = {
+    'apps.analysis.tasks.generate_version_embedding_task': {'queue': 'embedding'},
+    'apps.analysis.tasks.flush_embedding_batch_task': {'queue': 'embedding'},
+    'apps.analysis.tasks.encode_query_task': {'queue': 'embedding'},
+    'apps.analysis.tasks.find_and_store_duplicate_pairs_task': {'queue': 'duplicates'},
+    'apps.analysis.tasks.find_duplicates_bulk_task': {'queue': 'duplicates'},
+    'apps.analysis.tasks.generate_embeddings_batch_task': {'queue': 'embedding_bulk'},
+    'apps.analysis.tasks.run_embedding_model_migration_task': {'queue': 'embedding_bulk'},
+}
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+# 定时任务 (需运行 celery -A tcms beat)
+CELERY_BEAT_SCHEDULE = {
+    # 核对 TestRun 结果计数器 (apps.executions.counters)，兜底绕过维护逻辑的写入
+    'reconcile-run-counters': {
+        'task': 'apps.executions.tasks.reconcile_run_counters_task',
+        'schedule': float(os.environ.get('TCMS_RUN_COUNTER_RECONCILE_INTERVAL', str(6 * 60 * 60))),
+    },
+    # 定时 flush embedding 微批缓冲区，找回 worker 崩溃时遗留在处理中集合的版本 (apps.analysis.batching)
+    'flush-embedding-micro-batch': {
+        'task': 'apps.analysis.tasks.flush_embedding_batch_task',
+        'schedule': float(os.environ.get('TCMS_EMBEDDING_MICRO_BATCH_RECOVERY_INTERVAL', '300')),
+    },
+}
+# Redis 传输的任务优先级：0 最高，9 最低 (交互式 embedding 为 0，回填为 9)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+# 每个 worker 进程只预取一个任务，避免大批量任务被提前取走后挡住高优先级任务
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
 # （可选）结果过期时间 (例如，1天)
 # CELERY_RESULT_EXPIRES = timedelta(days=1)
@@ -315,3 +344,134 @@ CELERY_ENABLE_UTC = True
 # （可选）确保任务在失败时不会无限重试 (设置默认重试策略)
 # CELERY_TASK_DEFAULT_RETRY_DELAY = 3  # 默认重试延迟3秒
 # CELERY_TASK_MAX_RETRIES = 3          # 默认最大重试次数
+
+# ==============================================================================
+# EMBEDDING MODEL SETTINGS
+# ==============================================================================
+# 模型按需加载，且只有开启的进程才会加载 (见 apps.analysis.utils.get_embedding_model)。
+# Web 进程和普通管理命令默认不加载模型。
+EMBEDDING_MODEL_AUTOLOAD = os.environ.get('TCMS_EMBEDDING_AUTOLOAD', '0') == '1'
+# Celery worker 是否开启模型 (不处理 embedding 任务的 worker 可设为 0)
+EMBEDDING_MODEL_IN_WORKER = os.environ.get('TCMS_EMBEDDING_WORKER', '1') == '1'
+# 是否在 worker 主进程 fork 之前预加载模型，使池内子进程写时复制共享模型权重
+EMBEDDING_MODEL_PRELOAD = os.environ.get('TCMS_EMBEDDING_PRELOAD', '1') == '1'
+
+# Embedding 生成策略 (apps.analysis.policy)：
+#   active - 只为活动版本主动生成 embedding，历史版本按需生成，版本停用时回收向量
+#   all    - 所有版本都生成 embedding (旧行为)
+EMBEDDING_POLICY = os.environ.get('TCMS_EMBEDDING_POLICY', 'active')
+# 按需为历史版本生成的向量保留的小时数：reclaim_embeddings 全量回收时跳过这段时间内生成的向量
+EMBEDDING_ON_DEMAND_TTL_HOURS = int(os.environ.get('TCMS_EMBEDDING_ON_DEMAND_TTL_HOURS', '168'))
+# 同一版本的按需生成任务在该窗口 (秒) 内只派发一次，客户端轮询 /similar/ 不会重复派发
+EMBEDDING_ON_DEMAND_DEDUPE_SECONDS = int(os.environ.get('TCMS_EMBEDDING_ON_DEMAND_DEDUPE_SECONDS', '60'))
+
+# 推理后端 (apps.analysis.backends)：sentence_transformers (PyTorch，默认) 或 onnx (ONNX Runtime，CPU 更快，
+# 需要安装 onnxruntime 和 tokenizers，并先执行 export_onnx_model 准备模型文件)
+EMBEDDING_BACKEND = os.environ.get('TCMS_EMBEDDING_BACKEND', 'sentence_transformers')
+# 使用 int8 动态量化模型 (export_onnx_model --quantize)。量化向量的 embedding_model_version 带 "+onnx-int8" 后缀
+EMBEDDING_ONNX_QUANTIZED = os.environ.get('TCMS_EMBEDDING_ONNX_INT8', '0') == '1'
+EMBEDDING_ONNX_MODEL_DIR = os.environ.get('TCMS_EMBEDDING_ONNX_MODEL_DIR') or None  # 默认 BASE_DIR/models/<模型名>
+EMBEDDING_ONNX_THREADS = int(os.environ.get('TCMS_EMBEDDING_ONNX_THREADS', '0'))  # 0 表示由 ONNX Runtime 决定
+EMBEDDING_MAX_SEQ_LENGTH = 128  # 与该模型在 sentence-transformers 中的 max_seq_length 一致
+# 以上为默认模型；通过 migrate_embedding_model 切换后以数据库中的迁移记录为准。
+# 各进程每隔该秒数重新读取一次生效的模型，切换后最多延迟这么久跟进。
+EMBEDDING_MODEL_SPEC_TTL = int(os.environ.get('TCMS_EMBEDDING_MODEL_SPEC_TTL', '10'))
+
+# --- Embedding 微批处理 (apps.analysis.batching) ---
+# 单版本 embedding 请求先进入 Redis 缓冲区，达到批大小或窗口到期后合并为一次 encode
+EMBEDDING_MICRO_BATCH_ENABLED = os.environ.get('TCMS_EMBEDDING_MICRO_BATCH', '1') == '1'
+EMBEDDING_MICRO_BATCH_SIZE = int(os.environ.get('TCMS_EMBEDDING_MICRO_BATCH_SIZE', '64'))
+EMBEDDING_MICRO_BATCH_WINDOW_MS = int(os.environ.get('TCMS_EMBEDDING_MICRO_BATCH_WINDOW_MS', '2000'))
+# 取出后超过该秒数仍未写回 (例如 worker 崩溃) 的版本会被放回待处理集合
+EMBEDDING_MICRO_BATCH_PROCESSING_TIMEOUT = int(os.environ.get('TCMS_EMBEDDING_MICRO_BATCH_PROCESSING_TIMEOUT', '600'))
+# 缓冲区使用的 Redis，默认复用 CELERY_BROKER_URL
+EMBEDDING_MICRO_BATCH_REDIS_URL = os.environ.get('TCMS_EMBEDDING_MICRO_BATCH_REDIS_URL') or None
+
+# --- 队列背压 (apps.analysis.queues) ---
+# 生产者派发前检查目标队列深度，超过上限时等待 (单位：消息数，0 表示不限制)
+EMBEDDING_BULK_MAX_QUEUE_DEPTH = int(os.environ.get('TCMS_EMBEDDING_BULK_MAX_QUEUE_DEPTH', '20'))
+DUPLICATES_MAX_QUEUE_DEPTH = int(os.environ.get('TCMS_DUPLICATES_MAX_QUEUE_DEPTH', '500'))
+
+# --- 增量重复扫描 (apps.analysis.duplicates) ---
+# 水位线 = 上一次完成扫描的开始时间减去该余量 (秒)，覆盖扫描开始时尚未提交的 embedding 写入；应大于写入事务的最长耗时
+DUPLICATE_SCAN_WATERMARK_MARGIN_SECONDS = int(os.environ.get('TCMS_DUPLICATE_SCAN_WATERMARK_MARGIN_SECONDS', '300'))
+
+# --- 重复用例簇 (apps.analysis.clusters) ---
+# 相似度不低于该阈值且未被忽略的配对才会把两个版本连进同一个簇。
+# 簇按连通分量计算 (单链接)，阈值过低时不相似的版本可能经由中间版本串成大簇。
+DUPLICATE_CLUSTER_THRESHOLD = float(os.environ.get('TCMS_DUPLICATE_CLUSTER_THRESHOLD', '0.90'))
+
+# --- 文本 shingle 预过滤 (apps.analysis.shingles) ---
+# 重复扫描在向量检索之前用 MinHash/LSH 找出完全相同/几乎相同的版本，每组只让代表版本进入向量检索。
+# 修改 SHINGLE_SIZE 或 MINHASH_PERMUTATIONS 后需执行 manage.py compute_text_signatures --force。
+SHINGLE_PREFILTER_ENABLED = os.environ.get('TCMS_SHINGLE_PREFILTER_ENABLED', '1') == '1'
+# 字符 k-gram 的长度
+SHINGLE_SIZE = int(os.environ.get('TCMS_SHINGLE_SIZE', '5'))
+# 签名长度与 LSH 分段数：64 = 8 段 × 8 行，估计 Jaccard 约 0.77 以上的版本对才会落入同一桶
+MINHASH_PERMUTATIONS = int(os.environ.get('TCMS_MINHASH_PERMUTATIONS', '64'))
+MINHASH_LSH_BANDS = int(os.environ.get('TCMS_MINHASH_LSH_BANDS', '8'))
+# 同桶版本的签名估计 Jaccard 相似度达到该值才视为近重复
+SHINGLE_PREFILTER_JACCARD = float(os.environ.get('TCMS_SHINGLE_PREFILTER_JACCARD', '0.9'))
+
+# --- Embedding 内容哈希缓存 (apps.analysis.embedding_cache) ---
+# 以 (模型版本号 + 规范化文本) 的哈希为键缓存向量，文本未变化的版本不再调用模型
+EMBEDDING_CACHE_ENABLED = os.environ.get('TCMS_EMBEDDING_CACHE', '1') == '1'
+EMBEDDING_CACHE_DTYPE = 'float16'                 # 向量存储精度: float16 (约 1.5 KB/条) 或 float32
+EMBEDDING_CACHE_LOCAL_MAX_ENTRIES = 10000         # 进程内 LRU 容量
+EMBEDDING_CACHE_USE_REDIS = True                  # 是否启用 Redis 共享层 (与微批缓冲区共用连接)
+EMBEDDING_CACHE_SHARED_MAX_ENTRIES = 200000       # Redis 共享 LRU 容量
+
+# --- 向量检索 (pgvector HNSW) ---
+# 默认 hnsw.ef_search (pgvector 默认 40)；查询的 limit 更大时会自动取 limit
+VECTOR_SEARCH_EF_SEARCH = int(os.environ.get('TCMS_VECTOR_EF_SEARCH', '40'))
+# pgvector >= 0.8 支持的迭代扫描 ('strict_order' / 'relaxed_order')，过滤查询结果不足时继续扫描。
+# 旧版本 pgvector 不支持该参数，保持为 None
+VECTOR_SEARCH_ITERATIVE_SCAN = os.environ.get('TCMS_VECTOR_ITERATIVE_SCAN') or None
+# 检索使用的向量索引布局 (apps.analysis.utils.VECTOR_STORAGE_MODES)：
+#   float32 - 默认，embedding 列上的 HNSW 索引
+#   halfvec - embedding::halfvec 表达式索引，索引体积约减半，召回率基本不变
+#   binary  - binary_quantize(embedding) 的 bit 索引按汉明距离取候选，再用 float32 向量重排
+# 切换前先用 vector_indexes --create-quantized 建索引，并用 benchmark_vector_storage 核对召回率
+VECTOR_STORAGE_MODE = os.environ.get('TCMS_VECTOR_STORAGE', 'float32')
+# binary 模式下第一阶段取出的候选数量 (越大召回率越高，重排开销也越大)
+VECTOR_SEARCH_RERANK_CANDIDATES = int(os.environ.get('TCMS_VECTOR_RERANK_CANDIDATES', '200'))
+
+# ==============================================================================
+# TEST EXECUTION SETTINGS
+# ==============================================================================
+# 创建执行轮次时，计划包含的用例版本数达到该值则异步生成结果 (接口立即返回 202，
+# 轮次的 fill_status / fill_progress 展示进度)；请求中 async 参数可显式指定。见 apps/executions/run_fill.py
+RUN_FILL_ASYNC_THRESHOLD = int(os.environ.get('TCMS_RUN_FILL_ASYNC_THRESHOLD', '5000'))
+# 异步生成时每批 (每个事务) 插入的结果数
+RUN_FILL_BATCH_SIZE = int(os.environ.get('TCMS_RUN_FILL_BATCH_SIZE', '10000'))
+# 结果批量上报 (/testruns/{id}/ingest/，apps/executions/ingest.py)：单次请求的条目上限与每条 UPDATE 语句的行数
+RESULT_INGEST_MAX_ITEMS = int(os.environ.get('TCMS_RESULT_INGEST_MAX_ITEMS', '50000'))
+RESULT_INGEST_CHUNK_SIZE = int(os.environ.get('TCMS_RESULT_INGEST_CHUNK_SIZE', '2000'))
+
+# --- 执行进度实时推送 (SSE，apps.executions.progress) ---
+# 结果计数变化在事务提交后发布到 Redis，/testruns/<id>/events/ 转发给看板 (需 ASGI 部署)
+RUN_PROGRESS_PUSH_ENABLED = os.environ.get('TCMS_RUN_PROGRESS_PUSH', '1') == '1'
+# 发布/订阅使用的 Redis，默认复用 CELERY_BROKER_URL
+RUN_PROGRESS_REDIS_URL = os.environ.get('TCMS_RUN_PROGRESS_REDIS_URL') or None
+RUN_PROGRESS_HEARTBEAT_SECONDS = int(os.environ.get('TCMS_RUN_PROGRESS_HEARTBEAT_SECONDS', '15'))
+# 单个连接的最长时间，到期后通知客户端重连 (释放长期占用的连接)
+RUN_PROGRESS_STREAM_MAX_SECONDS = int(os.environ.get('TCMS_RUN_PROGRESS_STREAM_MAX_SECONDS', '300'))
+# /testruns/<id>/events-ticket/ 签发的连接票据的有效期 (只用于建立连接，连接建立后不再校验)
+RUN_PROGRESS_TICKET_TTL_SECONDS = int(os.environ.get('TCMS_RUN_PROGRESS_TICKET_TTL_SECONDS', '60'))
+
+# ==============================================================================
+# SEMANTIC SEARCH (/api/v1/testcases/semantic-search/)
+# ==============================================================================
+# 检索语句与版本文本共用 embedding 内容哈希缓存，重复的检索语句不再调用模型。
+# 延迟目标 (p95，单个项目 <= 100 万个活动版本，ef_search 40~100)：
+#   - 检索语句命中缓存: < 50 ms (仅 HNSW 检索 + 序列化)
+#   - 检索语句需要编码: < 150 ms (CPU 上单条短文本编码约 30~80 ms)
+# 可用 benchmark_vector_search 命令核对检索部分的 p95 与召回率；响应中的 took_ms 也给出了拆分耗时。
+# 是否允许 Web 进程在缓存未命中时加载 embedding 模型 (约 1 GB 内存/进程，不建议开启)。
+# 默认 0：未命中缓存的检索语句交给 embedding 队列的 worker 编码 (encode_query_task)，
+# Web 进程以一次 Redis BLPOP 等待 worker 的完成通知，超过 SEMANTIC_SEARCH_ENCODE_TIMEOUT_MS 返回 503。
+SEMANTIC_SEARCH_LOAD_MODEL = os.environ.get('TCMS_SEMANTIC_SEARCH_LOAD_MODEL', '0') == '1'
+SEMANTIC_SEARCH_ENCODE_TIMEOUT_MS = int(os.environ.get('TCMS_SEMANTIC_SEARCH_ENCODE_TIMEOUT_MS', '3000'))
+SEMANTIC_SEARCH_DEFAULT_LIMIT = 10
+SEMANTIC_SEARCH_MAX_LIMIT = 50
+SEMANTIC_SEARCH_MAX_QUERY_LENGTH = 512
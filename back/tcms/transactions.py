@@ -0,0 +1,50 @@
+# back/tcms/transactions.py
+"""
+事务提交后统一执行的合并缓冲区 (apps.analysis.batching 的 embedding 派发、apps.executions.progress 的进度推送)。
+
+同一事务内多次请求写入同一个缓冲区，事务提交后调用一次 buffer.flush()。缓冲区按当前保存点链
+(connection.savepoint_ids) 区分：在保存点内创建的缓冲区随保存点回滚一同作废，不会被外层继续使用。
+连接对象上只保存缓冲区的弱引用，强引用只在 on_commit 注册的回调中：事务 (或保存点) 回滚时 Django
+丢弃回调，缓冲区随之释放，下一次请求会创建新的缓冲区；flush 执行时先把缓冲区从连接上摘除。
+不读取 Django 保存回调的内部结构 (connection.run_on_commit)。
+"""
+import weakref
+from functools import partial
+from typing import Callable, Optional, TypeVar
+from django.db import transaction
+
+T = TypeVar('T')
+
+
+def get_commit_buffer(attr: str, factory: Callable[[], T], using: Optional[str] = None) -> T:
+    """
+    返回当前事务 (保存点) 的缓冲区；没有可用的缓冲区时以 factory() 创建，并注册提交后调用其 flush()。
+    只能在事务中 (connection.in_atomic_block) 调用，attr 是保存在连接对象上的属性名。
+    """
+    connection = transaction.get_connection(using)
+    buffers = getattr(connection, attr, None)
+    if buffers is None:
+        buffers = {}
+        setattr(connection, attr, buffers)
+
+    key = tuple(connection.savepoint_ids)
+    ref = buffers.get(key)
+    buffer = ref() if ref is not None else None
+    if buffer is None:
+        buffer = factory()
+        buffers[key] = weakref.ref(buffer, partial(_discard, buffers, key))
+        transaction.on_commit(partial(_flush, buffers, key, buffer), using=using)
+    return buffer
+
+
+def _discard(buffers: dict, key: tuple, ref: weakref.ref) -> None:
+    """缓冲区被释放 (回调随回滚丢弃) 时移除它的登记，不影响同一位置上更新的缓冲区。"""
+    if buffers.get(key) is ref:
+        del buffers[key]
+
+
+def _flush(buffers: dict, key: tuple, buffer) -> None:
+    ref = buffers.get(key)
+    if ref is not None and ref() is buffer:
+        del buffers[key]
+    buffer.flush()